@@ -1,11 +1,16 @@
-from flask import Flask
+from flask import Flask, g, request
 from config import Config
+import logging
+import time
 import os
 from flask_cors import CORS
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+
+    # Diagnostics go through logging; gunicorn or the host may already have configured handlers
+    logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     
     # Enable CORS
     CORS(app)
@@ -18,24 +23,30 @@ def create_app():
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         return response
 
-    # Print environment variables for debugging
-    print("\nEnvironment variables:")
-    print(f"MATHPIX_APP_ID: {app.config.get('MATHPIX_APP_ID', 'Not set')}")
-    
-    mathpix_key = app.config.get('MATHPIX_APP_KEY', '')
-    print(f"MATHPIX_APP_KEY: {mathpix_key[:10] + '...' if mathpix_key else 'Not set'}")
-    
-    google_key = app.config.get('GOOGLE_CLOUD_API_KEY', '')
-    print(f"GOOGLE_CLOUD_API_KEY: {google_key[:10] + '...' if google_key else 'Not set'}")
-    print(f"Full Google Cloud API Key length: {len(google_key) if google_key else 0}")
-    print(f"Environment variable directly: {os.getenv('GOOGLE_CLOUD_API_KEY')}")
+    # Request latency per endpoint for /metrics
+    from app.utils.instrumentation import record_request
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
 
-    # Ensure upload and reports directories exist
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs('reports', exist_ok=True)
+    @app.after_request
+    def record_request_time(response):
+        if 'request_start' in g:
+            record_request(request.endpoint or 'unmatched', response.status_code,
+                           time.perf_counter() - g.request_start)
+        return response
+
+    # Ensure the reports directory exists; uploads are processed in memory
+    os.makedirs(app.config['REPORT_FOLDER'], exist_ok=True)
 
     # Register blueprint
     from app.routes import main
     app.register_blueprint(main)
 
+    # Load the embedding model before the first request (in the gunicorn master when --preload is used)
+    if app.config['PRELOAD_EMBEDDING_MODEL']:
+        from app.similarity.model_registry import warmup
+        warmup(app.config['EMBEDDING_MODEL_NAME'], app.config['EMBEDDING_DEVICE'])
+
     return app 
\ No newline at end of file
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import logging
+import json
+import time
+import uuid
+import os
+import re
+from app.pipeline import run_comparison, PIPELINE_STAGES
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Jobs run on a pool inside the worker that accepted them, but their status and
+# results live in JOBS_FOLDER so any gunicorn worker can answer polling requests.
+_executor = None
+_executor_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+# Page callbacks of all OCR stages report progress; the status file is only
+# rewritten when overall progress moves by PROGRESS_MIN_STEP points or
+# PROGRESS_MIN_INTERVAL seconds have passed
+PROGRESS_MIN_STEP = 1.0
+PROGRESS_MIN_INTERVAL = 0.5
+
+_TERMINAL_STATUSES = ('completed', 'failed')
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.JOB_WORKERS, thread_name_prefix='job')
+        return _executor
+
+def _status_path(job_id):
+    return os.path.join(Config.JOBS_FOLDER, f'{job_id}.json')
+
+def _result_path(job_id):
+    return os.path.join(Config.JOBS_FOLDER, f'{job_id}.result.json')
+
+def _json_default(value):
+    # numpy scalars in anomaly statistics
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def _write_json(path, data):
+    """Write via a temp file and rename so readers never see a partial file"""
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, default=_json_default)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _overall_progress(stages):
+    return sum(stages.values()) / len(stages) if stages else 0.0
+
+def _update(job, **changes):
+    # The file is written under the lock, so writes land in the order the record changed
+    with _write_lock:
+        job.update(changes)
+        job['progress'] = _overall_progress(job['stages'])
+        job['updated_at'] = time.time()
+        _write_json(_status_path(job['id']), job)
+
+def _record_progress(job, stage, percent):
+    """Apply a stage progress callback, writing the status file unless throttled"""
+    with _write_lock:
+        # Page callbacks can arrive late, even after the job has finished; never
+        # move a stage backwards or overwrite a final status
+        if job['status'] in _TERMINAL_STATUSES:
+            return
+        job['stages'][stage] = max(job['stages'].get(stage, 0.0), round(percent, 1))
+        progress = _overall_progress(job['stages'])
+        now = time.time()
+        if (progress - job['progress'] < PROGRESS_MIN_STEP and now - job['updated_at'] < PROGRESS_MIN_INTERVAL
+                and percent < 100.0):
+            return
+        job['progress'] = progress
+        job['updated_at'] = now
+        _write_json(_status_path(job['id']), job)
+
+def _cleanup_expired():
+    """Remove job records older than JOB_TTL"""
+    cutoff = time.time() - Config.JOB_TTL
+    try:
+        names = os.listdir(Config.JOBS_FOLDER)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(Config.JOBS_FOLDER, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _run_job(job, filepaths, options):
+    _update(job, status='running', started_at=time.time())
+
+    def on_progress(stage, percent):
+        _record_progress(job, stage, percent)
+
+    try:
+        result = run_comparison(*filepaths, progress=on_progress, **options)
+        _write_json(_result_path(job['id']), result)
+        _update(job, status='completed', stages={stage: 100.0 for stage in job['stages']},
+                finished_at=time.time())
+    except Exception as e:
+        logger.exception("Error in comparison job %s: %s", job['id'], e)
+        _update(job, status='failed', error=str(e), error_status=getattr(e, 'status_code', 500),
+                finished_at=time.time())
+
+def submit_job(filepath1, filepath2, **options):
+    """
+    Queue a comparison of two PDFs and return its job id immediately.
+
+    The PDFs are InMemoryPDF uploads, held until the job has run.
+    options are passed to run_comparison.
+    """
+    os.makedirs(Config.JOBS_FOLDER, exist_ok=True)
+    _cleanup_expired()
+
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'stages': {stage: 0.0 for stage in PIPELINE_STAGES},
+        'created_at': time.time()
+    }
+    _update(job)
+    _get_executor().submit(_run_job, job, (filepath1, filepath2), options)
+    return job['id']
+
+def _valid_job_id(job_id):
+    # Job ids become file names; reject anything that is not one of ours
+    return re.fullmatch(r'[0-9a-f]{32}', job_id or '') is not None
+
+def get_job(job_id):
+    """Return the status record of a job, or None if it is unknown or expired"""
+    if not _valid_job_id(job_id):
+        return None
+    return _read_json(_status_path(job_id))
+
+def get_job_result(job_id):
+    """Return the comparison result of a completed job, or None"""
+    if not _valid_job_id(job_id):
+        return None
+    return _read_json(_result_path(job_id))
@@ -0,0 +1,525 @@
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+import threading
+import logging
+import time
+import numpy as np
+from pdf2image.exceptions import PDFPageCountError, PDFSyntaxError
+from app.similarity.text_similarity import embed_text, compute_embedded_text_similarity, pairwise_text_similarity
+from app.similarity.lexical_similarity import compute_lexical_similarity, pairwise_lexical_similarity
+from app.similarity.handwriting_similarity import (score_handwriting_features, pairwise_handwriting_similarity,
+                                                   detect_internal_anomalies)
+from app.utils.ocr_backends import extract_text, extract_handwriting, resolve_backends
+from app.utils.document_loader import load_document, source_name
+from app.utils.report_cache import register_report, report_url, report_urls
+from app.utils.report_generator import REPORT_FORMATS
+from app.similarity.embedding_index import get_index
+from app.utils import instrumentation
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Shared pool for comparison stages. Stages only ever wait on stages submitted
+# before them, so the FIFO queue cannot deadlock even when the pool is saturated.
+_executor = None
+_executor_lock = threading.Lock()
+
+# Corpus indexing runs on its own pool, which comparisons never wait for
+_index_executor = None
+
+# Stages reported by run_comparison, in roughly the order they start
+PIPELINE_STAGES = [
+    'render_document1', 'render_document2',
+    'text_ocr_document1', 'text_ocr_document2',
+    'handwriting_ocr_document1', 'handwriting_ocr_document2',
+    'embed_document1', 'embed_document2',
+    'lexical_similarity',
+    'handwriting_analysis', 'text_similarity', 'report'
+]
+
+# 'semantic': embedding model only; 'lexical': TF-IDF only, the model never runs;
+# 'hybrid': TF-IDF first, embedding only pairs at or above LEXICAL_PREFILTER_THRESHOLD
+TEXT_SIMILARITY_MODES = ('semantic', 'lexical', 'hybrid')
+
+class ComparisonError(Exception):
+    """The uploaded documents cannot be compared (reported to the client as a 400)"""
+    status_code = 400
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.PIPELINE_WORKERS,
+                thread_name_prefix='compare'
+            )
+        return _executor
+
+def _get_index_executor():
+    global _index_executor
+    with _executor_lock:
+        if _index_executor is None:
+            _index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index')
+        return _index_executor
+
+class StageRunner:
+    """
+    Runs pipeline stages on the shared pool and records their wall-clock duration in seconds.
+
+    If a progress callback is given it is called as progress(stage, percent)
+    when a stage starts, advances and finishes. The instrumented work done by
+    the stages (see app.utils.instrumentation) is collected in self.recorder.
+    """
+
+    def __init__(self, progress=None):
+        self.timings = {}
+        self.progress = progress
+        self.futures = []
+        self.recorder = instrumentation.Recorder()
+        self._lock = threading.Lock()
+
+    def report(self, name, percent):
+        if self.progress is not None:
+            self.progress(name, percent)
+
+    def page_progress(self, name):
+        """Callback for per-page extractors reporting progress(done, total)"""
+        return lambda done, total: self.report(name, 100.0 * done / total if total else 100.0)
+
+    def run(self, name, func, *args, **kwargs):
+        self.report(name, 0.0)
+        start = time.perf_counter()
+        try:
+            return instrumentation.bind_recorder(self.recorder, func)(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[name] = elapsed
+            instrumentation.record_pipeline_stage(name, elapsed)
+            self.report(name, 100.0)
+
+    def submit(self, name, func, *args):
+        """Run a stage on the pool; Future arguments are resolved (outside the stage timing) first"""
+        def task():
+            resolved = [arg.result() if isinstance(arg, Future) else arg for arg in args]
+            return self.run(name, func, *resolved)
+        future = _get_executor().submit(task)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """Block until every submitted stage has finished"""
+        wait(self.futures)
+
+    def detach(self, name, func, *args):
+        """Run a stage on the index pool without waiting for it; it is left out of timings and progress"""
+        def task():
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                instrumentation.record_pipeline_stage(name, time.perf_counter() - start)
+        return _get_index_executor().submit(task)
+
+def _embed_if_text(text):
+    return embed_text(text) if text else None
+
+def _lexical_if_text(text1, text2):
+    return compute_lexical_similarity(text1, text2) if text1 and text2 else None
+
+def _passes_prefilter(text_mode, lexical_similarity):
+    """
+    Whether pairs with these TF-IDF similarities get the (expensive) semantic score.
+
+    Works elementwise on arrays of similarities as well as on single scores.
+    """
+    passes = np.asarray(lexical_similarity) >= Config.LEXICAL_PREFILTER_THRESHOLD
+    if text_mode == 'semantic':
+        return np.ones_like(passes)
+    return passes & (text_mode == 'hybrid')
+
+def _embed_if_candidate(text, text_mode, lexical_similarity):
+    if lexical_similarity is None or not _passes_prefilter(text_mode, lexical_similarity):
+        return None
+    return _embed_if_text(text)
+
+def _score_texts(embedded1, embedded2, lexical_similarity):
+    """Semantic similarity when both texts were embedded, otherwise the lexical score"""
+    if embedded1 is not None and embedded2 is not None:
+        analysis = compute_embedded_text_similarity(embedded1, embedded2)
+        analysis['method'] = 'semantic'
+        return analysis
+    return {
+        'similarity_score': lexical_similarity,
+        'consistency_analysis': {'doc1': [], 'doc2': []},
+        'method': 'lexical'
+    }
+
+def _index_document(name, text, embedded, page_count):
+    """Add a processed document to the corpus index; indexing problems never fail a comparison"""
+    if not Config.EMBEDDING_INDEX_ENABLED or not embedded:
+        return None
+    try:
+        return get_index().add_document(name, text, embedded[1], page_count)
+    except Exception as e:
+        logger.exception("Error indexing document %s: %s", name, e)
+        return None
+
+def _load_document(source, dpi, fmt):
+    """Open a PDF; a file poppler rejects is reported to the client, without poppler's output"""
+    try:
+        return load_document(source, dpi, fmt)
+    except (PDFPageCountError, PDFSyntaxError) as e:
+        logger.warning("Could not read PDF %s: %s", source_name(source), e)
+        raise ComparisonError(f"Could not extract text from {source_name(source)}")
+
+def _check_backends(text_backends, handwriting_backends):
+    try:
+        resolve_backends(text_backends, 'text')
+        resolve_backends(handwriting_backends, 'handwriting')
+    except ValueError as e:
+        raise ComparisonError(str(e))
+
+def _check_text_mode(text_mode):
+    text_mode = text_mode or Config.TEXT_SIMILARITY_MODE
+    if text_mode not in TEXT_SIMILARITY_MODES:
+        raise ComparisonError(f"Unknown text similarity mode: {text_mode}")
+    return text_mode
+
+def _check_report_format(report_format):
+    report_format = report_format or Config.REPORT_FORMAT
+    if report_format not in REPORT_FORMATS:
+        raise ComparisonError(f"Unknown report format: {report_format}")
+    return report_format
+
+def run_comparison(filepath1, filepath2, weight_text=0.5, bypass_cache=False, dpi=None, fmt=None, progress=None,
+                   names=None, text_backends=None, handwriting_backends=None, text_mode=None,
+                   report_format=None, timing_breakdown=False):
+    """
+    Compare two PDFs, running independent stages concurrently.
+
+    Both documents are opened in parallel, then text and handwriting OCR for both
+    run at once, rasterizing pages in small ranges as the OCR workers reach them.
+    Each document is embedded as soon as its text is ready, and the handwriting
+    statistics run alongside the text similarity. Returns the /compare response
+    payload including per-stage timings.
+
+    The PDFs are paths or InMemoryPDF uploads.
+    progress(stage, percent), if given, receives per-stage progress (see PIPELINE_STAGES).
+    names are the original file names used when adding the documents to the corpus index.
+    text_backends/handwriting_backends override the configured OCR backend fallback order.
+    text_mode overrides TEXT_SIMILARITY_MODE (see TEXT_SIMILARITY_MODES).
+    report_format overrides REPORT_FORMAT for 'report_url' (see REPORT_FORMATS).
+    timing_breakdown adds per-stage wall/CPU time, memory and API traffic ('instrumentation').
+    """
+    runner = StageRunner(progress)
+    submit = runner.submit
+    start = time.perf_counter()
+    names = names or [source_name(filepath1), source_name(filepath2)]
+    _check_backends(text_backends, handwriting_backends)
+    text_mode = _check_text_mode(text_mode)
+    report_format = _check_report_format(report_format)
+
+    documents = []
+    try:
+        # Open each PDF once; text and handwriting extraction share the rendered pages
+        render1 = submit('render_document1', _load_document, filepath1, dpi, fmt)
+        render2 = submit('render_document2', _load_document, filepath2, dpi, fmt)
+        render_error = None
+        for future in (render1, render2):
+            try:
+                documents.append(future.result())
+            except Exception as e:
+                render_error = e
+        if render_error is not None:
+            raise render_error
+        document1, document2 = documents
+
+        # Text and handwriting OCR for both documents at once
+        text1 = submit('text_ocr_document1', extract_text, filepath1, document1, text_backends, bypass_cache,
+                       runner.page_progress('text_ocr_document1'))
+        text2 = submit('text_ocr_document2', extract_text, filepath2, document2, text_backends, bypass_cache,
+                       runner.page_progress('text_ocr_document2'))
+        features1 = submit('handwriting_ocr_document1', extract_handwriting, document1, handwriting_backends,
+                           bypass_cache, runner.page_progress('handwriting_ocr_document1'))
+        features2 = submit('handwriting_ocr_document2', extract_handwriting, document2, handwriting_backends,
+                           bypass_cache, runner.page_progress('handwriting_ocr_document2'))
+
+        # Embed each text as soon as its OCR finishes; outside semantic mode only once
+        # the pair passes the lexical pre-filter
+        lexical = None
+        if text_mode == 'semantic':
+            embedded1 = submit('embed_document1', _embed_if_text, text1)
+            embedded2 = submit('embed_document2', _embed_if_text, text2)
+        else:
+            lexical = submit('lexical_similarity', _lexical_if_text, text1, text2)
+            embedded1 = submit('embed_document1', _embed_if_candidate, text1, text_mode, lexical)
+            embedded2 = submit('embed_document2', _embed_if_candidate, text2, text_mode, lexical)
+
+        # Handwriting statistics overlap with the embedding work
+        handwriting = submit('handwriting_analysis', score_handwriting_features, features1, features2)
+
+        if not text1.result() or not text2.result():
+            raise ComparisonError('Could not extract text from one or both files')
+
+        lexical_similarity = None if lexical is None else lexical.result()
+        text_analysis = runner.run(
+            'text_similarity', _score_texts, embedded1.result(), embedded2.result(), lexical_similarity
+        )
+        text_similarity = text_analysis['similarity_score']
+
+        # Remember both documents for corpus-wide search after the response is sent
+        runner.detach('index_document1', _index_document, names[0], text1.result(), embedded1.result(),
+                      document1.page_count)
+        runner.detach('index_document2', _index_document, names[1], text2.result(), embedded2.result(),
+                      document2.page_count)
+        try:
+            handwriting_similarity, feature_scores, anomalies1, anomalies2, variations1, variations2 = handwriting.result()
+        except Exception as e:
+            raise Exception(f"Error computing handwriting similarity: {str(e)}")
+
+        # Calculate weighted similarity index
+        weight_handwriting = 1 - weight_text
+        similarity_index = (weight_text * text_similarity +
+                            weight_handwriting * handwriting_similarity)
+
+        # Store what the report is built from; each format is rendered when it is downloaded
+        report_id = runner.run(
+            'report', register_report, 'comparison',
+            text_similarity=text_similarity,
+            handwriting_similarity=handwriting_similarity,
+            similarity_index=similarity_index,
+            text1=text1.result(),
+            text2=text2.result(),
+            feature_scores=feature_scores,
+            anomalies1=anomalies1,
+            anomalies2=anomalies2,
+            variations1=variations1,
+            variations2=variations2
+        )
+    finally:
+        # Stages still running may be reading the pages; let them finish before releasing
+        runner.wait()
+        for document in documents:
+            document.close()
+
+    runner.timings['total'] = time.perf_counter() - start
+
+    result = {
+        'text_similarity': text_similarity,
+        'text_consistency': text_analysis['consistency_analysis'],
+        'text_similarity_method': text_analysis['method'],
+        'lexical_similarity': lexical_similarity,
+        'handwriting_similarity': handwriting_similarity,
+        'similarity_index': similarity_index,
+        'feature_scores': feature_scores,
+        'anomalies': {
+            'document1': anomalies1,
+            'document2': anomalies2
+        },
+        'variations': {
+            'document1': variations1,
+            'document2': variations2
+        },
+        'ocr_backends': {
+            'document1': {'text': text1.result().backend, 'handwriting': features1.result().backend},
+            'document2': {'text': text2.result().backend, 'handwriting': features2.result().backend}
+        },
+        'report_url': report_url(report_id, report_format),
+        'report_urls': report_urls(report_id),
+        'timings': runner.timings
+    }
+    if timing_breakdown:
+        result['instrumentation'] = runner.recorder.breakdown()
+    return result
+
+def _prefiltered_text_matrix(embedded, lexical_matrix, semantic_mask):
+    """Lexical similarities, replaced by semantic ones where semantic_mask holds and both texts are embedded"""
+    text_matrix = lexical_matrix.copy()
+    scored = [i for i, document in enumerate(embedded) if document is not None]
+    if scored:
+        block = np.ix_(scored, scored)
+        semantic = pairwise_text_similarity([embedded[i][1] for i in scored])
+        text_matrix[block] = np.where(semantic_mask[block], semantic, text_matrix[block])
+    return text_matrix
+
+def run_batch_comparison(filepaths, names=None, reference_index=None, weight_text=0.5, bypass_cache=False,
+                         dpi=None, fmt=None, progress=None, text_backends=None, handwriting_backends=None,
+                         text_mode=None, report_format=None, timing_breakdown=False):
+    """
+    Compare N PDFs: every pair, or the document at reference_index against all others.
+
+    Each document is rendered, OCR'd and embedded exactly once; the full text and
+    handwriting similarity matrices are then computed with vectorized operations.
+    Pairs are ranked by weighted similarity index and summarized in one report.
+
+    Outside semantic text_mode the TF-IDF matrix is computed first and only the
+    documents of pairs passing the lexical pre-filter are embedded; the other
+    pairs keep their lexical text similarity.
+    """
+    runner = StageRunner(progress)
+    start = time.perf_counter()
+    names = names or [source_name(filepath) for filepath in filepaths]
+    _check_backends(text_backends, handwriting_backends)
+    text_mode = _check_text_mode(text_mode)
+    report_format = _check_report_format(report_format)
+
+    # Same orientation as /compare: [i, j] scores document i's lines against document j
+    if reference_index is None:
+        pairs = [(i, j) for i in range(len(filepaths)) for j in range(i + 1, len(filepaths))]
+    else:
+        pairs = [(reference_index, j) for j in range(len(filepaths)) if j != reference_index]
+
+    documents = []
+    try:
+        # Render every PDF once, all in parallel
+        renders = [runner.submit(f'render_document{i+1}', _load_document, filepath, dpi, fmt)
+                   for i, filepath in enumerate(filepaths)]
+        render_error = None
+        for future in renders:
+            try:
+                documents.append(future.result())
+            except Exception as e:
+                render_error = e
+        if render_error is not None:
+            raise render_error
+
+        # OCR and embed every document once
+        text_futures = [runner.submit(f'text_ocr_document{i+1}', extract_text, filepath, document, text_backends,
+                                      bypass_cache, runner.page_progress(f'text_ocr_document{i+1}'))
+                        for i, (filepath, document) in enumerate(zip(filepaths, documents))]
+        feature_futures = [runner.submit(f'handwriting_ocr_document{i+1}', extract_handwriting, document,
+                                         handwriting_backends, bypass_cache,
+                                         runner.page_progress(f'handwriting_ocr_document{i+1}'))
+                           for i, document in enumerate(documents)]
+
+        def embed(indices, text_inputs):
+            futures = [None] * len(filepaths)
+            for i in indices:
+                futures[i] = runner.submit(f'embed_document{i+1}', _embed_if_text, text_inputs[i])
+            return futures
+
+        lexical_matrix = None
+        semantic_mask = np.ones((len(filepaths), len(filepaths)), dtype=bool)
+        if text_mode == 'semantic':
+            embedded_futures = embed(range(len(filepaths)), text_futures)
+
+        texts = [future.result() for future in text_futures]
+        missing = [names[i] for i, text in enumerate(texts) if not text]
+        if missing:
+            raise ComparisonError(f"Could not extract text from: {', '.join(missing)}")
+
+        if text_mode != 'semantic':
+            lexical_matrix = runner.run('lexical_similarity', pairwise_lexical_similarity, texts)
+            semantic_mask = _passes_prefilter(text_mode, lexical_matrix)
+            candidates = sorted({i for pair in pairs if semantic_mask[pair] for i in pair})
+            embedded_futures = embed(candidates, texts)
+
+        embedded = [None if future is None else future.result() for future in embedded_futures]
+        features = [future.result() for future in feature_futures]
+        page_counts = [document.page_count for document in documents]
+
+        # Remember the embedded documents for corpus-wide search after the response is sent
+        for i, document_embedded in enumerate(embedded):
+            if document_embedded is not None:
+                runner.detach(f'index_document{i+1}', _index_document, names[i], texts[i], document_embedded,
+                              page_counts[i])
+    finally:
+        # Stages still running may be reading the pages; let them finish before releasing
+        runner.wait()
+        for document in documents:
+            document.close()
+
+    if lexical_matrix is None:
+        text_matrix = runner.run('text_similarity', pairwise_text_similarity,
+                                 [embeddings for _, embeddings in embedded])
+    else:
+        text_matrix = runner.run('text_similarity', _prefiltered_text_matrix, embedded, lexical_matrix,
+                                 semantic_mask)
+    handwriting_matrix = runner.run('handwriting_similarity', pairwise_handwriting_similarity, features)
+    index_matrix = weight_text * text_matrix + (1 - weight_text) * handwriting_matrix
+
+    ranked_pairs = sorted(
+        [
+            {
+                'document1': names[i],
+                'document2': names[j],
+                'text_similarity': float(text_matrix[i, j]),
+                'text_similarity_method': 'semantic' if semantic_mask[i, j] else 'lexical',
+                'lexical_similarity': None if lexical_matrix is None else float(lexical_matrix[i, j]),
+                'handwriting_similarity': float(handwriting_matrix[i, j]),
+                'similarity_index': float(index_matrix[i, j])
+            }
+            for i, j in pairs
+        ],
+        key=lambda pair: pair['similarity_index'],
+        reverse=True
+    )
+
+    def summarize_documents():
+        summaries = []
+        for name, page_count, text, document_features in zip(names, page_counts, texts, features):
+            anomalies, variations = detect_internal_anomalies(document_features)
+            summaries.append({
+                'name': name,
+                'pages': page_count,
+                'anomaly_count': len(anomalies),
+                'variation_count': len(variations),
+                'ocr_backends': {'text': text.backend, 'handwriting': document_features.backend}
+            })
+        return summaries
+
+    document_summaries = runner.run('anomaly_detection', summarize_documents)
+    report_id = runner.run('report', register_report, 'batch', documents=document_summaries, pairs=ranked_pairs,
+                           reference=None if reference_index is None else names[reference_index])
+    runner.timings['total'] = time.perf_counter() - start
+
+    result = {
+        'documents': document_summaries,
+        'reference': None if reference_index is None else names[reference_index],
+        'pairs': ranked_pairs,
+        'text_similarity_matrix': np.round(text_matrix, 6).tolist(),
+        'handwriting_similarity_matrix': np.round(handwriting_matrix, 6).tolist(),
+        'report_url': report_url(report_id, report_format),
+        'report_urls': report_urls(report_id),
+        'timings': runner.timings
+    }
+    if timing_breakdown:
+        result['instrumentation'] = runner.recorder.breakdown()
+    return result
+
+def run_corpus_search(filepath, name=None, top_k=10, bypass_cache=False, dpi=None, fmt=None, text_backends=None,
+                      timing_breakdown=False):
+    """
+    Match one PDF against every document in the corpus index.
+
+    Only the text branch runs: render, text OCR and embedding. The upload is then
+    added to the index itself so later searches can find it.
+    """
+    runner = StageRunner()
+    start = time.perf_counter()
+    name = name or source_name(filepath)
+    _check_backends(text_backends, None)
+
+    document = runner.run('render_document', _load_document, filepath, dpi, fmt)
+    try:
+        text = runner.run('text_ocr_document', extract_text, filepath, document, text_backends, bypass_cache)
+        page_count = document.page_count
+    finally:
+        document.close()
+
+    if not text:
+        raise ComparisonError('Could not extract text from the file')
+
+    embedded = runner.run('embed_document', embed_text, text)
+    matches = runner.run('index_search', get_index().search, embedded[1], top_k, None, text)
+    runner.detach('index_document', _index_document, name, text, embedded, page_count)
+    runner.timings['total'] = time.perf_counter() - start
+
+    result = {
+        'document': name,
+        'matches': matches,
+        'timings': runner.timings
+    }
+    if timing_breakdown:
+        result['instrumentation'] = runner.recorder.breakdown()
+    return result
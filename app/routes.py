@@ -1,10 +1,21 @@
-from flask import Blueprint, render_template, request, jsonify, current_app
+from flask import Blueprint, render_template, request, jsonify, current_app, url_for, Response, send_file
 from werkzeug.utils import secure_filename
+import logging
 import os
-from app.similarity.text_similarity import compute_text_similarity
-from app.similarity.handwriting_similarity import compute_handwriting_similarity
-from app.utils.pdf_processor import extract_text_from_pdf, validate_pdf
-from app.utils.report_generator import generate_report
+from app.pipeline import run_comparison, run_batch_comparison, run_corpus_search, ComparisonError
+from app.jobs import submit_job, get_job, get_job_result
+from app.similarity.model_registry import get_model_metrics
+from app.similarity.embedding_index import get_index
+from app.similarity.embedding_cache import get_cache_stats as get_embedding_cache_stats
+from app.utils.pdf_processor import validate_pdf
+from app.utils.document_loader import InMemoryPDF
+from app.utils.ocr_cache import get_cache_stats
+from app.utils import report_cache
+from app.utils.report_generator import REPORT_FORMATS, MEDIA_TYPES
+from app.utils.image_preprocessing import get_preprocessing_stats
+from app.utils.instrumentation import render_prometheus
+
+logger = logging.getLogger(__name__)
 
 main = Blueprint('main', __name__)
 
@@ -17,6 +28,127 @@ def allowed_file(filename):
 def index():
     return render_template('index.html')
 
+@main.route('/metrics')
+def prometheus_metrics():
+    """Stage timings, API traffic, request latency and cache counters of this worker, in Prometheus text format"""
+    ocr_stats = get_cache_stats()
+    embedding_stats = get_embedding_cache_stats()
+    report_stats = report_cache.get_cache_stats()
+    extra = [
+        ('ocr_cache_events_total', 'OCR cache lookups and writes by outcome', 'counter',
+         [({'event': event}, ocr_stats[event]) for event in ('hits', 'misses', 'stores', 'evictions', 'bypassed')]),
+        ('embedding_cache_events_total', 'Embedding cache lookups and writes by outcome', 'counter',
+         [({'event': event}, embedding_stats[event])
+          for event in ('memory_hits', 'disk_hits', 'misses', 'stores', 'memory_evictions', 'disk_evictions')]),
+        ('embedding_cache_bytes', 'Embedding cache size by tier', 'gauge',
+         [({'tier': 'memory'}, embedding_stats['memory_bytes']),
+          ({'tier': 'disk'}, embedding_stats.get('disk_bytes', 0))]),
+        ('report_cache_events_total', 'Report registrations, downloads and evictions by outcome', 'counter',
+         [({'event': event}, report_stats[event]) for event in ('registered', 'hits', 'renders', 'misses', 'evictions')]),
+        ('report_cache_bytes', 'Size of the report folder', 'gauge', [({}, report_stats['bytes'])])
+    ]
+    return Response(render_prometheus(extra), mimetype='text/plain; version=0.0.4')
+
+@main.route('/metrics/models')
+def model_metrics():
+    return jsonify(get_model_metrics())
+
+@main.route('/metrics/ocr-cache')
+def ocr_cache_metrics():
+    return jsonify(get_cache_stats())
+
+@main.route('/metrics/embedding-cache')
+def embedding_cache_metrics():
+    return jsonify(get_embedding_cache_stats())
+
+@main.route('/metrics/preprocessing')
+def preprocessing_metrics():
+    return jsonify(get_preprocessing_stats())
+
+@main.route('/metrics/index')
+def index_metrics():
+    return jsonify(get_index().stats())
+
+@main.route('/metrics/report-cache')
+def report_cache_metrics():
+    return jsonify(report_cache.get_cache_stats())
+
+@main.route('/reports/<report_id>.<fmt>')
+def download_report(report_id, fmt):
+    """Stream a comparison report as JSON, HTML or PDF, rendering it on the first request"""
+    if not report_cache.valid_report_id(report_id) or fmt not in REPORT_FORMATS:
+        return jsonify({'error': 'Unknown report'}), 404
+    try:
+        path = report_cache.get_report(report_id, fmt)
+    except Exception as e:
+        logger.exception("Error rendering report %s: %s", report_id, e)
+        return jsonify({'error': 'Error generating report'}), 500
+    if path is None:
+        return jsonify({'error': 'Report is no longer available'}), 404
+
+    # The id is a hash of the report's content, so a downloaded copy never goes stale
+    response = send_file(os.path.abspath(path), mimetype=MEDIA_TYPES[fmt], download_name=f'similarity_report.{fmt}',
+                         conditional=True, etag=report_id, max_age=current_app.config['REPORT_HTTP_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+def _read_upload(file):
+    """
+    Read an uploaded file once into an InMemoryPDF.
+
+    Nothing is written to disk here. Werkzeug spools large uploads on its own,
+    and the pages are only written out, to a per-document scratch folder, when
+    poppler rasterizes them. Concurrent uploads with the same name cannot collide.
+    """
+    return InMemoryPDF(file.read(), secure_filename(file.filename))
+
+def _check_uploads(uploads):
+    """Return an error response if any upload is empty or not a PDF"""
+    if any(len(upload) == 0 for upload in uploads):
+        return jsonify({'error': 'One or both files are empty'}), 400
+
+    # Validate PDFs
+    if not all(validate_pdf(upload) for upload in uploads):
+        return jsonify({'error': 'Invalid or corrupted PDF file(s)'}), 400
+
+    return None
+
+def _weight_text():
+    """The text share of the similarity index; raises ComparisonError unless it is within [0, 1]"""
+    try:
+        weight_text = float(request.form.get('weight_text', 0.5))
+    except ValueError:
+        weight_text = None
+    # Also rejects nan
+    if weight_text is None or not 0.0 <= weight_text <= 1.0:
+        raise ComparisonError('weight_text must be a number between 0 and 1')
+    return weight_text
+
+def _comparison_options():
+    """
+    Comparison settings shared by /compare, /compare/batch, /search and /jobs
+
+    Raises ComparisonError for invalid values.
+    """
+    return {
+        # Skip the OCR cache when the client asks for fresh results
+        'bypass_cache': request.form.get('bypass_cache', 'false').lower() == 'true',
+        'weight_text': _weight_text(),
+        'dpi': current_app.config['RENDER_DPI'],
+        'fmt': current_app.config['RENDER_FORMAT'],
+        # Comma-separated OCR backends in fallback order, e.g. 'tesseract' or 'vision,tesseract'
+        'text_backends': request.form.get('text_backends') or None,
+        'handwriting_backends': request.form.get('handwriting_backends') or None,
+        # 'semantic', 'lexical' or 'hybrid'; defaults to TEXT_SIMILARITY_MODE
+        'text_mode': request.form.get('text_mode') or None,
+        # 'json', 'html' or 'pdf' for report_url; defaults to REPORT_FORMAT
+        'report_format': request.form.get('report_format') or None,
+        # Add per-stage wall/CPU time, memory and API traffic to the response
+        'timing_breakdown': request.form.get('timing_breakdown', 'false').lower() == 'true'
+    }
+
 @main.route('/compare', methods=['POST'])
 def compare_pdfs():
     if 'file1' not in request.files or 'file2' not in request.files:
@@ -25,97 +157,173 @@ def compare_pdfs():
     file1 = request.files['file1']
     file2 = request.files['file2']
     
-    print(f"Received files: {file1.filename} and {file2.filename}")
+    logger.info("Received files: %s and %s", file1.filename, file2.filename)
 
     # Validate files
     if not all(allowed_file(f.filename) for f in [file1, file2]):
         return jsonify({'error': 'Invalid file format. Only PDF files are allowed'}), 400
 
     try:
-        # Create upload directory if it doesn't exist
-        if not os.path.exists(current_app.config['UPLOAD_FOLDER']):
-            os.makedirs(current_app.config['UPLOAD_FOLDER'])
-
-        # Save files
-        filename1 = secure_filename(file1.filename)
-        filename2 = secure_filename(file2.filename)
-        
-        filepath1 = os.path.join(current_app.config['UPLOAD_FOLDER'], filename1)
-        filepath2 = os.path.join(current_app.config['UPLOAD_FOLDER'], filename2)
-        
-        file1.save(filepath1)
-        file2.save(filepath2)
-        print(f"Files saved to {filepath1} and {filepath2}")
-
-        # Basic file validation
-        if not os.path.exists(filepath1) or not os.path.exists(filepath2):
-            return jsonify({'error': 'Error saving files'}), 500
-
-        if os.path.getsize(filepath1) == 0 or os.path.getsize(filepath2) == 0:
-            return jsonify({'error': 'One or both files are empty'}), 400
-
-        # Validate PDFs
-        if not validate_pdf(filepath1) or not validate_pdf(filepath2):
-            return jsonify({'error': 'Invalid or corrupted PDF file(s)'}), 400
-
-        # Extract text using Mathpix
-        text1 = extract_text_from_pdf(filepath1)
-        text2 = extract_text_from_pdf(filepath2)
-        
-        if not text1 or not text2:
-            return jsonify({'error': 'Could not extract text from one or both files'}), 400
-
-        # Calculate similarities
-        text_analysis = compute_text_similarity(text1, text2)
-        text_similarity = text_analysis['similarity_score']
-        handwriting_similarity, feature_scores, anomalies1, anomalies2, variations1, variations2 = compute_handwriting_similarity(filepath1, filepath2)
-
-        # Calculate weighted similarity index
-        weight_text = float(request.form.get('weight_text', 0.5))
-        weight_handwriting = 1 - weight_text
-        
-        similarity_index = (weight_text * text_similarity + 
-                          weight_handwriting * handwriting_similarity)
-
-        # Generate report with feature scores and anomalies
-        report_path = generate_report(
-            text_similarity, 
-            handwriting_similarity, 
-            similarity_index, 
-            text1, 
-            text2,
-            feature_scores,
-            anomalies1,
-            anomalies2,
-            variations1,
-            variations2
+        uploads = [_read_upload(file1), _read_upload(file2)]
+
+        error_response = _check_uploads(uploads)
+        if error_response:
+            return error_response
+
+        # Text and handwriting branches run concurrently; the response includes per-stage timings
+        result = run_comparison(*uploads, names=[upload.name for upload in uploads], **_comparison_options())
+        logger.info("Comparison stage timings: %s", result['timings'])
+
+        return jsonify(result)
+
+    except ComparisonError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in compare_pdfs: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@main.route('/compare/batch', methods=['POST'])
+def compare_batch():
+    """
+    Compare many PDFs at once: all pairs of 'files', or the 'reference' file against each of them
+    """
+    files = request.files.getlist('files')
+    reference = request.files.get('reference')
+    uploads = ([reference] if reference else []) + files
+
+    if len(uploads) < 2:
+        return jsonify({'error': 'At least two PDF files are required'}), 400
+    if len(uploads) > current_app.config['BATCH_MAX_DOCUMENTS']:
+        return jsonify({'error': f"At most {current_app.config['BATCH_MAX_DOCUMENTS']} PDF files can be compared at once"}), 400
+    if not all(allowed_file(f.filename) for f in uploads):
+        return jsonify({'error': 'Invalid file format. Only PDF files are allowed'}), 400
+
+    logger.info("Received %s files for batch comparison", len(uploads))
+
+    try:
+        documents = [_read_upload(upload) for upload in uploads]
+
+        error_response = _check_uploads(documents)
+        if error_response:
+            return error_response
+
+        result = run_batch_comparison(
+            documents,
+            names=[document.name for document in documents],
+            reference_index=0 if reference else None,
+            **_comparison_options()
+        )
+        logger.info("Batch comparison stage timings: %s", result['timings'])
+
+        return jsonify(result)
+
+    except ComparisonError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in compare_batch: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@main.route('/search', methods=['POST'])
+def search_corpus():
+    """
+    Find the previously processed documents most similar to 'file' (up to 'top_k' matches)
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'A PDF file is required'}), 400
+
+    file = request.files['file']
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Invalid file format. Only PDF files are allowed'}), 400
+
+    # At most EMBEDDING_INDEX_RERANK_CANDIDATES documents are re-scored, so no more can be returned
+    max_top_k = current_app.config['EMBEDDING_INDEX_RERANK_CANDIDATES']
+    try:
+        top_k = int(request.form.get('top_k', 10))
+    except ValueError:
+        top_k = None
+    if top_k is None or not 1 <= top_k <= max_top_k:
+        return jsonify({'error': f'top_k must be an integer between 1 and {max_top_k}'}), 400
+
+    try:
+        upload = _read_upload(file)
+
+        error_response = _check_uploads([upload])
+        if error_response:
+            return error_response
+
+        options = _comparison_options()
+        options.pop('weight_text')
+        options.pop('handwriting_backends')
+        options.pop('text_mode')
+        options.pop('report_format')
+        result = run_corpus_search(
+            upload,
+            name=upload.name,
+            top_k=top_k,
+            **options
         )
+        logger.info("Corpus search stage timings: %s", result['timings'])
 
-        return jsonify({
-            'text_similarity': text_similarity,
-            'text_consistency': text_analysis['consistency_analysis'],
-            'handwriting_similarity': handwriting_similarity,
-            'similarity_index': similarity_index,
-            'feature_scores': feature_scores,
-            'anomalies': {
-                'document1': anomalies1,
-                'document2': anomalies2
-            },
-            'variations': {
-                'document1': variations1,
-                'document2': variations2
-            },
-            'report_url': report_path
-        })
+        return jsonify(result)
 
+    except ComparisonError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error in compare_pdfs: {str(e)}")
+        logger.exception("Error in search_corpus: %s", e)
         return jsonify({'error': str(e)}), 500
-    finally:
-        # Clean up uploaded files
-        for filepath in [filepath1, filepath2]:
-            try:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-            except Exception as e:
-                print(f"Error removing file {filepath}: {str(e)}") 
\ No newline at end of file
+
+@main.route('/jobs', methods=['POST'])
+def submit_comparison_job():
+    """Queue a comparison and return its job id without waiting for the result"""
+    if 'file1' not in request.files or 'file2' not in request.files:
+        return jsonify({'error': 'Two PDF files are required'}), 400
+
+    file1 = request.files['file1']
+    file2 = request.files['file2']
+
+    if not all(allowed_file(f.filename) for f in [file1, file2]):
+        return jsonify({'error': 'Invalid file format. Only PDF files are allowed'}), 400
+
+    try:
+        # The job keeps the uploads in memory until it has run
+        uploads = [_read_upload(file1), _read_upload(file2)]
+
+        error_response = _check_uploads(uploads)
+        if error_response:
+            return error_response
+
+        job_id = submit_job(*uploads, names=[upload.name for upload in uploads], **_comparison_options())
+    except ComparisonError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in submit_comparison_job: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('main.comparison_job_status', job_id=job_id),
+        'result_url': url_for('main.comparison_job_result', job_id=job_id)
+    }), 202
+
+@main.route('/jobs/<job_id>')
+def comparison_job_status(job_id):
+    """Job status with overall and per-stage progress percentages"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@main.route('/jobs/<job_id>/result')
+def comparison_job_result(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job.get('error', 'Comparison failed')}), job.get('error_status', 500)
+    if job['status'] != 'completed':
+        return jsonify({'status': job['status'], 'progress': job['progress']}), 202
+
+    result = get_job_result(job_id)
+    if result is None:
+        return jsonify({'error': 'Job result is no longer available'}), 404
+    return jsonify(result)
@@ -0,0 +1,164 @@
+import threading
+import logging
+import os
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Inference backends for the embedding model. Each encoder maps padded numpy
+# inputs (input_ids, attention_mask, ...) to the last hidden state as a float32
+# array of shape (batch, tokens, hidden); pooling happens in SemanticAnalyzer.
+#
+#   torch       float32 PyTorch model (any device)
+#   torch-int8  PyTorch with dynamic int8 quantization of the Linear layers (CPU)
+#   onnx        exported ONNX graph on ONNX Runtime (CPU)
+#   onnx-int8   the ONNX graph with dynamically quantized int8 weights (CPU)
+#
+# ONNX graphs are exported once into EMBEDDING_ONNX_FOLDER (`python setup.py
+# --export-onnx`); the first load exports them if they are missing.
+
+EMBEDDING_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+
+_export_lock = threading.RLock()  # the int8 export exports the float graph first
+
+def inference_threads():
+    """
+    Intra-op threads for one process: EMBEDDING_THREADS, or the CPU cores split between
+    WEB_CONCURRENCY gunicorn workers so they do not oversubscribe the machine
+    """
+    if Config.EMBEDDING_THREADS > 0:
+        return Config.EMBEDDING_THREADS
+    workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+class TorchEncoder:
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+        self.hidden_size = model.config.hidden_size
+
+    def __call__(self, inputs):
+        import torch
+
+        tensors = {key: torch.from_numpy(values).to(self.device) for key, values in inputs.items()}
+        with torch.no_grad():
+            outputs = self.model(**tensors)
+        return outputs.last_hidden_state.float().cpu().numpy()
+
+class OnnxEncoder:
+    """
+    ONNX Runtime session for an exported graph.
+
+    The session (and its thread pool) is created on first use in each process, so
+    a model preloaded in the gunicorn master is safe to use after fork.
+    """
+
+    def __init__(self, path, hidden_size, threads):
+        self.path = path
+        self.hidden_size = hidden_size
+        self.threads = threads
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def session(self):
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                import onnxruntime
+
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                options.inter_op_num_threads = 1
+                self._session = onnxruntime.InferenceSession(self.path, options,
+                                                             providers=['CPUExecutionProvider'])
+                self._pid = os.getpid()
+            return self._session
+
+    def __call__(self, inputs):
+        session = self.session()
+        # Only feed the inputs the graph was exported with (e.g. no token_type_ids for some models)
+        feed = {node.name: inputs[node.name].astype(np.int64) for node in session.get_inputs()}
+        return session.run(['last_hidden_state'], feed)[0].astype(np.float32, copy=False)
+
+def onnx_model_path(model_name, quantized=False):
+    """Where the exported graph of model_name is cached"""
+    folder = os.path.join(Config.EMBEDDING_ONNX_FOLDER, model_name.replace('/', '--'))
+    return os.path.join(folder, 'model.int8.onnx' if quantized else 'model.onnx')
+
+def export_onnx(model_name, quantized=False, force=False):
+    """
+    Export model_name to ONNX (and optionally quantize it to int8) unless already cached.
+
+    Needs torch, transformers and onnx (plus onnxruntime for quantization); workers
+    running the exported graph only need onnxruntime. Returns the graph path.
+    """
+    path = onnx_model_path(model_name, quantized)
+    with _export_lock:
+        if os.path.exists(path) and not force:
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # _export_lock only covers this process; other workers may export at the same time
+        temp_path = f'{path}.{os.getpid()}.tmp'
+
+        if quantized:
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            source = export_onnx(model_name, force=force)
+            logger.info("Quantizing %s to int8", source)
+            quantize_dynamic(source, temp_path, weight_type=QuantType.QInt8)
+        else:
+            import torch
+            from transformers import AutoTokenizer, AutoModel
+
+            logger.info("Exporting %s to %s", model_name, path)
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = AutoModel.from_pretrained(model_name)
+            model.eval()
+            sample = tokenizer(['An example sentence to trace the graph'], return_tensors='pt')
+            # Positional order of BERT-style forward(): input_ids, attention_mask, token_type_ids
+            input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+            dynamic_axes = {name: {0: 'batch', 1: 'tokens'} for name in input_names + ['last_hidden_state']}
+            with torch.no_grad():
+                torch.onnx.export(
+                    model,
+                    tuple(sample[name] for name in input_names),
+                    temp_path,
+                    input_names=input_names,
+                    output_names=['last_hidden_state'],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=14
+                )
+        # Workers may be loading concurrently; never expose a half-written graph
+        os.replace(temp_path, path)
+    return path
+
+def load_encoder(model_name, device, backend=None):
+    """Return (tokenizer, encoder) for model_name running on the given inference backend"""
+    from transformers import AutoTokenizer
+
+    backend = backend or Config.EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    threads = inference_threads()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if backend.startswith('onnx'):
+        from transformers import AutoConfig
+
+        path = export_onnx(model_name, quantized=backend == 'onnx-int8')
+        hidden_size = AutoConfig.from_pretrained(model_name).hidden_size
+        return tokenizer, OnnxEncoder(path, hidden_size, threads)
+
+    import torch
+    from transformers import AutoModel
+
+    torch.set_num_threads(threads)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    if backend == 'torch-int8':
+        if device != 'cpu':
+            raise ValueError('torch-int8 embeddings only run on the CPU')
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.to(device)
+    return tokenizer, TorchEncoder(model, device)
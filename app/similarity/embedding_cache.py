@@ -0,0 +1,254 @@
+from collections import OrderedDict
+import sqlite3
+import logging
+import hashlib
+import os
+import re
+import threading
+import time
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Segment embeddings keyed by model id + normalized line text. Handwritten
+# submissions on one assignment repeat prompts, headings and formulas, so most
+# lines of a new document have usually been embedded before.
+#
+# Two tiers: a per-process LRU bounded by EMBEDDING_CACHE_MEMORY_BYTES, and a
+# SQLite file (EMBEDDING_CACHE_PATH) shared by every gunicorn worker. The file
+# doubles as the warm-start store: warm_start() loads its most recently used
+# entries into memory, in the gunicorn master when the model is preloaded.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+# SQLite limits the number of host parameters per statement
+_QUERY_CHUNK = 500
+
+# Eviction sums the whole table, so each process runs it at most once per _EVICT_INTERVAL seconds
+_EVICT_INTERVAL = 60
+
+_memory = OrderedDict()
+_memory_bytes = 0
+_memory_lock = threading.Lock()
+
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0,
+          'memory_evictions': 0, 'disk_evictions': 0, 'warm_start_entries': 0}
+_stats_lock = threading.Lock()
+_initialized_paths = set()
+_next_evict_at = 0.0
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def _connect():
+    path = Config.EMBEDDING_CACHE_PATH
+    if path not in _initialized_paths:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _initialized_paths:
+        # WAL lets gunicorn workers read while another one writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(_SCHEMA)
+        conn.execute('CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed_at)')
+        conn.commit()
+        _initialized_paths.add(path)
+    return conn
+
+def normalize_segment(text):
+    """Collapse whitespace runs; the tokenizer ignores them, so the embedding is unchanged"""
+    return re.sub(r'\s+', ' ', text).strip()
+
+def make_key(model_id, text):
+    """Cache key for the embedding of an already normalized segment"""
+    return hashlib.sha256(f'{model_id}\0{text}'.encode()).hexdigest()
+
+def _remember(key, vector):
+    """Insert into the in-memory LRU, evicting least recently used entries over the memory bound"""
+    global _memory_bytes
+    evicted = 0
+    with _memory_lock:
+        previous = _memory.pop(key, None)
+        if previous is not None:
+            _memory_bytes -= previous.nbytes
+        _memory[key] = vector
+        _memory_bytes += vector.nbytes
+        while _memory_bytes > Config.EMBEDDING_CACHE_MEMORY_BYTES and _memory:
+            _, oldest = _memory.popitem(last=False)
+            _memory_bytes -= oldest.nbytes
+            evicted += 1
+    if evicted:
+        _count('memory_evictions', evicted)
+
+def get_many(model_id, segments):
+    """
+    Look up normalized segments; returns {index: embedding} for the ones found.
+
+    The in-memory LRU is checked first, then the shared SQLite file; disk hits are
+    promoted to memory.
+    """
+    if not Config.EMBEDDING_CACHE_ENABLED or not segments:
+        return {}
+
+    keys = [make_key(model_id, segment) for segment in segments]
+    found = {}
+    with _memory_lock:
+        for i, key in enumerate(keys):
+            vector = _memory.get(key)
+            if vector is not None:
+                _memory.move_to_end(key)
+                found[i] = vector
+    _count('memory_hits', len(found))
+
+    remaining = {}
+    for i, key in enumerate(keys):
+        if i not in found:
+            remaining.setdefault(key, []).append(i)
+    if remaining:
+        rows = []
+        try:
+            conn = _connect()
+            try:
+                pending = list(remaining)
+                for start in range(0, len(pending), _QUERY_CHUNK):
+                    chunk = pending[start:start + _QUERY_CHUNK]
+                    rows.extend(conn.execute(
+                        f"SELECT key, value FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall())
+                if rows:
+                    now = time.time()
+                    conn.executemany('UPDATE embeddings SET accessed_at = ? WHERE key = ?',
+                                     [(now, key) for key, _ in rows])
+                    conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("Embedding cache read error: %s", e)
+            rows = []
+
+        for key, value in rows:
+            vector = np.frombuffer(value, dtype=np.float32)
+            _remember(key, vector)
+            for i in remaining[key]:
+                found[i] = vector
+        _count('disk_hits', sum(len(remaining[key]) for key, _ in rows))
+
+    _count('misses', len(segments) - len(found))
+    return found
+
+def put_many(model_id, segments, embeddings):
+    """Store the embeddings of normalized segments in memory and in the shared file"""
+    if not Config.EMBEDDING_CACHE_ENABLED or not segments:
+        return
+
+    now = time.time()
+    rows = []
+    for segment, embedding in zip(segments, embeddings):
+        key = make_key(model_id, segment)
+        vector = np.array(embedding, dtype=np.float32)
+        _remember(key, vector)
+        rows.append((key, model_id, vector.tobytes(), vector.nbytes, now, now))
+    try:
+        conn = _connect()
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, model, value, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            if _evict_due(now):
+                _evict(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        _count('stores', len(rows))
+    except sqlite3.Error as e:
+        logger.warning("Embedding cache write error: %s", e)
+
+def _evict_due(now):
+    global _next_evict_at
+    with _stats_lock:
+        if now < _next_evict_at:
+            return False
+        _next_evict_at = now + _EVICT_INTERVAL
+        return True
+
+def _evict(conn):
+    """Drop least recently used entries above EMBEDDING_CACHE_MAX_BYTES"""
+    total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM embeddings').fetchone()[0]
+    if total_size <= Config.EMBEDDING_CACHE_MAX_BYTES:
+        return
+    excess = total_size - Config.EMBEDDING_CACHE_MAX_BYTES
+    keys = []
+    for key, size in conn.execute('SELECT key, size FROM embeddings ORDER BY accessed_at'):
+        if excess <= 0:
+            break
+        keys.append((key,))
+        excess -= size
+    conn.executemany('DELETE FROM embeddings WHERE key = ?', keys)
+    _count('disk_evictions', len(keys))
+
+def warm_start(model_id):
+    """
+    Load the most recently used embeddings of model_id from the shared file into memory.
+
+    Stops at EMBEDDING_CACHE_MEMORY_BYTES. Returns the number of entries loaded.
+    """
+    if not Config.EMBEDDING_CACHE_ENABLED or not os.path.exists(Config.EMBEDDING_CACHE_PATH):
+        return 0
+
+    loaded = 0
+    budget = Config.EMBEDDING_CACHE_MEMORY_BYTES
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute('SELECT key, value, size FROM embeddings WHERE model = ? ORDER BY accessed_at DESC',
+                                (model_id,))
+            entries = []
+            for key, value, size in rows:
+                if size > budget:
+                    break
+                budget -= size
+                entries.append((key, value))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Embedding cache warm start error: %s", e)
+        return 0
+
+    # Oldest first, so the most recently used entries end up at the LRU's fresh end
+    for key, value in reversed(entries):
+        _remember(key, np.frombuffer(value, dtype=np.float32))
+        loaded += 1
+    _count('warm_start_entries', loaded)
+    return loaded
+
+def get_cache_stats():
+    """Return hit/miss/eviction counters for this process and the sizes of both tiers"""
+    with _stats_lock:
+        stats = dict(_stats)
+    with _memory_lock:
+        stats['memory_entries'] = len(_memory)
+        stats['memory_bytes'] = _memory_bytes
+    stats['enabled'] = Config.EMBEDDING_CACHE_ENABLED
+    try:
+        conn = _connect()
+        try:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings').fetchone()
+        finally:
+            conn.close()
+        stats['disk_entries'] = entries
+        stats['disk_bytes'] = size
+    except sqlite3.Error as e:
+        logger.warning("Embedding cache stats error: %s", e)
+    return stats
@@ -0,0 +1,283 @@
+import numpy as np
+import logging
+import sqlite3
+import hashlib
+import fcntl
+import threading
+import time
+import os
+from contextlib import contextmanager
+from app.similarity.text_similarity import normalize_embeddings, max_cosine_similarity
+from app.similarity.model_registry import embedding_model_id
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# On-disk layout, one directory per embedding model and backend (their vectors differ slightly):
+#   lines.f32         float32 matrix of every indexed line embedding (L2-normalized), row-major
+#   centroids.f32     one normalized mean embedding per document, in document id order
+#   ivf.npz           optional coarse quantizer (cluster centroids + document assignments)
+#   metadata.sqlite3  document names, hashes and row ranges into lines.f32
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    line_offset INTEGER NOT NULL,
+    line_count INTEGER NOT NULL,
+    page_count INTEGER,
+    created_at REAL NOT NULL
+)
+"""
+
+def content_hash(text):
+    """Identify a document by its extracted text, so re-uploads are not indexed twice"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def document_centroid(embeddings):
+    """Normalized mean of a document's normalized line embeddings"""
+    centroid = normalize_embeddings(embeddings).mean(axis=0, keepdims=True)
+    return normalize_embeddings(centroid)[0]
+
+def _kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Spherical k-means on normalized vectors; returns (cluster centroids, assignments)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = normalize_embeddings(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+class EmbeddingIndex:
+    """
+    Corpus of previously processed documents' line embeddings for similarity search.
+
+    Vectors are appended to flat float32 files and read back through np.memmap, so
+    searching does not load the corpus into memory. Writers take an exclusive file
+    lock, which makes the index safe to share between gunicorn workers.
+    """
+
+    def __init__(self, folder=None, model_id=None):
+        model_id = model_id or embedding_model_id()
+        self.folder = os.path.join(folder or Config.EMBEDDING_INDEX_FOLDER, model_id.replace('/', '__'))
+        os.makedirs(self.folder, exist_ok=True)
+        self.lines_path = os.path.join(self.folder, 'lines.f32')
+        self.centroids_path = os.path.join(self.folder, 'centroids.f32')
+        self.ivf_path = os.path.join(self.folder, 'ivf.npz')
+        self.db_path = os.path.join(self.folder, 'metadata.sqlite3')
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+            conn.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _write_lock(self):
+        with open(os.path.join(self.folder, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _ivf_lock(self):
+        """Yield whether this process may rebuild the IVF; only one build runs at a time"""
+        with open(os.path.join(self.folder, '.ivf.lock'), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _dimension(self, conn):
+        row = conn.execute("SELECT value FROM settings WHERE key = 'dimension'").fetchone()
+        return int(row[0]) if row else None
+
+    def _open_matrix(self, path, rows, dimension):
+        if rows == 0:
+            return np.zeros((0, dimension), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode='r', shape=(rows, dimension))
+
+    @staticmethod
+    def _append_rows(path, matrix, expected_rows, dimension):
+        """Append rows, first dropping any rows left behind by an interrupted write"""
+        with open(path, 'ab') as f:
+            f.truncate(expected_rows * dimension * 4)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+
+    def add_document(self, name, text, embeddings, page_count=None):
+        """
+        Index a document's line embeddings; returns its id (existing id if already indexed)
+        """
+        embeddings = normalize_embeddings(embeddings)
+        if len(embeddings) == 0:
+            return None
+        digest = content_hash(text)
+
+        with self._write_lock(), self._connect() as conn:
+            existing = conn.execute('SELECT id FROM documents WHERE content_hash = ?', (digest,)).fetchone()
+            if existing:
+                return existing[0]
+
+            dimension = self._dimension(conn)
+            if dimension is None:
+                dimension = embeddings.shape[1]
+                conn.execute("INSERT INTO settings (key, value) VALUES ('dimension', ?)", (str(dimension),))
+            elif dimension != embeddings.shape[1]:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match index dimension {dimension}")
+
+            document_count, line_total = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(line_count), 0) FROM documents'
+            ).fetchone()
+
+            # Vectors first, metadata last: a document only becomes visible once both are written
+            self._append_rows(self.lines_path, embeddings, line_total, dimension)
+            self._append_rows(self.centroids_path, document_centroid(embeddings)[None, :], document_count, dimension)
+            cursor = conn.execute(
+                'INSERT INTO documents (name, content_hash, line_offset, line_count, page_count, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (name, digest, line_total, len(embeddings), page_count, time.time())
+            )
+            document_id = cursor.lastrowid
+
+        # k-means runs outside the write lock, on the documents indexed so far, so other writers don't queue behind it
+        if self._ivf_is_stale(document_count + 1):
+            self._build_ivf(document_count + 1, dimension)
+
+        return document_id
+
+    def _load_ivf(self):
+        try:
+            with np.load(self.ivf_path) as ivf:
+                return ivf['centroids'], ivf['assignments']
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _ivf_is_stale(self, document_count):
+        """The coarse quantizer is rebuilt once the corpus grows 10% past what it was built on"""
+        if not Config.EMBEDDING_INDEX_IVF_LISTS or document_count < Config.EMBEDDING_INDEX_IVF_MIN_DOCUMENTS:
+            return False
+        ivf = self._load_ivf()
+        return ivf is None or document_count > len(ivf[1]) * 1.1
+
+    def _build_ivf(self, document_count, dimension):
+        """
+        Cluster the first document_count document centroids and publish the quantizer atomically.
+
+        centroids.f32 is append-only, so those rows are a stable snapshot while
+        other writers keep adding documents; they are searched exhaustively
+        until the next rebuild.
+        """
+        with self._ivf_lock() as acquired:
+            # Another process is already rebuilding, or finished while we waited
+            if not acquired or not self._ivf_is_stale(document_count):
+                return
+            centroids = np.array(self._open_matrix(self.centroids_path, document_count, dimension))
+            n_lists = min(Config.EMBEDDING_INDEX_IVF_LISTS, document_count)
+            logger.info("Building IVF index with %s lists over %s documents", n_lists, document_count)
+            cluster_centroids, assignments = _kmeans(centroids, n_lists)
+            tmp_path = f'{self.ivf_path}.{os.getpid()}.tmp.npz'
+            np.savez(tmp_path, centroids=cluster_centroids, assignments=assignments)
+            os.replace(tmp_path, self.ivf_path)
+
+    def _candidate_rows(self, query_centroid, centroids):
+        """Rows of centroids worth scoring: all of them, or only the nearest IVF lists"""
+        ivf = self._load_ivf() if Config.EMBEDDING_INDEX_IVF_LISTS else None
+        if ivf is None:
+            return np.arange(len(centroids))
+
+        cluster_centroids, assignments = ivf
+        probes = np.argsort(-(cluster_centroids @ query_centroid))[:Config.EMBEDDING_INDEX_IVF_PROBES]
+        candidates = np.flatnonzero(np.isin(assignments, probes))
+        # Documents added since the quantizer was built are always searched exhaustively
+        recent = np.arange(len(assignments), len(centroids))
+        return np.concatenate([candidates, recent])
+
+    def search(self, embeddings, top_k=10, rerank_candidates=None, exclude_text=None):
+        """
+        Find the indexed documents most similar to a document's line embeddings.
+
+        Candidates are selected by centroid cosine similarity (optionally through the
+        IVF quantizer), then re-ranked with the same line-level score as /compare.
+        """
+        rerank_candidates = rerank_candidates or Config.EMBEDDING_INDEX_RERANK_CANDIDATES
+        if len(embeddings) == 0:
+            return []
+        query = normalize_embeddings(embeddings)
+        query_centroid = document_centroid(query)
+        exclude_hash = content_hash(exclude_text) if exclude_text else None
+
+        with self._connect() as conn:
+            dimension = self._dimension(conn)
+            rows = conn.execute(
+                'SELECT id, name, content_hash, line_offset, line_count, page_count FROM documents ORDER BY id'
+            ).fetchall()
+        if dimension is None or not rows:
+            return []
+
+        centroids = self._open_matrix(self.centroids_path, len(rows), dimension)
+        lines = self._open_matrix(self.lines_path, rows[-1][3] + rows[-1][4], dimension)
+
+        candidates = self._candidate_rows(query_centroid, centroids)
+        centroid_scores = np.asarray(centroids[candidates]) @ query_centroid
+        order = np.argsort(-centroid_scores)[:rerank_candidates + (1 if exclude_hash else 0)]
+
+        matches = []
+        for position in order:
+            document_id, name, digest, line_offset, line_count, page_count = rows[candidates[position]]
+            if digest == exclude_hash:
+                continue
+            document_lines = np.asarray(lines[line_offset:line_offset + line_count])
+            matches.append({
+                'document_id': document_id,
+                'name': name,
+                'page_count': page_count,
+                'centroid_similarity': float(centroid_scores[position]),
+                'text_similarity': float(np.mean(max_cosine_similarity(query, document_lines)))
+            })
+
+        matches.sort(key=lambda match: match['text_similarity'], reverse=True)
+        return matches[:top_k]
+
+    def stats(self):
+        with self._connect() as conn:
+            documents, lines = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(line_count), 0) FROM documents'
+            ).fetchone()
+        ivf = self._load_ivf()
+        return {
+            'documents': documents,
+            'lines': lines,
+            'ivf_lists': 0 if ivf is None else len(ivf[0]),
+            'ivf_documents': 0 if ivf is None else len(ivf[1])
+        }
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(model_id=None):
+    """Return the process-wide EmbeddingIndex for a model_id (see EmbeddingModel.model_id)"""
+    model_id = model_id or embedding_model_id()
+    with _indexes_lock:
+        index = _indexes.get(model_id)
+        if index is None:
+            index = EmbeddingIndex(model_id=model_id)
+            _indexes[model_id] = index
+        return index
@@ -1,150 +1,309 @@
-import requests
-import io
 import numpy as np
-from pdf2image import convert_from_path
 import os
 import base64
+import logging
+import json
+from app.utils import ocr_cache
+from app.utils import http_client
+from app.utils.document_loader import load_document
+from app.utils.instrumentation import instrumented
+from config import Config
 
-def compute_handwriting_similarity(pdf_path1, pdf_path2):
+logger = logging.getLogger(__name__)
+
+# Vision annotate features; also part of the OCR cache key
+VISION_FEATURES = [{
+    'type': 'DOCUMENT_TEXT_DETECTION',
+    'maxResults': 50
+}]
+
+# JSON bytes of one images:annotate request besides its base64 image, plus the separating ', '
+_VISION_REQUEST_OVERHEAD = len(json.dumps({'image': {'content': ''}, 'features': VISION_FEATURES})) + 2
+
+# One row per paragraph with words; page is the position among the document's annotated pages
+FEATURE_DTYPE = np.dtype([
+    ('page', np.int32),
+    ('paragraph', np.int32),
+    ('confidence', np.float64),
+    ('word_count', np.int32),
+    ('symbol_density', np.float64),
+    ('line_breaks', np.int32),
+    ('average_symbol_confidence', np.float64)
+])
+
+class HandwritingFeatures:
+    """
+    Columnar paragraph features of one document: a FEATURE_DTYPE array sorted by page.
+
+    page_count includes annotated pages without any paragraphs; pages whose
+    annotation failed are not counted. backend names the OCR engine, when known.
+    """
+
+    def __init__(self, rows, page_count, backend=None):
+        self.rows = rows
+        self.page_count = page_count
+        self.backend = backend
+
+    @classmethod
+    def from_pages(cls, page_rows):
+        """Stack per-page row arrays, numbering pages by their position in page_rows"""
+        rows = np.concatenate(page_rows) if page_rows else np.zeros(0, dtype=FEATURE_DTYPE)
+        rows['page'] = np.repeat(np.arange(len(page_rows), dtype=np.int32), [len(r) for r in page_rows])
+        return cls(rows, len(page_rows))
+
+    def page_sizes(self):
+        """Number of paragraphs on each page"""
+        return np.bincount(self.rows['page'], minlength=self.page_count)
+
+    def __len__(self):
+        return self.page_count
+
+def compute_handwriting_similarity(pdf_path1, pdf_path2, bypass_cache=False, document1=None, document2=None):
     """
     Compute similarity between handwriting in two PDFs using Google Cloud Vision API
+
+    Already rendered documents can be passed to reuse the pages rasterized for text extraction.
     """
+    api_key = None
+    owned_documents = []
     try:
-        # Convert PDFs to images
-        images1 = convert_from_path(pdf_path1)
-        images2 = convert_from_path(pdf_path2)
+        # Convert PDFs to images unless the caller already did
+        if document1 is None:
+            document1 = load_document(pdf_path1)
+            owned_documents.append(document1)
+        if document2 is None:
+            document2 = load_document(pdf_path2)
+            owned_documents.append(document2)
 
         # Get API key
         api_key = os.environ.get('GOOGLE_CLOUD_API_KEY')
-        print(f"Using Google Cloud API key: {api_key[:10]}...")
 
         # Get handwriting features for both documents
-        features1 = extract_handwriting_features(images1, api_key)
-        features2 = extract_handwriting_features(images2, api_key)
-
-        # Add anomaly and variation detection
-        anomalies1, variations1 = detect_internal_anomalies(features1)
-        anomalies2, variations2 = detect_internal_anomalies(features2)
+        features1 = extract_handwriting_features(document1, api_key, bypass_cache)
+        features2 = extract_handwriting_features(document2, api_key, bypass_cache)
 
-        # Compare features and calculate similarity score
-        similarity, feature_scores = compare_handwriting_features(features1, features2)
-
-        return float(np.clip(similarity, 0, 1)), feature_scores, anomalies1, anomalies2, variations1, variations2
+        return score_handwriting_features(features1, features2)
     except Exception as e:
-        print(f"Detailed error in handwriting similarity: {str(e)}")
-        print(f"API key used: {api_key[:10]}...")
+        logger.exception("Error in handwriting similarity: %s", e)
         raise Exception(f"Error computing handwriting similarity: {str(e)}")
+    finally:
+        for document in owned_documents:
+            document.close()
 
-def extract_handwriting_features(images, api_key):
+def score_handwriting_features(features1, features2):
     """
-    Extract handwriting features from images using Google Cloud Vision API
+    Similarity, feature scores, anomalies and page variations for two documents' extracted features
     """
-    features = []  # List to store features for each page
-    
-    for page_num, image in enumerate(images):
-        page_features = []  # Features for current page
+    # Add anomaly and variation detection
+    anomalies1, variations1 = detect_internal_anomalies(features1)
+    anomalies2, variations2 = detect_internal_anomalies(features2)
+
+    # Compare features and calculate similarity score
+    similarity, feature_scores = compare_handwriting_features(features1, features2)
+
+    return float(np.clip(similarity, 0, 1)), feature_scores, anomalies1, anomalies2, variations1, variations2
+
+def _annotate_images(images, api_key):
+    """
+    Send several encoded page images in one images:annotate call.
+
+    Returns one response dict per image, or None for every image if the call failed.
+    """
+    url = f'{Config.VISION_API_URL}/v1/images:annotate?key={api_key}'
+    payload = {
+        'requests': [{
+            'image': {
+                'content': base64.b64encode(img_bytes).decode()
+            },
+            'features': VISION_FEATURES
+        } for img_bytes in images]
+    }
+
+    logger.debug("Sending %d page(s) to Google Vision", len(images))
+    response = http_client.post('vision', url, json=payload)
+
+    if response.status_code != 200:
+        logger.warning("Google Vision returned HTTP %d for %d page(s)", response.status_code, len(images))
+        return [None] * len(images)
+
+    responses = response.json().get('responses') or []
+    # Responses come back in request order
+    return [responses[i] if i < len(responses) else {} for i in range(len(images))]
+
+def _vision_request_bytes(img_bytes):
+    """Size of one page's request in the JSON body: its image is sent base64-encoded"""
+    return -(-len(img_bytes) // 3) * 4 + _VISION_REQUEST_OVERHEAD
+
+def _vision_batches(pages):
+    """
+    Split (page_num, img_bytes) pairs into calls of at most VISION_BATCH_SIZE images
+    and VISION_BATCH_MAX_BYTES of JSON request body
+    """
+    batch, batch_bytes = [], 0
+    for page in pages:
+        page_bytes = _vision_request_bytes(page[1])
+        if batch and (len(batch) >= Config.VISION_BATCH_SIZE or batch_bytes + page_bytes > Config.VISION_BATCH_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(page)
+        batch_bytes += page_bytes
+    if batch:
+        yield batch
+
+def annotate_pages(document, page_nums, api_key, bypass_cache=False):
+    """
+    Vision responses for several rendered pages, batching the pages missing from the OCR cache
+
+    A page's response is None if its request failed.
+    """
+    responses = {}
+    uncached = []
+    for page_num in page_nums:
+        # Encoded page bytes are shared with the Mathpix extractor
+        img_bytes = document.page_bytes(page_num)
+        # Reuse the Vision response if this exact page was already annotated
+        response_data = ocr_cache.get('vision', img_bytes, VISION_FEATURES, bypass=bypass_cache)
+        if response_data is None:
+            uncached.append((page_num, img_bytes))
+        else:
+            logger.debug("Using cached Vision result for page %d", page_num + 1)
+            responses[page_num] = response_data
+
+    for batch in _vision_batches(uncached):
+        batch_responses = _annotate_images([img_bytes for _, img_bytes in batch], api_key)
+        for (page_num, img_bytes), response_data in zip(batch, batch_responses):
+            # Only successful annotations are worth caching
+            if response_data and 'fullTextAnnotation' in response_data and 'error' not in response_data:
+                ocr_cache.put('vision', img_bytes, VISION_FEATURES, response_data, bypass=bypass_cache)
+            responses[page_num] = response_data
+
+    return [responses[page_num] for page_num in page_nums]
+
+def page_features_from_response(response_data):
+    """
+    Paragraph-level handwriting features from one page's Vision response, as FEATURE_DTYPE rows
+
+    Every symbol is visited once; the page column is filled in by HandwritingFeatures.from_pages.
+    """
+    rows = []  # Features for current page
+
+    # Extract features from response
+    if 'fullTextAnnotation' in response_data:
+        # Success - process the text data
+        text_data = response_data['fullTextAnnotation']
+        
+        for page in text_data.get('pages', []):
+            for block in page.get('blocks', []):
+                for paragraph in block.get('paragraphs', []):
+                    words = paragraph.get('words', [])
+                    if not words:
+                        continue
+
+                    symbol_count = 0
+                    non_alnum_symbols = 0
+                    line_breaks = 0
+                    symbol_confidence = 0
+                    for word in words:
+                        for symbol in word.get('symbols', []):
+                            symbol_count += 1
+                            symbol_confidence += symbol.get('confidence', 0)
+                            if not symbol.get('text', '').isalnum():
+                                non_alnum_symbols += 1
+                            if symbol.get('property', {}).get('detectedBreak', {}).get('type'):
+                                line_breaks += 1
+
+                    rows.append((
+                        0,
+                        len(rows),
+                        paragraph.get('confidence', 0),
+                        len(words),
+                        non_alnum_symbols / len(words),
+                        line_breaks,
+                        # Raises for a paragraph without symbols, failing the page as before
+                        symbol_confidence / symbol_count
+                    ))
+
+    return np.array(rows, dtype=FEATURE_DTYPE)
+
+def extract_pages_features(document, page_nums, api_key, bypass_cache=False):
+    """
+    Extract handwriting features for several rendered pages with as few Vision calls as possible.
+
+    Returns one FEATURE_DTYPE array per page, or None for pages that failed.
+    """
+    try:
+        responses = annotate_pages(document, page_nums, api_key, bypass_cache)
+    except Exception as e:
+        logger.warning("Error annotating pages %s: %s", [page_num + 1 for page_num in page_nums], e)
+        return [None] * len(page_nums)
+
+    results = []
+    for response_data in responses:
+        if response_data is None:
+            results.append(None)
+            continue
         try:
-            # Convert image to bytes
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_bytes = img_byte_arr.getvalue()
-            
-            # Convert to base64
-            img_base64 = base64.b64encode(img_bytes).decode()
-
-            # Prepare request to Google Cloud Vision API
-            url = f'https://vision.googleapis.com/v1/images:annotate?key={api_key}'
-            
-            payload = {
-                'requests': [{
-                    'image': {
-                        'content': img_base64
-                    },
-                    'features': [{
-                        'type': 'DOCUMENT_TEXT_DETECTION',
-                        'maxResults': 50
-                    }]
-                }]
-            }
-            
-            # Print request details for debugging
-            print(f"Making request to Google Vision API...")
-            print(f"URL: {url[:60]}...")  # Only print start of URL for security
-            
-            # Make request
-            response = requests.post(url, json=payload)
-            
-            # Print response status and details
-            print(f"Response status code: {response.status_code}")
-            if response.status_code != 200:
-                print(f"Error response: {response.text}")
-                continue
-
-            result = response.json()
-            
-            # Extract features from response
-            if 'responses' in result and result['responses']:
-                response_data = result['responses'][0]
-                if 'fullTextAnnotation' in response_data:
-                    # Success - process the text data
-                    print("Successfully extracted text features")
-                    text_data = response_data['fullTextAnnotation']
-                    
-                    for page in text_data.get('pages', []):
-                        for block in page.get('blocks', []):
-                            for paragraph in block.get('paragraphs', []):
-                                words = paragraph.get('words', [])
-                                if words:
-                                    page_features.append({
-                                        'confidence': paragraph.get('confidence', 0),
-                                        'word_count': len(words),
-                                        'symbol_density': sum(1 for word in words 
-                                                           for symbol in word.get('symbols', []) 
-                                                           if not symbol.get('text', '').isalnum()) / len(words) if words else 0,
-                                        'line_breaks': sum(1 for word in words 
-                                                         for symbol in word.get('symbols', []) 
-                                                         if symbol.get('property', {}).get('detectedBreak', {}).get('type')),
-                                        'average_symbol_confidence': sum(symbol.get('confidence', 0) 
-                                                                      for word in words 
-                                                                      for symbol in word.get('symbols', [])) / 
-                                                                   sum(1 for word in words 
-                                                                      for _ in word.get('symbols', []))
-                                    })
-                    
+            results.append(page_features_from_response(response_data))
         except Exception as e:
-            print(f"Error processing image: {str(e)}")
-            continue
-        
-        features.append(page_features)  # Add features for this page
+            logger.warning("Error extracting handwriting features from a page: %s", e)
+            results.append(None)
+    return results
+
+def extract_page_features(document, page_num, api_key, bypass_cache=False):
+    """
+    Extract handwriting features for one rendered page; returns None if the page failed
+    """
+    return extract_pages_features(document, [page_num], api_key, bypass_cache)[0]
+
+def extract_handwriting_features(document, api_key, bypass_cache=False, progress=None):
+    """
+    Extract handwriting features from a rendered document using Google Cloud Vision API
+
+    Returns a HandwritingFeatures table. Pages are sent VISION_BATCH_SIZE at a time, batches concurrently.
+    progress(done, total) is called as batches complete.
+    """
+    page_nums = list(range(document.page_count))
+    batches = [page_nums[i:i + Config.VISION_BATCH_SIZE] for i in range(0, len(page_nums), Config.VISION_BATCH_SIZE)]
+
+    # Annotate all batches concurrently; results come back in page order
+    batch_results = http_client.map_pages(
+        'vision',
+        lambda batch: extract_pages_features(document, batch, api_key, bypass_cache),
+        batches,
+        progress
+    )
+    page_results = [page_features for batch in batch_results for page_features in batch]
     
-    return features
+    # Skip pages that failed
+    return HandwritingFeatures.from_pages([page_features for page_features in page_results if page_features is not None])
 
+# Metrics combined into the handwriting similarity score, and their weights
+SIMILARITY_METRICS = ['confidence', 'symbol_density', 'line_breaks', 'average_symbol_confidence']
+SIMILARITY_WEIGHTS = np.array([0.3, 0.3, 0.2, 0.2])
+
+# Metrics checked for paragraph anomalies and page-to-page variations
+ANOMALY_METRICS = ['confidence', 'symbol_density', 'line_breaks']
+
+def _comparable(features):
+    # Historical rule: a document whose first page has no paragraphs scores 0 against everything
+    return features is not None and features.page_count > 0 and features.page_sizes()[0] > 0
+
+def _document_means(features):
+    """Mean of each SIMILARITY_METRICS column over all of a document's paragraphs"""
+    return np.array([features.rows[metric].mean() for metric in SIMILARITY_METRICS])
+
+@instrumented('similarity')
 def compare_handwriting_features(features1, features2):
     """
     Compare handwriting features and return a similarity score
     """
-    if not features1 or not features2 or not features1[0] or not features2[0]:
-        return 0.0, {}
-    
-    # Flatten page features into single list for each document
-    flat_features1 = [f for page_features in features1 for f in page_features]
-    flat_features2 = [f for page_features in features2 for f in page_features]
-    
-    if not flat_features1 or not flat_features2:
+    if not _comparable(features1) or not _comparable(features2):
         return 0.0, {}
-        
+
     # Calculate various similarity metrics
-    conf_sim = 1 - abs(np.mean([f['confidence'] for f in flat_features1]) - 
-                      np.mean([f['confidence'] for f in flat_features2]))
-    
-    symbol_density_sim = 1 - abs(np.mean([f['symbol_density'] for f in flat_features1]) - 
-                                np.mean([f['symbol_density'] for f in flat_features2]))
-    
-    line_break_sim = 1 - abs(np.mean([f['line_breaks'] for f in flat_features1]) - 
-                            np.mean([f['line_breaks'] for f in flat_features2]))
-    
-    avg_conf_sim = 1 - abs(np.mean([f['average_symbol_confidence'] for f in flat_features1]) - 
-                          np.mean([f['average_symbol_confidence'] for f in flat_features2]))
+    conf_sim, symbol_density_sim, line_break_sim, avg_conf_sim = (
+        1 - np.abs(_document_means(features1) - _document_means(features2))
+    )
     
     # Store individual scores
     feature_scores = {
@@ -155,157 +314,132 @@ def compare_handwriting_features(features1, features2):
     }
     
     # Weight the different similarity metrics
-    weights = {
-        'confidence': 0.3,
-        'symbol_density': 0.3,
-        'line_breaks': 0.2,
-        'avg_confidence': 0.2
-    }
-    
-    similarity = (weights['confidence'] * conf_sim +
-                 weights['symbol_density'] * symbol_density_sim +
-                 weights['line_breaks'] * line_break_sim +
-                 weights['avg_confidence'] * avg_conf_sim)
+    similarity = np.dot(SIMILARITY_WEIGHTS, [conf_sim, symbol_density_sim, line_break_sim, avg_conf_sim])
     
     return float(np.clip(similarity, 0, 1)), feature_scores
 
+@instrumented('similarity')
+def pairwise_handwriting_similarity(features_list):
+    """
+    Return an N x N matrix of compare_handwriting_features scores for every pair of documents.
+
+    Each document is reduced to its mean feature vector once; all pairs are then
+    scored with a single broadcast instead of N^2 calls.
+    """
+    n_documents = len(features_list)
+    means = np.zeros((n_documents, len(SIMILARITY_METRICS)))
+    valid = np.zeros(n_documents, dtype=bool)
+    for i, features in enumerate(features_list):
+        # Same conditions under which compare_handwriting_features returns 0
+        if _comparable(features):
+            means[i] = _document_means(features)
+            valid[i] = True
+
+    metric_similarities = 1 - np.abs(means[:, None, :] - means[None, :, :])
+    similarity = np.clip(metric_similarities @ SIMILARITY_WEIGHTS, 0, 1)
+    similarity[~valid, :] = 0.0
+    similarity[:, ~valid] = 0.0
+    return similarity
+
+def page_statistics(features):
+    """
+    Per-page mean and standard deviation of each ANOMALY_METRICS column, grouped in one pass.
+
+    Returns (counts, means, stds); means and stds have shape (page_count, len(ANOMALY_METRICS))
+    and are NaN for pages without paragraphs.
+    """
+    pages = features.rows['page']
+    counts = features.page_sizes()
+    values = np.column_stack([features.rows[metric].astype(np.float64) for metric in ANOMALY_METRICS])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sums = np.stack([np.bincount(pages, weights=values[:, m], minlength=features.page_count)
+                         for m in range(len(ANOMALY_METRICS))], axis=1)
+        means = sums / counts[:, None]
+        # Two-pass variance, as np.std computes it
+        squared = (values - means[pages]) ** 2
+        variances = np.stack([np.bincount(pages, weights=squared[:, m], minlength=features.page_count)
+                              for m in range(len(ANOMALY_METRICS))], axis=1) / counts[:, None]
+    return counts, means, np.sqrt(variances)
+
+@instrumented('anomaly_detection')
 def detect_internal_anomalies(features):
     """
     Detect anomalies within a single document's handwriting, including page-to-page variations
     """
-    anomalies = []
-    page_variations = []
-    
-    if not features or not isinstance(features[0], list):
+    if features is None or features.page_count == 0:
         return [], []
-        
-    # Analyze each page's features
-    for page_num, page_features in enumerate(features):
-        if not page_features:
-            continue
-            
-        # Calculate baseline statistics for this page
-        page_confidence_mean = np.mean([f['confidence'] for f in page_features])
-        page_symbol_density_mean = np.mean([f['symbol_density'] for f in page_features])
-        page_line_breaks_mean = np.mean([f['line_breaks'] for f in page_features])
-        
-        # Store page characteristics
-        page_characteristics = {
-            'page_number': page_num + 1,
-            'confidence': page_confidence_mean,
-            'symbol_density': page_symbol_density_mean,
-            'line_breaks': page_line_breaks_mean
-        }
-        
-        # Detect internal anomalies within the page
-        page_anomalies = detect_page_anomalies(page_features, page_num)
-        anomalies.extend(page_anomalies)
-        
-        # Store page characteristics for variation analysis
-        page_variations.append(page_characteristics)
-    
+
+    counts, means, stds = page_statistics(features)
+
+    # Pages without paragraphs have no statistics and are skipped
+    page_numbers = np.flatnonzero(counts) + 1
+    anomalies = detect_paragraph_anomalies(features, means, stds)
+
     # Analyze variations between pages
-    if len(page_variations) > 1:
-        variations = analyze_page_variations(page_variations)
+    if len(page_numbers) > 1:
+        variations = analyze_page_variations(page_numbers, means[counts > 0])
         return anomalies, variations
     
     return anomalies, []
 
-def detect_page_anomalies(features, page_num):
+def detect_paragraph_anomalies(features, means, stds, threshold=2.0):
     """
-    Detect anomalies within a single page
+    Paragraphs more than threshold standard deviations from their page's mean, for every page at once
     """
+    rows = features.rows
+    pages = rows['page']
+    values = np.column_stack([rows[metric].astype(np.float64) for metric in ANOMALY_METRICS])
+    row_means = means[pages]
+    row_stds = stds[pages]
+    distances = np.abs(values - row_means)
+    flagged = distances > threshold * row_stds
+
     anomalies = []
-    
-    # Calculate baseline statistics
-    confidence_mean = np.mean([f['confidence'] for f in features])
-    confidence_std = np.std([f['confidence'] for f in features])
-    
-    symbol_density_mean = np.mean([f['symbol_density'] for f in features])
-    symbol_density_std = np.std([f['symbol_density'] for f in features])
-    
-    line_breaks_mean = np.mean([f['line_breaks'] for f in features])
-    line_breaks_std = np.std([f['line_breaks'] for f in features])
-    
-    threshold = 2.0
-    
-    # Check each paragraph for anomalies
-    for i, feature in enumerate(features):
+    # Only the (few) flagged paragraphs are turned into dicts
+    for row in np.flatnonzero(flagged.any(axis=1)):
         anomaly = {}
-        
-        if abs(feature['confidence'] - confidence_mean) > threshold * confidence_std:
-            anomaly['confidence'] = {
-                'value': feature['confidence'],
-                'mean': confidence_mean,
-                'deviation': abs(feature['confidence'] - confidence_mean) / confidence_std
-            }
-            
-        if abs(feature['symbol_density'] - symbol_density_mean) > threshold * symbol_density_std:
-            anomaly['symbol_density'] = {
-                'value': feature['symbol_density'],
-                'mean': symbol_density_mean,
-                'deviation': abs(feature['symbol_density'] - symbol_density_mean) / symbol_density_std
-            }
-            
-        if abs(feature['line_breaks'] - line_breaks_mean) > threshold * line_breaks_std:
-            anomaly['line_breaks'] = {
-                'value': feature['line_breaks'],
-                'mean': line_breaks_mean,
-                'deviation': abs(feature['line_breaks'] - line_breaks_mean) / line_breaks_std
-            }
-            
-        if anomaly:
-            anomaly['paragraph_index'] = i
-            anomaly['page_number'] = page_num + 1
-            anomalies.append(anomaly)
+        for m, metric in enumerate(ANOMALY_METRICS):
+            if flagged[row, m]:
+                anomaly[metric] = {
+                    'value': rows[metric][row].item(),
+                    'mean': float(row_means[row, m]),
+                    'deviation': float(distances[row, m] / row_stds[row, m])
+                }
+        anomaly['paragraph_index'] = int(rows['paragraph'][row])
+        anomaly['page_number'] = int(pages[row]) + 1
+        anomalies.append(anomaly)
     
     return anomalies
 
-def analyze_page_variations(page_characteristics):
+def analyze_page_variations(page_numbers, page_means, threshold=0.15):
     """
-    Analyze variations between pages
+    Analyze variations between consecutive pages
+
+    page_means holds one row of ANOMALY_METRICS means per page in page_numbers.
+    A change above threshold (15%) is reported.
     """
+    labels = {
+        'confidence': 'Confidence',
+        'symbol_density': 'Symbol density',
+        'line_breaks': 'Line spacing'
+    }
+    changes = np.abs(np.diff(page_means, axis=0))
+    flagged = changes > threshold
+
     variations = []
-    threshold = 0.15  # 15% variation threshold
-    
-    for i in range(1, len(page_characteristics)):
-        prev_page = page_characteristics[i-1]
-        curr_page = page_characteristics[i]
-        
-        variation = {
-            'from_page': prev_page['page_number'],
-            'to_page': curr_page['page_number'],
-            'changes': []
-        }
-        
-        # Check confidence variation
-        conf_change = abs(curr_page['confidence'] - prev_page['confidence'])
-        if conf_change > threshold:
-            variation['changes'].append({
-                'type': 'confidence',
-                'difference': conf_change,
-                'description': f"Confidence changed by {(conf_change * 100):.1f}%"
-            })
-            
-        # Check symbol density variation
-        density_change = abs(curr_page['symbol_density'] - prev_page['symbol_density'])
-        if density_change > threshold:
-            variation['changes'].append({
-                'type': 'symbol_density',
-                'difference': density_change,
-                'description': f"Symbol density changed by {(density_change * 100):.1f}%"
-            })
-            
-        # Check line breaks variation
-        breaks_change = abs(curr_page['line_breaks'] - prev_page['line_breaks'])
-        if breaks_change > threshold:
-            variation['changes'].append({
-                'type': 'line_breaks',
-                'difference': breaks_change,
-                'description': f"Line spacing changed by {(breaks_change * 100):.1f}%"
-            })
-            
-        if variation['changes']:
-            variations.append(variation)
+    for i in np.flatnonzero(flagged.any(axis=1)):
+        variations.append({
+            'from_page': int(page_numbers[i]),
+            'to_page': int(page_numbers[i + 1]),
+            'changes': [
+                {
+                    'type': metric,
+                    'difference': float(changes[i, m]),
+                    'description': f"{labels[metric]} changed by {(changes[i, m] * 100):.1f}%"
+                }
+                for m, metric in enumerate(ANOMALY_METRICS) if flagged[i, m]
+            ]
+        })
     
-    return variations
\ No newline at end of file
+    return variations
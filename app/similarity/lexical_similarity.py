@@ -0,0 +1,101 @@
+import threading
+import logging
+import re
+import numpy as np
+from app.utils.nltk_setup import configure_nltk
+from app.utils.instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+
+# Lexical (bag-of-lemmas) similarity: TF-IDF cosine over normalized tokens.
+# Much cheaper than the embedding model, so it serves as a pre-filter before
+# semantic scoring. scikit-learn and NLTK are imported on first use only.
+
+_normalizer = None
+_normalizer_lock = threading.Lock()
+
+class LemmaNormalizer:
+    """
+    Lowercase, tokenize, drop stopwords and punctuation, lemmatize.
+
+    Tokenization runs per line (OCR text has no reliable sentence boundaries), so
+    no punkt model is needed. Without the WordNet data tokens are kept as they
+    are instead of failing; `python setup.py` downloads it.
+    """
+
+    def __init__(self):
+        nltk = configure_nltk()
+        from nltk.corpus import stopwords, wordnet
+        from nltk.stem import WordNetLemmatizer
+        from nltk.tokenize import word_tokenize
+
+        self.word_tokenize = word_tokenize
+        try:
+            self.stop_words = set(stopwords.words('english'))
+        except LookupError:
+            logger.warning("NLTK stopwords not found; lexical similarity keeps stopwords")
+            self.stop_words = set()
+        try:
+            nltk.data.find('corpora/wordnet')
+            # The lazy corpus loader is not thread-safe; load it here, before pipeline threads share it
+            wordnet.ensure_loaded()
+            self.lemmatizer = WordNetLemmatizer()
+        except LookupError:
+            logger.warning("NLTK wordnet not found; lexical similarity skips lemmatization")
+            self.lemmatizer = None
+        self._lemmas = {}
+
+    def lemma(self, token):
+        if self.lemmatizer is None:
+            return token
+        # Vocabularies are small compared to token counts; memoize WordNet lookups
+        lemma = self._lemmas.get(token)
+        if lemma is None:
+            lemma = self._lemmas[token] = self.lemmatizer.lemmatize(token)
+        return lemma
+
+    def __call__(self, text):
+        tokens = []
+        for line in text.lower().split('\n'):
+            for token in self.word_tokenize(line, preserve_line=True):
+                if re.search(r'\w', token) and token not in self.stop_words:
+                    tokens.append(self.lemma(token))
+        return tokens
+
+def get_normalizer():
+    """Process-wide LemmaNormalizer, built (and NLTK imported) on first use"""
+    global _normalizer
+    with _normalizer_lock:
+        if _normalizer is None:
+            _normalizer = LemmaNormalizer()
+        return _normalizer
+
+def tfidf_matrix(texts):
+    """L2-normalized sparse TF-IDF rows, one per text, over a vocabulary fitted on the texts themselves"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    vectorizer = TfidfVectorizer(analyzer=get_normalizer(), sublinear_tf=True)
+    return vectorizer.fit_transform(texts)
+
+@instrumented('similarity')
+def pairwise_lexical_similarity(texts):
+    """
+    Return the symmetric N x N matrix of TF-IDF cosine similarities between texts.
+
+    All texts are vectorized in one pass; the rows are L2-normalized, so a single
+    sparse product gives every cosine. Texts without any content word score 0.
+    """
+    result = np.zeros((len(texts), len(texts)))
+    if not texts:
+        return result
+    try:
+        matrix = tfidf_matrix(texts)
+    except ValueError:
+        # Empty vocabulary: no text has a content word
+        return result
+    result[:] = (matrix @ matrix.T).toarray()
+    return np.clip(result, 0.0, 1.0)
+
+def compute_lexical_similarity(text1, text2):
+    """TF-IDF cosine similarity of two texts, between 0 and 1"""
+    return float(pairwise_lexical_similarity([text1, text2])[0, 1])
@@ -0,0 +1,115 @@
+import threading
+import logging
+import time
+from app.similarity.embedding_backends import load_encoder, inference_threads
+from app.similarity import embedding_cache
+from app.utils.instrumentation import resident_memory_bytes
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Loaded models keyed by (model_name, device, backend); shared by every request in the process.
+# torch, transformers and onnxruntime are imported on first load so app startup stays fast.
+_models = {}
+_lock = threading.Lock()
+
+class EmbeddingModel:
+    """
+    Tokenizer/encoder pair loaded once per process.
+
+    encoder(inputs) maps padded numpy inputs to the last hidden state; see
+    app.similarity.embedding_backends.
+    """
+
+    def __init__(self, model_name, device, backend, tokenizer, encoder, load_seconds):
+        self.model_name = model_name
+        self.device = device
+        self.backend = backend
+        self.tokenizer = tokenizer
+        self.encoder = encoder
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+
+    @property
+    def model_id(self):
+        """Identifies the embeddings this model produces (quantized backends differ slightly)"""
+        return embedding_model_id(self.model_name, self.backend)
+
+def embedding_model_id(model_name=None, backend=None):
+    """model_id of the configured (or given) model and backend, without loading it"""
+    return f'{model_name or Config.EMBEDDING_MODEL_NAME}:{backend or Config.EMBEDDING_BACKEND}'
+
+def resolve_device(device=None, backend=None):
+    """Map the configured device ('auto', 'cpu', 'cuda', ...) to a torch device name"""
+    if (backend or Config.EMBEDDING_BACKEND) != 'torch':
+        # Quantized and ONNX backends run on the CPU
+        return 'cpu'
+    device = device or Config.EMBEDDING_DEVICE
+    if device == 'auto':
+        import torch
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    return device
+
+def _load_model(model_name, device, backend):
+    logger.info("Loading embedding model %s on %s (%s, %d threads)", model_name, device, backend, inference_threads())
+    start = time.perf_counter()
+    tokenizer, encoder = load_encoder(model_name, device, backend)
+    load_seconds = time.perf_counter() - start
+    logger.info("Loaded %s in %.2fs", model_name, load_seconds)
+    return EmbeddingModel(model_name, device, backend, tokenizer, encoder, load_seconds)
+
+def get_model(model_name=None, device=None, backend=None):
+    """
+    Return the shared EmbeddingModel for model_name/device/backend, loading it on first use
+    """
+    model_name = model_name or Config.EMBEDDING_MODEL_NAME
+    backend = backend or Config.EMBEDDING_BACKEND
+    device = resolve_device(device, backend)
+    key = (model_name, device, backend)
+
+    entry = _models.get(key)
+    if entry is not None:
+        return entry
+
+    with _lock:
+        # Another thread may have finished loading while we waited for the lock
+        entry = _models.get(key)
+        if entry is None:
+            entry = _load_model(model_name, device, backend)
+            _models[key] = entry
+    return entry
+
+def warmup(model_name=None, device=None):
+    """
+    Load the configured embedding model ahead of the first request.
+
+    Called from create_app(); with gunicorn --preload this runs once in the
+    master so workers share the weights copy-on-write after fork. The embedding
+    cache's most recently used entries are loaded the same way.
+    """
+    try:
+        entry = get_model(model_name, device)
+    except Exception as e:
+        # Keep the app bootable; the first request will retry the load
+        logger.exception("Error warming up embedding model: %s", e)
+        return
+    loaded = embedding_cache.warm_start(entry.model_id)
+    if loaded:
+        logger.info("Loaded %d cached segment embeddings", loaded)
+
+def get_model_metrics():
+    """Return load time per model and the process resident memory"""
+    return {
+        'models': [
+            {
+                'model_name': entry.model_name,
+                'device': entry.device,
+                'backend': entry.backend,
+                'load_seconds': entry.load_seconds,
+                'loaded_at': entry.loaded_at
+            }
+            for entry in list(_models.values())
+        ],
+        'inference_threads': inference_threads(),
+        'resident_memory_bytes': resident_memory_bytes()
+    }
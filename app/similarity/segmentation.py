@@ -0,0 +1,79 @@
+from config import Config
+
+# OCR text comes as many short lines (LaTeX rows, bullet markers, single words)
+# and the odd very long one. Segments are what gets embedded: short consecutive
+# lines are merged until they hold SEGMENT_MIN_TOKENS tokens, and lines longer
+# than the model's sequence length are cut into windows instead of being
+# truncated. Every segment remembers the original lines it covers.
+
+class TextSegment(str):
+    """Segment text that remembers the 1-based range of original lines it came from"""
+
+    def __new__(cls, text, first_line, last_line):
+        instance = super().__new__(cls, text)
+        instance.first_line = first_line
+        instance.last_line = last_line
+        return instance
+
+def max_content_tokens(tokenizer, max_tokens=None):
+    """Tokens of text that fit one forward pass, leaving room for [CLS]/[SEP]"""
+    max_tokens = min(max_tokens or Config.SEGMENT_MAX_TOKENS, tokenizer.model_max_length)
+    return max(1, max_tokens - tokenizer.num_special_tokens_to_add())
+
+def _windows(tokenizer, line, ids, offsets, size):
+    """Cut one over-long line into pieces of at most size tokens"""
+    pieces = []
+    for start in range(0, len(ids), size):
+        end = min(start + size, len(ids))
+        if offsets is not None:
+            # Slice the original text so nothing is lost to detokenization
+            pieces.append(line[offsets[start][0]:offsets[end - 1][1]])
+        else:
+            pieces.append(tokenizer.decode(ids[start:end]))
+    return pieces
+
+def segment_text(text, tokenizer, max_tokens=None, min_tokens=None):
+    """
+    Split text into TextSegments sized for the embedding model.
+
+    Lines are tokenized once. A segment is closed once it holds min_tokens tokens,
+    or when the next line would overflow the sequence length; lines that alone
+    exceed it are split into consecutive windows.
+    """
+    numbered = [(number, line.strip()) for number, line in enumerate(text.split('\n'), 1) if line.strip()]
+    if not numbered:
+        return []
+
+    min_tokens = min_tokens or Config.SEGMENT_MIN_TOKENS
+    size = max_content_tokens(tokenizer, max_tokens)
+    lines = [line for _, line in numbered]
+    if getattr(tokenizer, 'is_fast', False):
+        encoded = tokenizer(lines, add_special_tokens=False, return_offsets_mapping=True)
+        all_offsets = encoded['offset_mapping']
+    else:
+        encoded = tokenizer(lines, add_special_tokens=False)
+        all_offsets = [None] * len(lines)
+
+    segments = []
+    pending = []
+    pending_tokens = 0
+
+    def flush():
+        nonlocal pending, pending_tokens
+        if pending:
+            segments.append(TextSegment(' '.join(line for _, line in pending), pending[0][0], pending[-1][0]))
+        pending = []
+        pending_tokens = 0
+
+    for (number, line), ids, offsets in zip(numbered, encoded['input_ids'], all_offsets):
+        if len(ids) > size:
+            flush()
+            segments.extend(TextSegment(piece, number, number)
+                            for piece in _windows(tokenizer, line, ids, offsets, size))
+            continue
+        if pending and (pending_tokens >= min_tokens or pending_tokens + len(ids) > size):
+            flush()
+        pending.append((number, line))
+        pending_tokens += len(ids)
+    flush()
+    return segments
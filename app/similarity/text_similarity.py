@@ -1,109 +1,187 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from transformers import AutoTokenizer, AutoModel
-import torch
 import numpy as np
-from collections import defaultdict
-import nltk
-import os
-import sys
-
-# Set NLTK data path to project directory
-current_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-nltk_data_dir = os.path.join(current_dir, 'nltk_data')
-os.makedirs(nltk_data_dir, exist_ok=True)
-
-# Ensure NLTK data path is set correctly
-nltk.data.path = [nltk_data_dir] + nltk.data.path
-
-def ensure_nltk_packages():
-    """Ensure all required NLTK packages are downloaded"""
-    packages = {
-        'punkt': 'tokenizers/punkt',
-        'stopwords': 'corpora/stopwords',
-        'wordnet': 'corpora/wordnet'
-    }
-    
-    for package, path in packages.items():
-        try:
-            nltk.data.find(path)
-            print(f"Found {package} data")
-        except LookupError:
-            print(f"Downloading {package}")
-            try:
-                nltk.download(package, download_dir=nltk_data_dir, quiet=True)
-                print(f"Successfully downloaded {package}")
-            except Exception as e:
-                print(f"Error downloading {package}: {str(e)}")
-                sys.exit(1)
-
-# Ensure NLTK packages are available before proceeding
-ensure_nltk_packages()
+import logging
+from app.similarity.model_registry import get_model
+from app.similarity import embedding_cache
+from app.similarity.segmentation import segment_text
+from app.utils.instrumentation import instrumented
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def length_bucketed_batches(lengths, max_batch_size, token_budget):
+    """
+    Group segment indices into batches of similar token length.
+
+    Indices are sorted by length so padding stays small; a batch is closed once it
+    holds max_batch_size segments or padding it to its longest segment would
+    exceed token_budget tokens. Returns a list of index arrays.
+    """
+    batches = []
+    current = []
+    for index in np.argsort(lengths, kind='stable'):
+        # Sorted ascending, so the new segment is the longest in the batch
+        padded_tokens = (len(current) + 1) * lengths[index]
+        if current and (len(current) >= max_batch_size or padded_tokens > token_budget):
+            batches.append(np.array(current))
+            current = []
+        current.append(index)
+    if current:
+        batches.append(np.array(current))
+    return batches
+
+def mean_pool(token_embeddings, attention_mask):
+    """Average each row's token embeddings over its non-padding tokens"""
+    mask = np.asarray(attention_mask, dtype=np.float32)[:, :, None]
+    return (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+def normalize_embeddings(embeddings):
+    """L2-normalize embedding rows; all-zero rows stay zero"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def max_cosine_similarity(embeddings1, embeddings2, max_block_elements=None):
+    """
+    Return, for each row of embeddings1, its highest cosine similarity to any row of embeddings2.
+
+    The similarity matrix is computed one block of rows at a time so that at most
+    max_block_elements similarities are held in memory, however long the documents are.
+    """
+    normalized1 = normalize_embeddings(embeddings1)
+    normalized2 = normalize_embeddings(embeddings2)
+    max_block_elements = max_block_elements or Config.SIMILARITY_BLOCK_ELEMENTS
+    block_rows = max(1, max_block_elements // max(len(normalized2), 1))
+
+    best = np.empty(len(normalized1), dtype=np.float32)
+    for start in range(0, len(normalized1), block_rows):
+        block = normalized1[start:start + block_rows] @ normalized2.T
+        best[start:start + block_rows] = block.max(axis=1)
+    return best
+
+@instrumented('similarity')
+def pairwise_text_similarity(embeddings_list, max_block_elements=None):
+    """
+    Return an N x N matrix whose [i, j] entry equals compute_semantic_similarity(embeddings_list[i], embeddings_list[j]).
+
+    All documents' lines are stacked and normalized once; each block of rows of the
+    line-by-line similarity matrix is reduced to a best match per document with
+    np.maximum.reduceat, then averaged per source document with np.add.reduceat.
+    """
+    n_documents = len(embeddings_list)
+    result = np.zeros((n_documents, n_documents))
+    counts = np.array([len(embeddings) for embeddings in embeddings_list])
+    present = np.flatnonzero(counts > 0)
+    if len(present) == 0:
+        return result
+
+    stacked = normalize_embeddings(np.concatenate([embeddings_list[i] for i in present]))
+    present_counts = counts[present]
+    offsets = np.concatenate([[0], np.cumsum(present_counts)[:-1]])
+
+    max_block_elements = max_block_elements or Config.SIMILARITY_BLOCK_ELEMENTS
+    block_rows = max(1, max_block_elements // len(stacked))
+
+    # best[line, doc] = best cosine match of the line among the lines of doc
+    best = np.empty((len(stacked), len(present)), dtype=np.float32)
+    for start in range(0, len(stacked), block_rows):
+        block = stacked[start:start + block_rows] @ stacked.T
+        best[start:start + block_rows] = np.maximum.reduceat(block, offsets, axis=1)
+
+    means = np.add.reduceat(best.astype(np.float64), offsets, axis=0) / present_counts[:, None]
+    result[np.ix_(present, present)] = means
+    return result
 
 class SemanticAnalyzer:
-    def __init__(self):
+    def __init__(self, model_name=None, device=None, batch_size=None, token_budget=None, backend=None):
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained('sentence-transformers/paraphrase-MiniLM-L3-v2')
-            self.model = AutoModel.from_pretrained('sentence-transformers/paraphrase-MiniLM-L3-v2')
-            self.stop_words = set(stopwords.words('english'))
-            self.lemmatizer = WordNetLemmatizer()
+            # Model weights come from the process-wide registry and are only loaded once
+            embedding_model = get_model(model_name, device, backend)
+            self.tokenizer = embedding_model.tokenizer
+            self.encoder = embedding_model.encoder
+            self.device = embedding_model.device
+            self.model_id = embedding_model.model_id
+            self.batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+            self.token_budget = token_budget or Config.EMBEDDING_TOKEN_BUDGET
         except Exception as e:
-            print(f"Error initializing SemanticAnalyzer: {str(e)}")
+            logger.exception("Error initializing SemanticAnalyzer: %s", e)
             raise
 
     def preprocess_text(self, text):
-        """Preprocess text by splitting into lines"""
+        """Split text into model-sized TextSegments that map back to their original lines"""
         try:
-            # Split into lines and remove empty ones
-            lines = [line.strip() for line in text.split('\n') if line.strip()]
-            return lines
+            return segment_text(text, self.tokenizer)
         except Exception as e:
-            print(f"Error in preprocess_text: {str(e)}")
+            logger.exception("Error in preprocess_text: %s", e)
             raise
 
     def get_embeddings(self, segments):
-        """Get BERT embeddings for text segments"""
-        embeddings = []
-        
-        for segment in segments:
-            # Tokenize and get BERT embeddings
-            inputs = self.tokenizer(segment, padding=True, truncation=True, return_tensors='pt')
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-            
-            # Use mean pooling to get segment embedding
-            attention_mask = inputs['attention_mask']
-            token_embeddings = outputs.last_hidden_state
-            input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-            segment_embedding = torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-            
-            embeddings.append(segment_embedding.numpy()[0])
-        
-        return np.array(embeddings)
+        """
+        Get BERT embeddings for text segments as a float32 matrix (one row per segment).
+
+        Segments are looked up in the embedding cache by their whitespace-normalized
+        text; only distinct segments not cached yet reach the model.
+        """
+        if not segments:
+            return self.encode(segments)
+
+        normalized = [embedding_cache.normalize_segment(segment) for segment in segments]
+        distinct = list(dict.fromkeys(normalized))
+        position = {segment: i for i, segment in enumerate(distinct)}
+        cached = embedding_cache.get_many(self.model_id, distinct)
+        missing = [segment for i, segment in enumerate(distinct) if i not in cached]
+        if missing:
+            computed = self.encode(missing)
+            embedding_cache.put_many(self.model_id, missing, computed)
+            cached.update((position[segment], row) for segment, row in zip(missing, computed))
+
+        return np.stack([cached[position[segment]] for segment in normalized]).astype(np.float32, copy=False)
+
+    @instrumented('embed')
+    def encode(self, segments):
+        """Run the model on text segments, bypassing the embedding cache"""
+        hidden_size = self.encoder.hidden_size
+        if not segments:
+            return np.zeros((0, hidden_size), dtype=np.float32)
+
+        # Tokenize once without padding; each batch is padded only to its own longest segment
+        encoded = self.tokenizer(list(segments), truncation=True)
+        lengths = [len(ids) for ids in encoded['input_ids']]
+        embeddings = np.empty((len(segments), hidden_size), dtype=np.float32)
+
+        for batch in length_bucketed_batches(lengths, self.batch_size, self.token_budget):
+            batch_inputs = {key: [values[i] for i in batch] for key, values in encoded.items()}
+            inputs = dict(self.tokenizer.pad(batch_inputs, return_tensors='np'))
+            # The encoder (PyTorch or ONNX Runtime, see embedding_backends) returns the last hidden state
+            token_embeddings = self.encoder(inputs)
+
+            # Use mean pooling over non-padding tokens to get segment embeddings
+            embeddings[batch] = mean_pool(token_embeddings, inputs['attention_mask'])
+
+        return embeddings
 
     def compute_semantic_similarity(self, embeddings1, embeddings2):
         """Compute semantic similarity between two sets of embeddings"""
-        similarities = []
-        
-        for emb1 in embeddings1:
-            # Compute cosine similarity with each embedding in the second set
-            sims = [np.dot(emb1, emb2)/(np.linalg.norm(emb1)*np.linalg.norm(emb2)) for emb2 in embeddings2]
-            similarities.append(max(sims))  # Take best match
-        
-        return np.mean(similarities)
+        if len(embeddings1) == 0 or len(embeddings2) == 0:
+            return 0.0
+
+        # Best cosine match in the second set for each line of the first, averaged
+        return float(np.mean(max_cosine_similarity(embeddings1, embeddings2)))
+
+    def embed_text(self, text):
+        """Segment a text and embed its segments"""
+        segments = self.preprocess_text(text)
+        return segments, self.get_embeddings(segments)
 
     def analyze_semantic_consistency(self, text1, text2):
         """Analyze semantic consistency between two texts"""
-        # Preprocess and segment texts
-        segments1 = self.preprocess_text(text1)
-        segments2 = self.preprocess_text(text2)
-        
-        # Get embeddings
-        embeddings1 = self.get_embeddings(segments1)
-        embeddings2 = self.get_embeddings(segments2)
+        # Preprocess, segment and embed texts
+        segments1, embeddings1 = self.embed_text(text1)
+        segments2, embeddings2 = self.embed_text(text2)
         
+        return self.compare_embedded_texts(segments1, embeddings1, segments2, embeddings2)
+
+    def compare_embedded_texts(self, segments1, embeddings1, segments2, embeddings2):
+        """Similarity and internal consistency of two already embedded texts"""
         # Compute overall semantic similarity
         similarity = self.compute_semantic_similarity(embeddings1, embeddings2)
         
@@ -116,21 +194,28 @@ class SemanticAnalyzer:
         return similarity, consistency_analysis
 
     def analyze_internal_consistency(self, segments, embeddings):
-        """Analyze semantic consistency within a document line by line"""
+        """Analyze semantic consistency within a document segment by segment"""
         inconsistencies = []
-        
-        for i in range(len(segments)-1):
-            similarity = np.dot(embeddings[i], embeddings[i+1])/(np.linalg.norm(embeddings[i])*np.linalg.norm(embeddings[i+1]))
-            
-            # If similarity is less than 0.05 (95% different), mark as potential inconsistency
-            if similarity < 0.05:  # Changed threshold from 0.03 to 0.05
-                inconsistencies.append({
-                    'segment_index': i,
-                    'segment_text': segments[i],
-                    'next_segment_text': segments[i+1],
-                    'similarity_score': float(similarity),
-                    'line_number': i + 1  # Add line number for reference
-                })
+        if len(segments) < 2:
+            return inconsistencies
+
+        # Cosine similarity of every line with the next one, from rows normalized once
+        normalized = normalize_embeddings(embeddings)
+        adjacent_similarities = np.einsum('ij,ij->i', normalized[:-1], normalized[1:])
+
+        # If similarity is less than 0.05 (95% different), mark as potential inconsistency
+        for i in np.flatnonzero(adjacent_similarities < 0.05):  # Changed threshold from 0.03 to 0.05
+            i = int(i)
+            inconsistencies.append({
+                'segment_index': i,
+                'segment_text': str(segments[i]),
+                'next_segment_text': str(segments[i+1]),
+                'similarity_score': float(adjacent_similarities[i]),
+                # Original line numbers for reference (segments may span several lines)
+                'line_number': getattr(segments[i], 'first_line', i + 1),
+                'last_line_number': getattr(segments[i], 'last_line', i + 1),
+                'next_line_number': getattr(segments[i+1], 'first_line', i + 2)
+            })
         
         return inconsistencies
 
@@ -144,4 +229,24 @@ def compute_text_similarity(text1, text2):
     return {
         'similarity_score': float(similarity),
         'consistency_analysis': consistency_analysis
-    }
\ No newline at end of file
+    }
+
+def embed_text(text):
+    """
+    Segment and embed one text so it can be compared later without re-running the model
+    """
+    analyzer = SemanticAnalyzer()
+    return analyzer.embed_text(text)
+
+@instrumented('similarity')
+def compute_embedded_text_similarity(embedded1, embedded2):
+    """
+    Same result as compute_text_similarity, from the (segments, embeddings) pairs returned by embed_text
+    """
+    analyzer = SemanticAnalyzer()
+    similarity, consistency_analysis = analyzer.compare_embedded_texts(*embedded1, *embedded2)
+    
+    return {
+        'similarity_score': float(similarity),
+        'consistency_analysis': consistency_analysis
+    }
@@ -2,6 +2,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const form = document.getElementById('upload-form');
     const results = document.getElementById('results');
     const reportLink = document.getElementById('report-link');
+    const JOB_POLL_INTERVAL_MS = 1000;
 
     // Add drag and drop functionality
     document.querySelectorAll('.upload-box').forEach((box, index) => {
@@ -52,7 +53,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
         try {
             const formData = new FormData(form);
-            const response = await fetch('/compare', {
+            const response = await fetch('/jobs', {
                 method: 'POST',
                 body: formData
             });
@@ -62,44 +63,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(error.error || 'An error occurred');
             }
 
-            const data = await response.json();
-            
-            // Update results
-            if (data.text_similarity !== undefined) {
-                document.getElementById('text-similarity').textContent = 
-                    (data.text_similarity * 100).toFixed(1) + '%';
-            }
-            
-            if (data.handwriting_similarity !== undefined) {
-                document.getElementById('handwriting-similarity').textContent = 
-                    (data.handwriting_similarity * 100).toFixed(1) + '%';
-            }
-            
-            if (data.similarity_index !== undefined) {
-                document.getElementById('similarity-index').textContent = 
-                    (data.similarity_index * 100).toFixed(1) + '%';
-            }
-            
-            // Update variations
-            updateVariations('variations-doc1', data.variations.document1);
-            updateVariations('variations-doc2', data.variations.document2);
-            
-            // Update semantic consistency
-            updateSemanticConsistency('semantics-doc1', data.text_consistency.doc1);
-            updateSemanticConsistency('semantics-doc2', data.text_consistency.doc2);
-            
-            // Update report link
-            if (data.report_url) {
-                reportLink.href = data.report_url;
-                reportLink.style.display = 'block';
-            }
-            
-            // Show results
-            results.style.display = 'block';
+            // The comparison runs in the background; poll until it finishes
+            const job = await response.json();
+            const data = await waitForJob(job, progress => {
+                submitButton.textContent = `Analyzing... ${Math.round(progress)}%`;
+            });
             
-            // Scroll to results
-            results.scrollIntoView({ behavior: 'smooth' });
-
+            showResults(data);
         } catch (error) {
             console.error('Error:', error);
             alert(error.message || 'An error occurred during analysis');
@@ -110,6 +80,69 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    // Poll a comparison job until it completes, reporting overall progress
+    async function waitForJob(job, onProgress) {
+        while (true) {
+            const statusResponse = await fetch(job.status_url);
+            const status = await statusResponse.json();
+            if (!statusResponse.ok) {
+                throw new Error(status.error || 'An error occurred');
+            }
+
+            onProgress(status.progress || 0);
+
+            if (status.status === 'completed' || status.status === 'failed') {
+                const resultResponse = await fetch(job.result_url);
+                const result = await resultResponse.json();
+                if (!resultResponse.ok) {
+                    throw new Error(result.error || 'An error occurred');
+                }
+                return result;
+            }
+
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        }
+    }
+
+    // Render comparison results
+    function showResults(data) {
+        // Update results
+        if (data.text_similarity !== undefined) {
+            document.getElementById('text-similarity').textContent = 
+                (data.text_similarity * 100).toFixed(1) + '%';
+        }
+        
+        if (data.handwriting_similarity !== undefined) {
+            document.getElementById('handwriting-similarity').textContent = 
+                (data.handwriting_similarity * 100).toFixed(1) + '%';
+        }
+        
+        if (data.similarity_index !== undefined) {
+            document.getElementById('similarity-index').textContent = 
+                (data.similarity_index * 100).toFixed(1) + '%';
+        }
+        
+        // Update variations
+        updateVariations('variations-doc1', data.variations.document1);
+        updateVariations('variations-doc2', data.variations.document2);
+        
+        // Update semantic consistency
+        updateSemanticConsistency('semantics-doc1', data.text_consistency.doc1);
+        updateSemanticConsistency('semantics-doc2', data.text_consistency.doc2);
+        
+        // Update report link
+        if (data.report_url) {
+            reportLink.href = data.report_url;
+            reportLink.style.display = 'block';
+        }
+        
+        // Show results
+        results.style.display = 'block';
+        
+        // Scroll to results
+        results.scrollIntoView({ behavior: 'smooth' });
+    }
+
     // Function to update variations display
     function updateVariations(elementId, variations) {
         const container = document.getElementById(elementId);
@@ -168,6 +201,11 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
 
+        // Segments can span several original lines
+        const lineRange = inc => inc.last_line_number && inc.last_line_number !== inc.line_number
+            ? `Lines ${inc.line_number}-${inc.last_line_number}`
+            : `Line ${inc.line_number}`;
+
         const inconsistenciesHtml = inconsistencies.map(inc => {
             const similarityPercentage = (1 - inc.similarity_score) * 100;
             const processedText = inc.segment_text.trim();
@@ -177,7 +215,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
             return `
                 <div class="inconsistency-item">
-                    <div class="line-info">Line ${inc.line_number}</div>
+                    <div class="line-info">${lineRange(inc)}</div>
                     <div class="segment-text">
                         ${hasMath ? 
                             `<div class="latex-content">$${escapeLatex(processedText)}$</div>` :
@@ -185,7 +223,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         }
                     </div>
                     <div class="similarity-indicator similarity-low">
-                        ${similarityPercentage.toFixed(1)}% different from next line
+                        ${similarityPercentage.toFixed(1)}% different from next segment
                     </div>
                 </div>
             `;
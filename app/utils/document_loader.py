@@ -0,0 +1,178 @@
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
+import tempfile
+import threading
+import shutil
+import os
+from app.utils.image_preprocessing import PreprocessingSettings, preprocess_image, record_page
+from app.utils.instrumentation import stage, instrumented
+from config import Config
+
+MIME_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg'
+}
+
+# pdftoppm output formats for each page format
+POPPLER_FORMATS = {
+    'PNG': 'png',
+    'JPEG': 'jpeg'
+}
+
+class InMemoryPDF:
+    """
+    An uploaded PDF held in memory, with the file name it was uploaded under.
+
+    Accepted wherever a PDF path is: validation, Mathpix PDF mode and the OCR
+    cache read the bytes directly, and the file is only written out when poppler
+    needs to rasterize it.
+    """
+
+    def __init__(self, data, name='document.pdf'):
+        self.data = data
+        self.name = name
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f'InMemoryPDF({self.name!r}, {len(self.data)} bytes)'
+
+def source_name(source):
+    """File name of a PDF given as a path or an InMemoryPDF"""
+    if isinstance(source, InMemoryPDF):
+        return source.name
+    return os.path.basename(source)
+
+def source_bytes(source):
+    """Contents of a PDF given as a path or an InMemoryPDF"""
+    if isinstance(source, InMemoryPDF):
+        return source.data
+    with open(source, 'rb') as f:
+        return f.read()
+
+# Caps the number of page ranges being rasterized at once across the whole process,
+# and with it the number of decoded page bitmaps in memory
+_render_slots = threading.BoundedSemaphore(Config.RENDER_MAX_CONCURRENT)
+
+class RenderedDocument:
+    """
+    Pages of one PDF rasterized once and shared by the Mathpix and Vision extractors.
+
+    source is a path or an InMemoryPDF; poppler only reads files, so an
+    in-memory PDF is written once into the document's own scratch folder.
+
+    Pages are rendered lazily, RENDER_CHUNK_PAGES at a time, the first time any page
+    of a range is requested. poppler writes them straight to encoded files in a
+    scratch folder, so OCR of the first pages starts while later ones are still
+    unrendered and no decoded page images are held in the worker.
+
+    With PREPROCESS_ENABLED, each rendered page is passed through
+    image_preprocessing once and the smaller encoding replaces the rendered file.
+    """
+
+    def __init__(self, source, dpi=None, fmt=None, chunk_pages=None):
+        self.name = source_name(source)
+        self.dpi = dpi or Config.RENDER_DPI
+        self.format = (fmt or Config.RENDER_FORMAT).upper()
+        if self.format not in MIME_TYPES:
+            raise ValueError(f"Unsupported page format: {self.format}")
+        self.chunk_pages = chunk_pages or Config.RENDER_CHUNK_PAGES
+        self.preprocessing = PreprocessingSettings() if Config.PREPROCESS_ENABLED else None
+        if self.preprocessing and self.preprocessing.target_dpi:
+            # Rasterizing at the target DPI is far cheaper than resizing afterwards
+            self.dpi = min(self.dpi, self.preprocessing.target_dpi)
+
+        self._folder = tempfile.mkdtemp(prefix='pages_')
+        try:
+            if isinstance(source, InMemoryPDF):
+                self.file_path = os.path.join(self._folder, 'source.pdf')
+                with open(self.file_path, 'wb') as f:
+                    f.write(source.data)
+            else:
+                self.file_path = source
+            # Only reads the PDF header; raises PDFPageCountError/PDFSyntaxError for files poppler rejects
+            self._page_count = int(pdfinfo_from_path(self.file_path)['Pages'])
+        except Exception:
+            shutil.rmtree(self._folder, ignore_errors=True)
+            raise
+        self._paths = [None] * self._page_count
+        # (bytes as rasterized, bytes sent to OCR) per preprocessed page
+        self.page_sizes = [None] * self._page_count
+        # Per-chunk locks so concurrent OCR workers render different ranges in parallel
+        self._locks = [threading.Lock() for _ in range(0, self._page_count, self.chunk_pages)]
+
+    @property
+    def page_count(self):
+        return self._page_count
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.preprocessing.format if self.preprocessing else self.format]
+
+    def _render_chunk(self, chunk):
+        first = chunk * self.chunk_pages
+        last = min(first + self.chunk_pages, self._page_count)
+        with _render_slots, stage('rasterize'):
+            paths = convert_from_path(
+                self.file_path,
+                dpi=self.dpi,
+                first_page=first + 1,
+                last_page=last,
+                output_folder=self._folder,
+                output_file=f'c{chunk:06d}_',  # fixed width: the prefix also selects the files read back
+                fmt=POPPLER_FORMATS[self.format],
+                paths_only=True
+            )
+            # paths_only returns the files sorted by page number
+            for index, path in enumerate(paths, start=first):
+                self._paths[index] = self._preprocess_page(index, path) if self.preprocessing else path
+
+    @instrumented('encode')
+    def _preprocess_page(self, index, path):
+        """Replace a rendered page file with its preprocessed encoding"""
+        bytes_before = os.path.getsize(path)
+        with Image.open(path) as image:
+            encoded = preprocess_image(image, self.dpi, self.preprocessing)
+        processed_path = f'{os.path.splitext(path)[0]}.pre'
+        with open(processed_path, 'wb') as f:
+            f.write(encoded)
+        os.remove(path)
+        self.page_sizes[index] = (bytes_before, len(encoded))
+        record_page(bytes_before, len(encoded))
+        return processed_path
+
+    def page_path(self, index):
+        """Return the path of a rendered page, rendering its range on first access"""
+        if not 0 <= index < self._page_count:
+            raise IndexError(f"Page {index} out of range")
+        chunk = index // self.chunk_pages
+        with self._locks[chunk]:
+            if self._paths[index] is None:
+                self._render_chunk(chunk)
+            return self._paths[index]
+
+    def page_bytes(self, index):
+        """Return the encoded bytes of a page; they are read from disk, not kept in memory"""
+        with open(self.page_path(index), 'rb') as f:
+            return f.read()
+
+    def close(self):
+        """Remove the rendered page files (and the written-out copy of an in-memory PDF)"""
+        shutil.rmtree(self._folder, ignore_errors=True)
+        self._paths = [None] * self._page_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def load_document(source, dpi=None, fmt=None):
+    """
+    Open a PDF (path or InMemoryPDF) for page-by-page rasterization at the configured DPI and page format
+    """
+    return RenderedDocument(source, dpi, fmt)
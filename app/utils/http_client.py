@@ -0,0 +1,108 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from app.utils import instrumentation
+from config import Config
+
+# One keep-alive session and one bounded worker pool per OCR provider, shared by all requests
+_sessions = {}
+_executors = {}
+_lock = threading.Lock()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def provider_concurrency(provider):
+    """Maximum number of in-flight requests allowed for a provider"""
+    limits = {
+        'mathpix': Config.MATHPIX_CONCURRENCY,
+        'vision': Config.VISION_CONCURRENCY
+    }
+    return limits.get(provider, 4)
+
+def get_session(provider):
+    """
+    Return the pooled session for a provider, retrying 429/5xx responses with exponential backoff
+    """
+    with _lock:
+        session = _sessions.get(provider)
+        if session is None:
+            retry = Retry(
+                total=Config.OCR_MAX_RETRIES,
+                backoff_factor=Config.OCR_RETRY_BACKOFF,
+                # A read timeout may come after the provider accepted (and billed) a POST, so
+                # only connection failures and 429/5xx responses are retried
+                read=0,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(['GET', 'POST']),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=provider_concurrency(provider),
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[provider] = session
+        return session
+
+def _request(provider, method, url, **kwargs):
+    """Send one request, recorded as a call of the provider's instrumentation stage"""
+    kwargs.setdefault('timeout', Config.OCR_TIMEOUT)
+    with instrumentation.stage(provider):
+        try:
+            response = get_session(provider).request(method, url, **kwargs)
+        except requests.RequestException:
+            instrumentation.record_api_call(provider, 'error', 0, 0)
+            raise
+    body = response.request.body or b''
+    instrumentation.record_api_call(provider, response.status_code, len(body), len(response.content))
+    return response
+
+def post(provider, url, **kwargs):
+    """POST through the provider's pooled session with the configured timeout"""
+    return _request(provider, 'POST', url, **kwargs)
+
+def get(provider, url, **kwargs):
+    """GET through the provider's pooled session with the configured timeout"""
+    return _request(provider, 'GET', url, **kwargs)
+
+def _get_executor(provider):
+    with _lock:
+        executor = _executors.get(provider)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=provider_concurrency(provider),
+                thread_name_prefix=f'ocr-{provider}'
+            )
+            _executors[provider] = executor
+        return executor
+
+def map_pages(provider, func, items, progress=None):
+    """
+    Run func over items concurrently on the provider's bounded pool.
+
+    Results are returned in the order of items, whatever order the requests finish in.
+    progress, if given, is called as progress(done, total) after each item completes.
+    """
+    executor = _get_executor(provider)
+    # Pages are processed on pool threads; keep them attributed to the caller's request
+    futures = [executor.submit(instrumentation.in_context(func), item) for item in items]
+    if progress is not None:
+        total = len(futures)
+        counter = {'done': 0}
+        counter_lock = threading.Lock()
+
+        def on_done(_future):
+            with counter_lock:
+                counter['done'] += 1
+                done = counter['done']
+            progress(done, total)
+
+        for future in futures:
+            future.add_done_callback(on_done)
+    return [future.result() for future in futures]
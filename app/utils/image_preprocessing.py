@@ -0,0 +1,104 @@
+from PIL import Image, ImageOps
+import threading
+import io
+from config import Config
+
+# Bytes per page before and after preprocessing, for this process
+_stats = {'pages': 0, 'bytes_before': 0, 'bytes_after': 0}
+_stats_lock = threading.Lock()
+
+class PreprocessingSettings:
+    """One preprocessing configuration; defaults come from Config.PREPROCESS_*"""
+
+    def __init__(self, grayscale=None, binarize=None, binarize_threshold=None, target_dpi=None,
+                 crop_margins=None, crop_padding=None, fmt=None, jpeg_quality=None):
+        self.grayscale = Config.PREPROCESS_GRAYSCALE if grayscale is None else grayscale
+        self.binarize = Config.PREPROCESS_BINARIZE if binarize is None else binarize
+        self.binarize_threshold = binarize_threshold or Config.PREPROCESS_BINARIZE_THRESHOLD
+        self.target_dpi = Config.PREPROCESS_TARGET_DPI if target_dpi is None else target_dpi
+        self.crop_margins = Config.PREPROCESS_CROP_MARGINS if crop_margins is None else crop_margins
+        self.crop_padding = Config.PREPROCESS_CROP_PADDING if crop_padding is None else crop_padding
+        self.format = (fmt or Config.PREPROCESS_FORMAT).upper()
+        self.jpeg_quality = jpeg_quality or Config.PREPROCESS_JPEG_QUALITY
+        if self.format not in ('PNG', 'JPEG'):
+            raise ValueError(f"Unsupported preprocessing format: {self.format}")
+
+    def describe(self):
+        return {
+            'grayscale': self.grayscale,
+            'binarize': self.binarize,
+            'target_dpi': self.target_dpi,
+            'crop_margins': self.crop_margins,
+            'format': self.format,
+            'jpeg_quality': self.jpeg_quality if self.format == 'JPEG' else None
+        }
+
+def crop_to_content(image, threshold=250, padding=16):
+    """Crop near-white page margins, keeping padding pixels around the ink"""
+    # getbbox() finds non-zero pixels, so invert: ink becomes bright, paper black
+    ink = ImageOps.invert(image.convert('L')).point(lambda value: 255 if value > 255 - threshold else 0)
+    bbox = ink.getbbox()
+    if bbox is None:
+        # Blank page: nothing to crop to
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(left - padding, 0),
+        max(top - padding, 0),
+        min(right + padding, image.width),
+        min(bottom + padding, image.height)
+    ))
+
+def preprocess_image(image, source_dpi, settings=None):
+    """
+    Apply the preprocessing steps to a page image and return the encoded bytes.
+
+    Order matters for cost: downscale first so the remaining steps touch fewer pixels.
+    """
+    settings = settings or PreprocessingSettings()
+
+    if settings.target_dpi and settings.target_dpi < source_dpi:
+        scale = settings.target_dpi / source_dpi
+        image = image.resize(
+            (max(round(image.width * scale), 1), max(round(image.height * scale), 1)),
+            Image.LANCZOS
+        )
+
+    if settings.grayscale or settings.binarize:
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    if settings.crop_margins:
+        image = crop_to_content(image, padding=settings.crop_padding)
+
+    if settings.binarize:
+        threshold = settings.binarize_threshold
+        image = image.point(lambda value: 255 if value > threshold else 0, mode='1')
+
+    output = io.BytesIO()
+    if settings.format == 'JPEG':
+        if image.mode == '1':
+            # JPEG has no 1-bit mode
+            image = image.convert('L')
+        image.save(output, format='JPEG', quality=settings.jpeg_quality, optimize=True)
+    else:
+        image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+def record_page(bytes_before, bytes_after):
+    with _stats_lock:
+        _stats['pages'] += 1
+        _stats['bytes_before'] += bytes_before
+        _stats['bytes_after'] += bytes_after
+
+def get_preprocessing_stats():
+    """Return the active settings and average bytes per page before and after preprocessing"""
+    with _stats_lock:
+        stats = dict(_stats)
+    pages = stats['pages']
+    stats['enabled'] = Config.PREPROCESS_ENABLED
+    stats['settings'] = PreprocessingSettings().describe() if Config.PREPROCESS_ENABLED else None
+    stats['bytes_per_page_before'] = stats['bytes_before'] / pages if pages else 0
+    stats['bytes_per_page_after'] = stats['bytes_after'] / pages if pages else 0
+    return stats
@@ -0,0 +1,253 @@
+from contextlib import contextmanager
+import contextvars
+import functools
+import resource
+import threading
+import time
+import sys
+import os
+import re
+
+# Stage-level instrumentation. Every instrumented call records its wall time,
+# the CPU time of the calling thread and, for provider HTTP calls, request
+# counts and bytes sent/received. Memory is not attributed to stages, which
+# overlap across threads; the process RSS and its peak (ru_maxrss) are sampled
+# once per scrape or per request breakdown instead. Totals live in
+# this process and are rendered for Prometheus by render_prometheus(); a
+# Recorder bound with bind_recorder() also collects them per request.
+#
+# Metrics are per process: with several gunicorn workers each one reports its
+# own totals, so scrape every worker or sum them in Prometheus.
+
+INSTRUMENTED_STAGES = ('rasterize', 'encode', 'mathpix', 'vision', 'embed', 'similarity', 'anomaly_detection',
+                       'report')
+
+# Histogram buckets for stage and request durations, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+METRIC_PREFIX = 'pdfcompare'
+
+_recorder = contextvars.ContextVar('instrumentation_recorder', default=None)
+_lock = threading.Lock()
+
+def resident_memory_bytes():
+    """Return the resident set size of the current process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No /proc (e.g. macOS): fall back to peak RSS
+        return peak_memory_bytes()
+
+def peak_memory_bytes():
+    """Return the largest resident set size the current process has reached, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Histogram:
+    """Cumulative Prometheus-style histogram of durations"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class StageTotals:
+    """Accumulated measurements of one stage"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def add(self, wall_seconds, cpu_seconds, error):
+        self.calls += 1
+        self.errors += int(error)
+        self.wall_seconds += wall_seconds
+        self.cpu_seconds += cpu_seconds
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received
+        }
+
+class Recorder:
+    """
+    Per-request stage totals.
+
+    Wall and CPU seconds are summed over calls, which overlap when pages are
+    processed concurrently, so a stage's wall_seconds can exceed the request time.
+    breakdown() adds the process's peak RSS, sampled once when it is called.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def _totals(self, stage):
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = StageTotals()
+        return totals
+
+    def breakdown(self):
+        with self._lock:
+            stages = {stage: totals.as_dict() for stage, totals in self.stages.items()}
+        return {'stages': stages, 'peak_rss_bytes': peak_memory_bytes()}
+
+# Process-wide metrics
+_stage_totals = {}
+_stage_histograms = {}
+_pipeline_histograms = {}
+_request_histograms = {}
+_api_calls = {}
+
+def _record_stage(stage, wall_seconds, cpu_seconds, error):
+    with _lock:
+        _stage_totals.setdefault(stage, StageTotals()).add(wall_seconds, cpu_seconds, error)
+        _stage_histograms.setdefault(stage, Histogram()).observe(wall_seconds)
+    recorder = _recorder.get()
+    if recorder is not None:
+        with recorder._lock:
+            recorder._totals(stage).add(wall_seconds, cpu_seconds, error)
+
+@contextmanager
+def stage(name):
+    """Measure the enclosed block as one call of stage name"""
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _record_stage(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start, error)
+
+def instrumented(name):
+    """Decorator form of stage()"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_api_call(provider, status, bytes_sent, bytes_received):
+    """Count one provider HTTP request (status is the HTTP status code or 'error')"""
+    with _lock:
+        key = (provider, str(status))
+        _api_calls[key] = _api_calls.get(key, 0) + 1
+        totals = _stage_totals.setdefault(provider, StageTotals())
+        totals.bytes_sent += bytes_sent
+        totals.bytes_received += bytes_received
+    recorder = _recorder.get()
+    if recorder is not None:
+        with recorder._lock:
+            totals = recorder._totals(provider)
+            totals.bytes_sent += bytes_sent
+            totals.bytes_received += bytes_received
+
+def record_pipeline_stage(name, seconds):
+    """Observe a pipeline stage duration; per-document stages (embed_document1, ...) share one series"""
+    name = re.sub(r'\d+$', '', name)
+    with _lock:
+        _pipeline_histograms.setdefault(name, Histogram()).observe(seconds)
+
+def record_request(endpoint, status, seconds):
+    with _lock:
+        _request_histograms.setdefault((endpoint, str(status)), Histogram()).observe(seconds)
+
+def bind_recorder(recorder, func):
+    """Return func running in a copy of the current context whose stages are collected by recorder"""
+    context = contextvars.copy_context()
+    context.run(_recorder.set, recorder)
+    return functools.partial(context.run, func)
+
+def in_context(func):
+    """
+    Bind func to a copy of the caller's context, so stages it runs on another
+    thread are attributed to the caller's Recorder. Wrap once per submitted task.
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+def _render_histogram(lines, name, help_text, histograms):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in histograms:
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {count}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+        lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+def _render_counter(lines, name, help_text, kind, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(**labels)} {value}')
+
+def render_prometheus(extra_counters=()):
+    """
+    Render this process's metrics in the Prometheus text exposition format.
+
+    extra_counters are (name, help, type, [(labels, value), ...]) tuples, e.g. cache statistics.
+    """
+    with _lock:
+        stage_histograms = sorted(_stage_histograms.items())
+        stage_totals = sorted((stage, totals.as_dict()) for stage, totals in _stage_totals.items())
+        pipeline_histograms = sorted(_pipeline_histograms.items())
+        request_histograms = sorted(_request_histograms.items())
+        api_calls = sorted(_api_calls.items())
+
+    prefix = METRIC_PREFIX
+    lines = []
+    _render_histogram(lines, f'{prefix}_stage_seconds', 'Wall time of instrumented stage calls',
+                      [({'stage': stage}, histogram) for stage, histogram in stage_histograms])
+    for field, name, help_text in (
+        ('cpu_seconds', 'stage_cpu_seconds_total', 'CPU time of the calling thread in instrumented stages'),
+        ('errors', 'stage_errors_total', 'Instrumented stage calls that raised'),
+        ('bytes_sent', 'api_bytes_sent_total', 'Request bytes sent to OCR providers'),
+        ('bytes_received', 'api_bytes_received_total', 'Response bytes received from OCR providers')
+    ):
+        _render_counter(lines, f'{prefix}_{name}', help_text, 'counter',
+                        [({'stage': stage}, totals[field]) for stage, totals in stage_totals])
+    _render_counter(lines, f'{prefix}_api_calls_total', 'OCR provider HTTP requests by status', 'counter',
+                    [({'provider': provider, 'status': status}, count) for (provider, status), count in api_calls])
+    _render_histogram(lines, f'{prefix}_pipeline_stage_seconds', 'Wall time of comparison pipeline stages',
+                      [({'stage': name}, histogram) for name, histogram in pipeline_histograms])
+    _render_histogram(lines, f'{prefix}_request_seconds', 'HTTP request latency',
+                      [({'endpoint': endpoint, 'status': status}, histogram)
+                       for (endpoint, status), histogram in request_histograms])
+    for name, help_text, kind, samples in extra_counters:
+        _render_counter(lines, f'{prefix}_{name}', help_text, kind, samples)
+    _render_counter(lines, 'process_resident_memory_bytes', 'Resident memory size in bytes', 'gauge',
+                    [({}, resident_memory_bytes())])
+    _render_counter(lines, f'{prefix}_process_peak_resident_memory_bytes',
+                    'Largest resident memory size this process has reached', 'gauge', [({}, peak_memory_bytes())])
+    return '\n'.join(lines) + '\n'
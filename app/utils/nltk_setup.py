@@ -0,0 +1,60 @@
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# NLTK corpora live in the project so workers never depend on a user-level download
+NLTK_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'nltk_data')
+
+# Package name -> resource path checked with nltk.data.find
+NLTK_PACKAGES = {
+    'punkt': 'tokenizers/punkt',
+    'stopwords': 'corpora/stopwords',
+    'wordnet': 'corpora/wordnet'
+}
+
+_configured = False
+_lock = threading.Lock()
+
+def configure_nltk():
+    """Import nltk and point it at NLTK_DATA_DIR; cheap after the first call"""
+    global _configured
+    import nltk
+    with _lock:
+        if not _configured:
+            if NLTK_DATA_DIR not in nltk.data.path:
+                nltk.data.path.insert(0, NLTK_DATA_DIR)
+            _configured = True
+    return nltk
+
+def missing_nltk_packages(packages=None):
+    """Return the packages whose data cannot be found locally (no network access)"""
+    nltk = configure_nltk()
+    missing = []
+    for package in packages or NLTK_PACKAGES:
+        try:
+            nltk.data.find(NLTK_PACKAGES[package])
+        except LookupError:
+            missing.append(package)
+    return missing
+
+def ensure_nltk_packages(packages=None, download=True):
+    """
+    Make sure NLTK data is present, downloading missing packages into NLTK_DATA_DIR.
+
+    With download=False nothing is fetched. Returns the packages still missing
+    instead of exiting, so callers decide whether that is fatal.
+    """
+    missing = missing_nltk_packages(packages)
+    if missing and download:
+        nltk = configure_nltk()
+        os.makedirs(NLTK_DATA_DIR, exist_ok=True)
+        for package in missing:
+            logger.info("Downloading %s", package)
+            try:
+                nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True)
+            except Exception as e:
+                logger.warning("Error downloading %s: %s", package, e)
+        missing = missing_nltk_packages(packages)
+    return missing
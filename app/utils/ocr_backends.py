@@ -0,0 +1,300 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import logging
+import threading
+import shutil
+import os
+import io
+from app.utils import ocr_cache
+from app.utils.pdf_processor import extract_text_from_pdf
+from app.similarity.handwriting_similarity import (extract_handwriting_features, page_features_from_response,
+                                                   HandwritingFeatures)
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Text and handwriting extraction go through named backends so a request can pick
+# its OCR engines and fall back to the next one when an engine fails. Handwriting
+# backends must produce Vision-shaped annotations (pages/blocks/paragraphs/words/
+# symbols) so the feature code stays provider-independent.
+
+class OCRText(str):
+    """Extracted text that remembers which backend produced it"""
+
+    def __new__(cls, text, backend=None):
+        instance = super().__new__(cls, text)
+        instance.backend = backend
+        return instance
+
+class OCRBackend:
+    """
+    Base class for OCR engines.
+
+    kinds lists what the backend can do: 'text' (extract_text) and/or
+    'handwriting' (extract_handwriting).
+    """
+    name = None
+    kinds = ()
+
+    def available(self):
+        """Whether the engine can run in this process at all; unavailable backends are skipped"""
+        return True
+
+    def extract_text(self, file_path, document, bypass_cache=False, progress=None):
+        """Return the document text, or an empty string on failure"""
+        raise NotImplementedError
+
+    def extract_handwriting(self, document, bypass_cache=False, progress=None):
+        """Return HandwritingFeatures for the document"""
+        raise NotImplementedError
+
+class MathpixBackend(OCRBackend):
+    name = 'mathpix'
+    kinds = ('text',)
+
+    def extract_text(self, file_path, document, bypass_cache=False, progress=None):
+        return extract_text_from_pdf(file_path, bypass_cache, document, progress)
+
+class VisionBackend(OCRBackend):
+    name = 'vision'
+    kinds = ('handwriting',)
+
+    def extract_handwriting(self, document, bypass_cache=False, progress=None):
+        api_key = os.environ.get('GOOGLE_CLOUD_API_KEY')
+        return extract_handwriting_features(document, api_key, bypass_cache, progress)
+
+def tesseract_to_annotation(data):
+    """
+    Convert pytesseract.image_to_data() output into a Vision-style annotation.
+
+    Tesseract only reports word confidences (0-100), so every symbol of a word
+    gets the word's confidence; the last symbol of each word carries a SPACE or,
+    at the end of a line, an EOL_SURE_SPACE break like Vision's.
+    """
+    words = [
+        {
+            'block': data['block_num'][i],
+            'paragraph': data['par_num'][i],
+            'line': data['line_num'][i],
+            'text': data['text'][i].strip(),
+            'confidence': max(float(data['conf'][i]), 0.0) / 100
+        }
+        for i in range(len(data['text']))
+        if data['level'][i] == 5 and data['text'][i].strip()
+    ]
+
+    def line_of(word):
+        return word['block'], word['paragraph'], word['line']
+
+    blocks = {}
+    lines = []
+    for i, word in enumerate(words):
+        end_of_line = i + 1 == len(words) or line_of(words[i + 1]) != line_of(word)
+        symbols = [{'text': character, 'confidence': word['confidence']} for character in word['text']]
+        symbols[-1]['property'] = {'detectedBreak': {'type': 'EOL_SURE_SPACE' if end_of_line else 'SPACE'}}
+
+        paragraphs = blocks.setdefault(word['block'], {})
+        paragraphs.setdefault(word['paragraph'], []).append({'symbols': symbols, 'confidence': word['confidence']})
+
+        if i == 0 or line_of(words[i - 1]) != line_of(word):
+            lines.append([])
+        lines[-1].append(word['text'])
+
+    return {
+        'fullTextAnnotation': {
+            'text': '\n'.join(' '.join(line) for line in lines),
+            'pages': [{
+                'blocks': [
+                    {
+                        'paragraphs': [
+                            {
+                                'confidence': sum(w['confidence'] for w in paragraph_words) / len(paragraph_words),
+                                'words': paragraph_words
+                            }
+                            for paragraph_words in paragraphs.values()
+                        ]
+                    }
+                    for paragraphs in blocks.values()
+                ]
+            }]
+        }
+    }
+
+def _tesseract_page(image_bytes, lang, psm, tesseract_cmd):
+    # Runs in a worker process
+    import pytesseract
+    from PIL import Image
+
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        data = pytesseract.image_to_data(image, lang=lang, config=f'--psm {psm}',
+                                         output_type=pytesseract.Output.DICT)
+    return tesseract_to_annotation(data)
+
+class TesseractBackend(OCRBackend):
+    """
+    Local OCR with Tesseract, one page per task on a process pool.
+
+    Requires the tesseract binary and the optional pytesseract package. One
+    Tesseract run per page serves both text and handwriting extraction: the
+    concurrent stages share the run of a page that is still in flight, and later
+    requests find it in the OCR cache.
+    """
+    name = 'tesseract'
+    kinds = ('text', 'handwriting')
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        # OCR cache key -> future of a page run not yet stored in the cache
+        self._in_flight = {}
+
+    def available(self):
+        try:
+            import pytesseract  # noqa: F401
+        except ImportError:
+            return False
+        return shutil.which(Config.TESSERACT_CMD) is not None
+
+    def _options(self):
+        # Part of the OCR cache key
+        return {'lang': Config.TESSERACT_LANG, 'psm': Config.TESSERACT_PSM}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs torch and request threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=Config.LOCAL_OCR_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def annotate_pages(self, document, bypass_cache=False, progress=None):
+        """Vision-style annotation for every page, in page order"""
+        options = self._options()
+        total = document.page_count
+        annotations = [None] * total
+        executor = self._get_executor()
+
+        # Submit each page as soon as it is rendered so rasterization overlaps OCR
+        pending = {}
+        for page_num in range(total):
+            img_bytes = document.page_bytes(page_num)
+            cached = ocr_cache.get('tesseract', img_bytes, options, bypass=bypass_cache)
+            if cached is not None:
+                annotations[page_num] = cached
+                continue
+            key = ocr_cache.make_key('tesseract', img_bytes, options)
+            with self._lock:
+                future = self._in_flight.get(key)
+                owner = future is None
+                if owner:
+                    future = executor.submit(_tesseract_page, img_bytes, options['lang'], options['psm'],
+                                             Config.TESSERACT_CMD)
+                    self._in_flight[key] = future
+            pending[page_num] = (img_bytes, key, future, owner)
+
+        done = total - len(pending)
+        if progress is not None and done:
+            progress(done, total)
+
+        try:
+            for page_num, (img_bytes, key, future, owner) in pending.items():
+                annotations[page_num] = future.result()
+                if owner:
+                    ocr_cache.put('tesseract', img_bytes, options, annotations[page_num], bypass=bypass_cache)
+                    self._release(key, future)
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+        finally:
+            # Pages not reached because of an error; later callers submit them again
+            for img_bytes, key, future, owner in pending.values():
+                if owner:
+                    self._release(key, future)
+        return annotations
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def extract_text(self, file_path, document, bypass_cache=False, progress=None):
+        annotations = self.annotate_pages(document, bypass_cache, progress)
+        return '\n\n'.join(annotation['fullTextAnnotation']['text'] for annotation in annotations)
+
+    def extract_handwriting(self, document, bypass_cache=False, progress=None):
+        annotations = self.annotate_pages(document, bypass_cache, progress)
+        return HandwritingFeatures.from_pages([page_features_from_response(annotation) for annotation in annotations])
+
+_backends = {}
+
+def register_backend(backend):
+    """Make an OCRBackend instance selectable by its name"""
+    _backends[backend.name] = backend
+
+for _backend in (MathpixBackend(), VisionBackend(), TesseractBackend()):
+    register_backend(_backend)
+
+def resolve_backends(names, kind):
+    """
+    Turn a comma-separated string or list of backend names into backends, in fallback order.
+
+    Defaults to TEXT_OCR_BACKENDS / HANDWRITING_OCR_BACKENDS; raises ValueError for
+    unknown names or backends that cannot do this kind of extraction.
+    """
+    if not names:
+        names = Config.TEXT_OCR_BACKENDS if kind == 'text' else Config.HANDWRITING_OCR_BACKENDS
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+
+    backends = []
+    for name in names:
+        backend = _backends.get(name)
+        if backend is None or kind not in backend.kinds:
+            raise ValueError(f"Unknown {kind} OCR backend: {name}")
+        backends.append(backend)
+    return backends
+
+def extract_text(file_path, document, backends=None, bypass_cache=False, progress=None):
+    """
+    Extract text with the first backend that returns any; the result's .backend names it
+    """
+    for backend in resolve_backends(backends, 'text'):
+        if not backend.available():
+            logger.info("OCR backend %s is not available, skipping", backend.name)
+            continue
+        try:
+            text = backend.extract_text(file_path, document, bypass_cache, progress)
+        except Exception as e:
+            logger.warning("Error extracting text with %s: %s", backend.name, e)
+            continue
+        if text:
+            return OCRText(text, backend.name)
+        logger.info("OCR backend %s returned no text, trying the next one", backend.name)
+    return OCRText('')
+
+def extract_handwriting(document, backends=None, bypass_cache=False, progress=None):
+    """
+    Extract handwriting features with the first backend that annotates any page.
+
+    The whole document always comes from one backend, since confidences are not
+    comparable across engines; the result's .backend names it.
+    """
+    for backend in resolve_backends(backends, 'handwriting'):
+        if not backend.available():
+            logger.info("OCR backend %s is not available, skipping", backend.name)
+            continue
+        try:
+            features = backend.extract_handwriting(document, bypass_cache, progress)
+        except Exception as e:
+            logger.warning("Error extracting handwriting features with %s: %s", backend.name, e)
+            continue
+        if features.page_count or not document.page_count:
+            features.backend = backend.name
+            return features
+        logger.info("OCR backend %s annotated no pages, trying the next one", backend.name)
+    features = HandwritingFeatures.from_pages([])
+    features.backend = None
+    return features
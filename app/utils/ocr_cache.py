@@ -0,0 +1,171 @@
+import sqlite3
+import logging
+import hashlib
+import json
+import os
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+)
+"""
+
+# Eviction sums the whole table, so each process runs it at most once per
+# _EVICT_INTERVAL seconds; reads already skip entries past OCR_CACHE_MAX_AGE
+_EVICT_INTERVAL = 60
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bypassed': 0}
+_stats_lock = threading.Lock()
+_initialized_paths = set()
+_next_evict_at = 0.0
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def _connect():
+    path = Config.OCR_CACHE_PATH
+    if path not in _initialized_paths:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _initialized_paths:
+        # WAL lets gunicorn workers read while another one writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(_SCHEMA)
+        conn.execute('CREATE INDEX IF NOT EXISTS ocr_results_accessed ON ocr_results (accessed_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ocr_results_created ON ocr_results (created_at)')
+        conn.commit()
+        _initialized_paths.add(path)
+    return conn
+
+def _enabled(bypass):
+    if bypass or not Config.OCR_CACHE_ENABLED:
+        _count('bypassed')
+        return False
+    return True
+
+def make_key(provider, image_bytes, options):
+    """
+    Build the cache key for one OCR call from the page image content and request options
+    """
+    digest = hashlib.sha256()
+    digest.update(provider.encode())
+    digest.update(b'\0')
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    digest.update(b'\0')
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+def get(provider, image_bytes, options, bypass=False):
+    """
+    Return the cached OCR result for this page image and options, or None on a miss
+    """
+    if not _enabled(bypass):
+        return None
+
+    key = make_key(provider, image_bytes, options)
+    min_created_at = time.time() - Config.OCR_CACHE_MAX_AGE
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                'SELECT value FROM ocr_results WHERE key = ? AND created_at >= ?',
+                (key, min_created_at)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE ocr_results SET accessed_at = ? WHERE key = ?', (time.time(), key))
+                conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("OCR cache read error: %s", e)
+        row = None
+
+    if row is None:
+        _count('misses')
+        return None
+    _count('hits')
+    return json.loads(row[0])
+
+def put(provider, image_bytes, options, result, bypass=False):
+    """
+    Store a successful OCR result, evicting old or excess entries at most every _EVICT_INTERVAL seconds
+    """
+    if bypass or not Config.OCR_CACHE_ENABLED:
+        return
+
+    key = make_key(provider, image_bytes, options)
+    value = json.dumps(result)
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO ocr_results (key, provider, value, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, provider, value, len(value.encode()), now, now)
+            )
+            if _evict_due(now):
+                _evict(conn, now)
+            conn.commit()
+        finally:
+            conn.close()
+        _count('stores')
+    except sqlite3.Error as e:
+        logger.warning("OCR cache write error: %s", e)
+
+def _evict_due(now):
+    global _next_evict_at
+    with _stats_lock:
+        if now < _next_evict_at:
+            return False
+        _next_evict_at = now + _EVICT_INTERVAL
+        return True
+
+def _evict(conn, now):
+    """Drop entries older than OCR_CACHE_MAX_AGE, then least recently used ones above OCR_CACHE_MAX_BYTES"""
+    evicted = conn.execute(
+        'DELETE FROM ocr_results WHERE created_at < ?', (now - Config.OCR_CACHE_MAX_AGE,)
+    ).rowcount
+
+    total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM ocr_results').fetchone()[0]
+    if total_size > Config.OCR_CACHE_MAX_BYTES:
+        excess = total_size - Config.OCR_CACHE_MAX_BYTES
+        keys = []
+        for key, size in conn.execute('SELECT key, size FROM ocr_results ORDER BY accessed_at'):
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        conn.executemany('DELETE FROM ocr_results WHERE key = ?', keys)
+        evicted += len(keys)
+
+    if evicted:
+        _count('evictions', evicted)
+
+def get_cache_stats():
+    """Return hit/miss counters for this process and the size of the on-disk store"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['enabled'] = Config.OCR_CACHE_ENABLED
+    try:
+        conn = _connect()
+        try:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_results').fetchone()
+        finally:
+            conn.close()
+        stats['entries'] = entries
+        stats['size_bytes'] = size
+    except sqlite3.Error as e:
+        logger.warning("OCR cache stats error: %s", e)
+    return stats
@@ -1,92 +1,187 @@
-import requests
 import os
+import time
+import json
 import base64
-from pdf2image import convert_from_path
-from PIL import Image
-import io
+import logging
+from app.utils import ocr_cache
+from app.utils import http_client
+from app.utils.document_loader import InMemoryPDF, load_document, source_bytes, source_name
+from config import Config
 
-def validate_pdf(file_path):
+logger = logging.getLogger(__name__)
+
+# Mathpix /v3/text options; also part of the OCR cache key
+MATHPIX_OPTIONS = {
+    'formats': ['text'],
+    'ocr': True,
+    'rm_spaces': True,
+    'enable_tables': True,
+    'enable_markdown': True,
+    'enable_math': True,
+    'enable_handwriting': True
+}
+
+# Mathpix /v3/pdf options; also part of the OCR cache key
+MATHPIX_PDF_OPTIONS = {
+    'rm_spaces': True,
+    'enable_tables_fallback': True
+}
+
+def _mathpix_headers():
+    return {
+        'app_id': os.environ.get('MATHPIX_APP_ID'),
+        'app_key': os.environ.get('MATHPIX_APP_KEY')
+    }
+
+def validate_pdf(source):
     """
-    Validate if the file is a valid PDF using basic signature check
+    Validate if the file (path or InMemoryPDF) is a valid PDF using basic signature check
     """
     try:
-        with open(file_path, 'rb') as file:
-            # Check PDF signature
-            header = file.read(5)
-            if header == b'%PDF-':
-                return True
-            return False
+        if isinstance(source, InMemoryPDF):
+            header = source.data[:5]
+        else:
+            with open(source, 'rb') as file:
+                header = file.read(5)
+        # Check PDF signature
+        return header == b'%PDF-'
     except Exception as e:
-        print(f"Validation error for {file_path}: {str(e)}")
+        logger.warning("Validation error for %s: %s", source, e)
         return False
 
-def extract_text_from_pdf(file_path):
+def extract_page_text(document, page_index, bypass_cache=False):
+    """
+    Extract the text of one rendered page with Mathpix; returns None if the page failed
+    """
+    # Encoded page bytes are shared with the handwriting extractor
+    img_byte_arr = document.page_bytes(page_index)
+    
+    # Reuse the OCR result if this exact page was already processed
+    result = ocr_cache.get('mathpix', img_byte_arr, MATHPIX_OPTIONS, bypass=bypass_cache)
+    if result is None:
+        # Convert to base64
+        img_base64 = base64.b64encode(img_byte_arr).decode()
+        
+        # Send request to Mathpix
+        url = f'{Config.MATHPIX_API_URL}/v3/text'
+        headers = dict(_mathpix_headers(), **{'Content-Type': 'application/json'})
+        data = dict(MATHPIX_OPTIONS, src=f'data:{document.mime_type};base64,{img_base64}')
+        
+        logger.debug("Sending request to Mathpix for %s page %d", document.file_path, page_index + 1)
+        response = http_client.post('mathpix', url, json=data, headers=headers)
+        
+        if response.status_code != 200:
+            logger.warning("Mathpix returned HTTP %d for %s page %d", response.status_code,
+                           document.file_path, page_index + 1)
+            return None
+            
+        result = response.json()
+        
+        if 'error' in result:
+            logger.warning("Mathpix error for %s page %d: %s %s", document.file_path, page_index + 1,
+                           result['error'], result.get('error_info', ''))
+            return None
+
+        ocr_cache.put('mathpix', img_byte_arr, MATHPIX_OPTIONS, result, bypass=bypass_cache)
+    else:
+        logger.debug("Using cached Mathpix result for %s page %d", document.file_path, page_index + 1)
+    
+    # Extract content
+    return result.get('text', '')
+
+def extract_text_with_pdf_api(file_path, bypass_cache=False, progress=None):
+    """
+    Extract the text of a whole PDF with one Mathpix /v3/pdf submission, polling until it is processed.
+
+    Returns None if the submission failed or timed out.
+    """
+    pdf_bytes = source_bytes(file_path)
+
+    cached = ocr_cache.get('mathpix_pdf', pdf_bytes, MATHPIX_PDF_OPTIONS, bypass=bypass_cache)
+    if cached is not None:
+        logger.debug("Using cached Mathpix PDF result for %s", file_path)
+        return cached['text']
+
+    logger.info("Submitting %s to Mathpix PDF processing", file_path)
+    response = http_client.post(
+        'mathpix',
+        f'{Config.MATHPIX_API_URL}/v3/pdf',
+        headers=_mathpix_headers(),
+        files={'file': (source_name(file_path), pdf_bytes, 'application/pdf')},
+        data={'options_json': json.dumps(MATHPIX_PDF_OPTIONS)}
+    )
+    if response.status_code != 200 or 'pdf_id' not in response.json():
+        logger.warning("Error submitting %s to Mathpix: HTTP %d", file_path, response.status_code)
+        return None
+    pdf_id = response.json()['pdf_id']
+
+    deadline = time.monotonic() + Config.MATHPIX_PDF_TIMEOUT
+    while True:
+        status = http_client.get('mathpix', f'{Config.MATHPIX_API_URL}/v3/pdf/{pdf_id}',
+                                 headers=_mathpix_headers()).json()
+        if progress is not None and status.get('num_pages'):
+            progress(status.get('num_pages_completed', 0), status['num_pages'])
+        if status.get('status') == 'completed':
+            break
+        if status.get('status') == 'error' or 'error' in status:
+            logger.warning("Mathpix PDF processing error for %s: %s", pdf_id, status.get('error', status.get('status')))
+            return None
+        if time.monotonic() > deadline:
+            logger.warning("Mathpix PDF processing timed out for %s", pdf_id)
+            return None
+        time.sleep(Config.MATHPIX_PDF_POLL_INTERVAL)
+
+    response = http_client.get('mathpix', f'{Config.MATHPIX_API_URL}/v3/pdf/{pdf_id}.mmd',
+                               headers=_mathpix_headers())
+    if response.status_code != 200:
+        logger.warning("Error fetching Mathpix PDF result for %s: HTTP %d", pdf_id, response.status_code)
+        return None
+
+    text = response.text
+    ocr_cache.put('mathpix_pdf', pdf_bytes, MATHPIX_PDF_OPTIONS, {'text': text}, bypass=bypass_cache)
+    return text
+
+def extract_text_from_pdf(file_path, bypass_cache=False, document=None, progress=None):
     """
     Extract text from PDF using Mathpix API
+
+    Pass an already rendered document to reuse its page images instead of
+    rasterizing the PDF again. progress(done, total) is called as pages complete.
+    With MATHPIX_MODE='pdf' the whole file goes to /v3/pdf instead, falling back to
+    per-page requests if that fails.
     """
+    if Config.MATHPIX_MODE == 'pdf':
+        try:
+            text = extract_text_with_pdf_api(file_path, bypass_cache, progress)
+            if text is not None:
+                logger.info("Extracted %d characters from %s", len(text), file_path)
+                return text
+        except Exception as e:
+            logger.warning("Error in Mathpix PDF processing, falling back to per-page requests: %s", e)
+
+    owns_document = document is None
     try:
-        # Convert PDF to images
-        images = convert_from_path(file_path)
-        all_text = []
+        # Convert PDF to images unless the caller already did
+        if owns_document:
+            document = load_document(file_path)
         
-        # Process each page
-        for i, image in enumerate(images):
-            # Save image to bytes
-            img_byte_arr = io.BytesIO()
-            image.save(img_byte_arr, format='PNG')
-            img_byte_arr = img_byte_arr.getvalue()
-            
-            # Convert to base64
-            img_base64 = base64.b64encode(img_byte_arr).decode()
-            
-            # Send request to Mathpix
-            url = 'https://api.mathpix.com/v3/text'
-            headers = {
-                'app_id': os.environ.get('MATHPIX_APP_ID'),
-                'app_key': os.environ.get('MATHPIX_APP_KEY'),
-                'Content-Type': 'application/json'
-            }
-            
-            print(f"Using Mathpix credentials - app_id: {headers['app_id']}, app_key: {headers['app_key'][:10]}...")
-            
-            data = {
-                'src': f'data:image/png;base64,{img_base64}',
-                'formats': ['text'],
-                'ocr': True,
-                'rm_spaces': True,
-                'enable_tables': True,
-                'enable_markdown': True,
-                'enable_math': True,
-                'enable_handwriting': True
-            }
-            
-            print(f"Sending request to Mathpix for {file_path} page {i+1}")
-            response = requests.post(url, json=data, headers=headers)
-            
-            if response.status_code != 200:
-                print(f"Error response from Mathpix: {response.status_code}")
-                print(f"Response content: {response.text}")
-                continue
-                
-            result = response.json()
-            print(f"Mathpix response for page {i+1}: {result}")
-            
-            if 'error' in result:
-                print(f"Mathpix error: {result['error']}")
-                if 'error_info' in result:
-                    print(f"Error info: {result['error_info']}")
-                continue
-            
-            # Extract content
-            text_content = result.get('text', '')
-            all_text.append(text_content)
+        # Send all pages concurrently; results come back in page order
+        page_texts = http_client.map_pages(
+            'mathpix',
+            lambda i: extract_page_text(document, i, bypass_cache),
+            range(document.page_count),
+            progress
+        )
+        all_text = [text for text in page_texts if text is not None]
         
         # Combine all text
         full_content = '\n\n'.join(all_text)
-        print(f"Extracted text length: {len(full_content)}")
+        logger.info("Extracted %d characters from %s", len(full_content), file_path)
         return full_content
             
     except Exception as e:
-        print(f"Error extracting text from PDF: {str(e)}")
-        print(f"Full error details: {str(e.__dict__)}")
-        return ""
\ No newline at end of file
+        logger.exception("Error extracting text from %s: %s", file_path, e)
+        return ""
+    finally:
+        if owns_document and document is not None:
+            document.close()
\ No newline at end of file
@@ -0,0 +1,211 @@
+import threading
+import logging
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from app.utils.report_generator import render_report, text_preview, json_default, REPORT_FORMATS
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Reports are rendered lazily: a comparison only stores the analysis results the
+# report is built from (<id>.spec.json in REPORT_FOLDER) and returns download
+# URLs. Each format (<id>.json, <id>.html, <id>.pdf) is rendered the first time
+# its URL is requested. The id is a hash of the stored results, so identical
+# results share one file and a rendered report never changes, which lets
+# clients cache it. Reports are dated by when their results were first
+# registered, which is stored alongside them but not hashed.
+#
+# Unused files are evicted by age and by total size. Rendered reports go first,
+# since they can be rebuilt from their results. Temporary files of writes that
+# never finished (a worker killed mid-render) are removed after _TEMP_MAX_AGE.
+
+# Bump when the report layout changes, so old renderings are not reused
+REPORT_VERSION = 3
+
+_SPEC_SUFFIX = '.spec.json'
+
+_TEMP_SUFFIX = '.tmp'
+
+# Seconds after which a temporary file is assumed abandoned; far longer than any render
+_TEMP_MAX_AGE = 3600
+
+REPORT_URL_PREFIX = '/reports/'
+
+REPORT_KINDS = ('comparison', 'batch')
+
+_REPORT_ID = re.compile(r'^[0-9a-f]{64}$')
+
+# Concurrent downloads of one report render it once per process; distinct reports render in parallel
+_render_locks = [threading.Lock() for _ in range(16)]
+
+_stats = {'registered': 0, 'hits': 0, 'renders': 0, 'misses': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def _path(report_id, fmt):
+    return os.path.join(Config.REPORT_FOLDER, f'{report_id}.{fmt}')
+
+def _spec_path(report_id):
+    return os.path.join(Config.REPORT_FOLDER, f'{report_id}{_SPEC_SUFFIX}')
+
+def valid_report_id(report_id):
+    return bool(_REPORT_ID.match(report_id))
+
+def report_url(report_id, fmt='pdf'):
+    return f'{REPORT_URL_PREFIX}{report_id}.{fmt}'
+
+def report_urls(report_id):
+    """Download URL of the report in every format"""
+    return {fmt: report_url(report_id, fmt) for fmt in REPORT_FORMATS}
+
+def register_report(kind, **fields):
+    """
+    Store the results a report of the given kind ('comparison' or 'batch') is rendered from.
+
+    fields are the generate_report/generate_batch_report keyword arguments. Returns the
+    report id; nothing is rendered yet.
+    """
+    if kind not in REPORT_KINDS:
+        raise ValueError(f"Unknown report kind: {kind}")
+    if kind == 'comparison':
+        # Only the beginning of each text is printed; don't store or hash the rest
+        fields['text1'] = text_preview(fields['text1'])
+        fields['text2'] = text_preview(fields['text2'])
+    spec = {'version': REPORT_VERSION, 'kind': kind, 'fields': fields}
+    report_id = hashlib.sha256(json.dumps(spec, sort_keys=True, default=json_default).encode()).hexdigest()
+
+    path = _spec_path(report_id)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        os.makedirs(Config.REPORT_FOLDER, exist_ok=True)
+        temp_path = _temp_path(path)
+        spec['registered_at'] = datetime.now().isoformat(timespec='seconds')
+        with open(temp_path, 'w') as f:
+            json.dump(spec, f, default=json_default)
+        os.replace(temp_path, path)
+        evict()
+    _count('registered')
+    return report_id
+
+def get_report(report_id, fmt='pdf'):
+    """
+    Return the path of report_id rendered in fmt, rendering it on first request.
+
+    Returns None for unknown or evicted reports.
+    """
+    if not valid_report_id(report_id) or fmt not in REPORT_FORMATS:
+        return None
+    report_path = _path(report_id, fmt)
+    spec_path = _spec_path(report_id)
+
+    with _render_locks[int(report_id[:8], 16) % len(_render_locks)]:
+        if os.path.exists(report_path):
+            _touch(report_path, spec_path)
+            _count('hits')
+            return report_path
+        try:
+            with open(spec_path) as f:
+                spec = json.load(f)
+        except FileNotFoundError:
+            _count('misses')
+            return None
+
+        # Render under a private name; os.replace publishes it atomically to other workers
+        temp_path = _temp_path(report_path)
+        try:
+            # Texts were cut to their preview when registered
+            render_report(spec['kind'], spec['fields'], fmt, temp_path,
+                          generated_at=datetime.fromisoformat(spec['registered_at']))
+            os.replace(temp_path, report_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        _touch(spec_path)
+        _count('renders')
+    evict()
+    return report_path
+
+def _temp_path(path):
+    """Private name to write path under before publishing it with os.replace"""
+    return f'{path}.{os.getpid()}.{threading.get_ident()}{_TEMP_SUFFIX}'
+
+def _touch(*paths):
+    """Mark files as recently used for eviction"""
+    for path in paths:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+def evict():
+    """
+    Remove abandoned temporary files and files unused for REPORT_CACHE_MAX_AGE, then the
+    least recently used ones until REPORT_FOLDER fits in REPORT_CACHE_MAX_BYTES (rendered
+    reports first).
+    """
+    now = time.time()
+    entries = []
+    stale_temp_paths = []
+    try:
+        with os.scandir(Config.REPORT_FOLDER) as listing:
+            for entry in listing:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(_TEMP_SUFFIX):
+                    if entry.stat().st_mtime < now - _TEMP_MAX_AGE:
+                        stale_temp_paths.append(entry.path)
+                elif entry.name.endswith(tuple(f'.{fmt}' for fmt in REPORT_FORMATS)):
+                    info = entry.stat()
+                    entries.append((entry.name.endswith(_SPEC_SUFFIX), info.st_mtime, info.st_size, entry.path))
+    except OSError:
+        return
+
+    removed = 0
+    for path in stale_temp_paths:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+
+    cutoff = now - Config.REPORT_CACHE_MAX_AGE
+    total_size = sum(size for _, _, size, _ in entries)
+    # Rendered reports (False) before results (True), least recently used first
+    for is_spec, mtime, size, path in sorted(entries):
+        if mtime >= cutoff and total_size <= Config.REPORT_CACHE_MAX_BYTES:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        removed += 1
+    if removed:
+        _count('evictions', removed)
+        logger.info("Evicted %d report files", removed)
+
+def get_cache_stats():
+    """Registration, render and eviction counters for this process, and the size of REPORT_FOLDER"""
+    with _stats_lock:
+        stats = dict(_stats)
+    files = 0
+    size = 0
+    try:
+        with os.scandir(Config.REPORT_FOLDER) as listing:
+            for entry in listing:
+                if entry.is_file():
+                    files += 1
+                    size += entry.stat().st_size
+    except OSError:
+        pass
+    stats['files'] = files
+    stats['bytes'] = size
+    return stats
@@ -1,11 +1,128 @@
 from fpdf import FPDF
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+import threading
 import os
+import uuid
+import json
+import logging
 from datetime import datetime
+from app.utils.instrumentation import instrumented
+from config import Config
 
-def generate_report(text_similarity, handwriting_similarity, similarity_index, text1, text2, 
-                   feature_scores=None, anomalies1=None, anomalies2=None, variations1=None, variations2=None):
+logger = logging.getLogger(__name__)
+
+# Characters of each document's text printed in the report
+TEXT_PREVIEW_CHARS = 1000
+
+# Report formats, cheapest first: compact JSON, one self-contained HTML page
+# (templates/report.html) or a PDF laid out with FPDF
+REPORT_FORMATS = ('json', 'html', 'pdf')
+
+MEDIA_TYPES = {
+    'json': 'application/json',
+    'html': 'text/html',
+    'pdf': 'application/pdf'
+}
+
+_TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+_environment = None
+_environment_lock = threading.Lock()
+
+def text_preview(text):
+    """The part of a text the report prints, with an ellipsis if it was cut"""
+    if len(text) <= TEXT_PREVIEW_CHARS:
+        return text
+    return text[:TEXT_PREVIEW_CHARS] + '...'
+
+def json_default(value):
+    """json.dumps fallback for the numpy scalars and arrays of the similarity code"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+def _default_output_path(prefix, fmt):
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return os.path.join(Config.REPORT_FOLDER, f'{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.{fmt}')
+
+def _get_environment():
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            _environment = Environment(loader=FileSystemLoader(_TEMPLATE_FOLDER),
+                                       autoescape=select_autoescape(['html']), trim_blocks=True, lstrip_blocks=True)
+        return _environment
+
+def render_json(kind, fields, generated_at):
+    """Compact JSON report of a 'comparison' or 'batch' result"""
+    report = {'kind': kind, 'generated_at': generated_at.isoformat(timespec='seconds'), **fields}
+    return json.dumps(report, separators=(',', ':'), default=json_default)
+
+def render_html(kind, fields, generated_at):
+    """Single-file HTML report of a 'comparison' or 'batch' result, with inline styles"""
+    return _get_environment().get_template('report.html').render(
+        kind=kind, generated_at=generated_at.strftime('%Y-%m-%d %H:%M:%S'), **fields)
+
+@instrumented('report')
+def render_report(kind, fields, fmt='pdf', output_path=None, generated_at=None):
+    """
+    Write the report of a 'comparison' or 'batch' result in fmt (see REPORT_FORMATS).
+
+    Comparison texts are printed as given, so pass them through text_preview first.
+    The report is dated generated_at (a datetime), or now if None.
+    Written to output_path, or to a new file in REPORT_FOLDER; returns the path.
+    """
+    if fmt not in REPORT_FORMATS:
+        raise ValueError(f"Unknown report format: {fmt}")
+    output_path = output_path or _default_output_path(
+        'similarity_report' if kind == 'comparison' else 'batch_similarity_report', fmt)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    generated_at = generated_at or datetime.now()
+    if fmt == 'pdf':
+        writer = _write_comparison_pdf if kind == 'comparison' else _write_batch_pdf
+        writer(output_path=output_path, generated_at=generated_at, **fields)
+    else:
+        render = render_json if fmt == 'json' else render_html
+        content = render(kind, fields, generated_at)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return output_path
+
+def generate_report(text_similarity, handwriting_similarity, similarity_index, text1, text2,
+                    feature_scores=None, anomalies1=None, anomalies2=None, variations1=None, variations2=None,
+                    output_path=None, fmt='pdf'):
     """
-    Generate a PDF report with similarity analysis results
+    Generate a report with similarity analysis results in fmt ('json', 'html' or 'pdf')
+
+    Written to output_path, or to a new file in REPORT_FOLDER; returns the path.
+    """
+    return render_report('comparison', {
+        'text_similarity': text_similarity,
+        'handwriting_similarity': handwriting_similarity,
+        'similarity_index': similarity_index,
+        'text1': text_preview(text1),
+        'text2': text_preview(text2),
+        'feature_scores': feature_scores,
+        'anomalies1': anomalies1,
+        'anomalies2': anomalies2,
+        'variations1': variations1,
+        'variations2': variations2
+    }, fmt, output_path)
+
+def generate_batch_report(documents, pairs, reference=None, output_path=None, fmt='pdf'):
+    """
+    Generate a single report summarizing a batch comparison in fmt ('json', 'html' or 'pdf')
+
+    Written to output_path, or to a new file in REPORT_FOLDER; returns the path.
+    """
+    return render_report('batch', {'documents': documents, 'pairs': pairs, 'reference': reference},
+                         fmt, output_path)
+
+def _write_comparison_pdf(text_similarity, handwriting_similarity, similarity_index, text1, text2,
+                          feature_scores=None, anomalies1=None, anomalies2=None, variations1=None, variations2=None,
+                          output_path=None, generated_at=None):
+    """
+    Lay out the comparison report with FPDF and write it to output_path
     """
     try:
         pdf = FPDF()
@@ -23,7 +140,7 @@ def generate_report(text_similarity, handwriting_similarity, similarity_index, t
         
         # Add date
         pdf.set_font('Arial', '', 12)
-        pdf.cell(effective_width, 10, f'Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}', 0, 1)
+        pdf.cell(effective_width, 10, f'Generated on: {(generated_at or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")}', 0, 1)
         pdf.ln(10)
         
         # Add similarity scores
@@ -121,23 +238,81 @@ def generate_report(text_similarity, handwriting_similarity, similarity_index, t
             pdf.set_font('Arial', 'B', 12)
             pdf.cell(effective_width, 8, f'Document {doc_num}:', 0, 1)
             pdf.set_font('Arial', '', 10)
-            # Split text into smaller chunks and add ellipsis if needed
-            text_preview = text[:1000] + ('...' if len(text) > 1000 else '')
-            pdf.multi_cell(effective_width, 5, text_preview)
+            pdf.multi_cell(effective_width, 5, text)
             pdf.ln(5)
         
         write_text_sample(text1, 1)
         write_text_sample(text2, 2)
         
         # Save the report
-        report_dir = 'reports'
-        os.makedirs(report_dir, exist_ok=True)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        report_path = os.path.join(report_dir, f'similarity_report_{timestamp}.pdf')
-        pdf.output(report_path)
+        pdf.output(output_path)
+        
+        return output_path
+        
+    except Exception as e:
+        logger.exception("Error in report generation: %s", e)
+        raise Exception(f"Error generating report: {str(e)}")
+
+def _write_batch_pdf(documents, pairs, reference=None, output_path=None, generated_at=None):
+    """
+    Lay out the batch report with FPDF and write it to output_path
+    """
+    try:
+        pdf = FPDF()
+        pdf.set_margins(15, 15, 15)
+        pdf.add_page()
+        
+        effective_width = pdf.w - pdf.l_margin - pdf.r_margin
+        
+        # Add header
+        pdf.set_font('Arial', 'B', 16)
+        pdf.cell(effective_width, 10, 'Batch Similarity Analysis Report', 0, 1, 'C')
+        pdf.ln(10)
+        
+        pdf.set_font('Arial', '', 12)
+        pdf.cell(effective_width, 10, f'Generated on: {(generated_at or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")}', 0, 1)
+        if reference:
+            pdf.cell(effective_width, 10, f'Reference document: {reference}', 0, 1)
+        pdf.ln(5)
+        
+        # Add document overview
+        pdf.set_font('Arial', 'B', 14)
+        pdf.cell(effective_width, 10, f'Documents ({len(documents)}):', 0, 1)
+        pdf.set_font('Arial', '', 10)
+        for document in documents:
+            pdf.multi_cell(effective_width, 5,
+                f"{document['name']}: {document['pages']} page(s), "
+                f"{document['anomaly_count']} handwriting anomalies, "
+                f"{document['variation_count']} page-to-page variations", 0)
+        pdf.ln(10)
+        
+        # Add ranked pairs table
+        pdf.set_font('Arial', 'B', 14)
+        pdf.cell(effective_width, 10, 'Most Similar Pairs:', 0, 1)
+        pdf.ln(2)
+        
+        name_width = effective_width * 0.3
+        score_width = (effective_width - 2 * name_width) / 3
+        pdf.set_font('Arial', 'B', 9)
+        for header, width in [('Document 1', name_width), ('Document 2', name_width),
+                              ('Text', score_width), ('Handwriting', score_width), ('Overall', score_width)]:
+            pdf.cell(width, 7, header, 1, 0, 'C')
+        pdf.ln()
+        
+        pdf.set_font('Arial', '', 9)
+        for pair in pairs:
+            pdf.cell(name_width, 6, pair['document1'][:40], 1)
+            pdf.cell(name_width, 6, pair['document2'][:40], 1)
+            pdf.cell(score_width, 6, f"{pair['text_similarity']:.2%}", 1, 0, 'R')
+            pdf.cell(score_width, 6, f"{pair['handwriting_similarity']:.2%}", 1, 0, 'R')
+            pdf.cell(score_width, 6, f"{pair['similarity_index']:.2%}", 1, 0, 'R')
+            pdf.ln()
+        
+        # Save the report
+        pdf.output(output_path)
         
-        return report_path
+        return output_path
         
     except Exception as e:
-        print(f"Detailed error in report generation: {str(e)}")
-        raise Exception(f"Error generating report: {str(e)}")
\ No newline at end of file
+        logger.exception("Error in batch report generation: %s", e)
+        raise Exception(f"Error generating batch report: {str(e)}")
@@ -0,0 +1,119 @@
+"""
+Check that the quantized and ONNX embedding backends agree with float32 PyTorch, and time them.
+
+    python benchmarks/embedding_parity.py --backends torch-int8 onnx onnx-int8 --min-cosine 0.99
+
+The reference is the float32 `torch` backend on the CPU. For every other backend
+this reports the per-segment cosine similarity to the reference embeddings, the
+change in the document similarity score that /compare would return, and the
+embedding throughput. Exits with status 1 if any segment's cosine falls below
+--min-cosine or a backend cannot be loaded. ONNX graphs are exported on first
+use if `python setup.py --export-onnx` has not been run.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from app.similarity.text_similarity import SemanticAnalyzer, normalize_embeddings
+from app.similarity.embedding_backends import inference_threads
+
+# Two short "documents" with a mix of lengths; override with --text
+SAMPLE_DOCUMENTS = [
+    "Photosynthesis converts light energy into chemical energy.\n"
+    "Chlorophyll absorbs mostly red and blue light.\n"
+    "The light reactions take place in the thylakoid membranes, producing ATP and NADPH.\n"
+    "The Calvin cycle fixes carbon dioxide into sugars.\n"
+    "Oxygen is released as a by-product.",
+    "Plants use sunlight to make their own food.\n"
+    "Green pigments in the leaves capture light.\n"
+    "In the first stage, energy carriers are made inside the chloroplast membranes.\n"
+    "Carbon from the air is then built into glucose.\n"
+    "The French Revolution began in 1789."
+]
+
+def embed(analyzer, segments, runs):
+    """Embeddings of segments, plus the median seconds per run"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        embeddings = analyzer.encode(segments)
+        timings.append(time.perf_counter() - start)
+    return embeddings, statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['torch-int8', 'onnx', 'onnx-int8'])
+    parser.add_argument('--text', nargs=2, metavar='FILE', help='two text files to use instead of the sample')
+    parser.add_argument('--runs', type=int, default=3, help='timed embedding runs per backend')
+    parser.add_argument('--min-cosine', type=float, default=0.99)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    documents = SAMPLE_DOCUMENTS
+    if args.text:
+        documents = []
+        for path in args.text:
+            with open(path) as f:
+                documents.append(f.read())
+
+    reference = SemanticAnalyzer(device='cpu', backend='torch')
+    segments = [reference.preprocess_text(document) for document in documents]
+    all_segments = segments[0] + segments[1]
+    reference_embeddings, reference_seconds = embed(reference, all_segments, args.runs)
+    split = len(segments[0])
+    reference_score = reference.compute_semantic_similarity(reference_embeddings[:split], reference_embeddings[split:])
+
+    results = {
+        'segments': len(all_segments),
+        'inference_threads': inference_threads(),
+        'reference': {'backend': 'torch', 'seconds': reference_seconds, 'similarity_score': reference_score},
+        'backends': []
+    }
+    failed = False
+    for backend in args.backends:
+        try:
+            analyzer = SemanticAnalyzer(device='cpu', backend=backend)
+        except Exception as e:
+            print(f"{backend}: could not load ({str(e)})")
+            results['backends'].append({'backend': backend, 'error': str(e)})
+            failed = True
+            continue
+        embeddings, seconds = embed(analyzer, all_segments, args.runs)
+        cosines = np.einsum('ij,ij->i', normalize_embeddings(embeddings), normalize_embeddings(reference_embeddings))
+        score = analyzer.compute_semantic_similarity(embeddings[:split], embeddings[split:])
+        results['backends'].append({
+            'backend': backend,
+            'seconds': seconds,
+            'speedup': reference_seconds / seconds if seconds else None,
+            'min_cosine': float(cosines.min()),
+            'mean_cosine': float(cosines.mean()),
+            'max_abs_difference': float(np.abs(embeddings - reference_embeddings).max()),
+            'similarity_score': score,
+            'similarity_score_delta': score - reference_score
+        })
+        failed = failed or cosines.min() < args.min_cosine
+
+    print(f"{len(all_segments)} segments, {results['inference_threads']} inference threads")
+    print(f"{'backend':<12}{'seconds':>10}{'speedup':>9}{'min cos':>10}{'mean cos':>10}{'score delta':>13}")
+    print(f"{'torch':<12}{reference_seconds:>10.4f}{1.0:>9.2f}{1.0:>10.4f}{1.0:>10.4f}{0.0:>13.4f}")
+    for row in results['backends']:
+        if 'error' in row:
+            continue
+        print(f"{row['backend']:<12}{row['seconds']:>10.4f}{row['speedup']:>9.2f}{row['min_cosine']:>10.4f}"
+              f"{row['mean_cosine']:>10.4f}{row['similarity_score_delta']:>+13.4f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Offline latency and throughput benchmark of the comparison entry points.
+
+    python benchmarks/pipeline_benchmark.py --pages 1,4,12 --runs 5 --json results.json
+    python benchmarks/pipeline_benchmark.py --baseline results.json --max-regression 0.25
+
+For each page count a pair of synthetic handwritten-looking PDFs is generated
+(seeded, so every run and every commit benchmarks the same documents) and all
+Mathpix and Vision traffic goes to benchmarks/stub_server.py. --fixtures FILE
+replays recorded provider responses; --record-fixtures FILE forwards the calls
+to the real APIs once (keys from .env) and saves their responses for offline runs.
+
+Measured separately, per page count:
+
+    compare_pdfs                    POST /compare through the Flask app (reports render on download)
+    compute_text_similarity         the two documents' OCR text
+    compute_handwriting_similarity  rasterization and Vision features of both PDFs
+    generate_report                 from the /compare result
+
+The OCR cache, embedding cache and corpus index are disabled, so every run does
+the full work. Exits with status 1 if a measurement fails or if a p95 is more
+than --max-regression slower than in --baseline.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import platform
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dotenv import load_dotenv
+from PIL import Image, ImageDraw, ImageFont
+from benchmarks.stub_server import UPSTREAM_URLS, load_fixtures, serve
+from config import Config
+
+FUNCTIONS = ['compare_pdfs', 'compute_text_similarity', 'compute_handwriting_similarity', 'generate_report']
+
+VOCABULARY = ['integral', 'derivative', 'limit', 'matrix', 'vector', 'function', 'proof', 'theorem', 'lemma',
+              'therefore', 'equation', 'solve', 'value', 'constant', 'series', 'converges', 'bounded', 'continuous',
+              'x', 'y', 'f(x)', '=', '+', '2', 'dx', 'n', 'k', 'sum', 'since', 'hence', 'let', 'assume']
+
+# US Letter at 100 dpi
+PAGE_SIZE = (850, 1100)
+PAGE_DPI = 100
+FIXED_DATE = time.gmtime(1704067200)  # 2024-01-01
+
+def synthetic_lines(rng, count):
+    return [' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(3, 9))) for _ in range(count)]
+
+def render_page(rng, lines):
+    """One page of jittered dark-grey lines on off-white paper"""
+    image = Image.new('L', PAGE_SIZE, color=rng.randint(235, 250))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=26)
+    y = 80
+    for line in lines:
+        x = 70 + rng.randint(-8, 8)
+        for word in line.split():
+            draw.text((x, y + rng.randint(-3, 3)), word, fill=rng.randint(20, 70), font=font)
+            x += int(draw.textlength(word, font=font)) + rng.randint(10, 22)
+        y += 42 + rng.randint(-4, 4)
+    return image
+
+def write_pdf_pair(folder, pages, seed=0):
+    """
+    Two PDFs of the given page count; the second reuses about 70% of the first's lines.
+
+    Returns their paths.
+    """
+    rng = random.Random(f'{seed}-{pages}')
+    paths = []
+    first_lines = []
+    for document in range(2):
+        images = []
+        for page in range(pages):
+            if document == 0:
+                lines = synthetic_lines(rng, 20)
+                first_lines.append(lines)
+            else:
+                lines = [line if rng.random() < 0.7 else synthetic_lines(rng, 1)[0] for line in first_lines[page]]
+            images.append(render_page(rng, lines))
+        path = os.path.join(folder, f'synthetic_{pages}p_{document + 1}.pdf')
+        # Fixed dates keep the files byte-identical, so recorded Mathpix PDF responses match
+        images[0].save(path, 'PDF', resolution=PAGE_DPI, save_all=True, append_images=images[1:],
+                       creationDate=FIXED_DATE, modDate=FIXED_DATE)
+        for image in images:
+            image.close()
+        paths.append(path)
+    return paths
+
+def configure(url, text_mode, folder):
+    """Point the provider clients at the stub and turn off everything that would carry over between runs"""
+    Config.REPORT_FOLDER = os.path.join(folder, 'reports')
+    Config.MATHPIX_API_URL = url
+    Config.VISION_API_URL = url
+    Config.MATHPIX_PDF_POLL_INTERVAL = 0.01
+    Config.TEXT_OCR_BACKENDS = 'mathpix'
+    Config.HANDWRITING_OCR_BACKENDS = 'vision'
+    Config.OCR_CACHE_ENABLED = False
+    Config.EMBEDDING_CACHE_ENABLED = False
+    Config.EMBEDDING_INDEX_ENABLED = False
+    Config.PRELOAD_EMBEDDING_MODEL = False
+    if text_mode:
+        Config.TEXT_SIMILARITY_MODE = text_mode
+    for name in ('MATHPIX_APP_ID', 'MATHPIX_APP_KEY', 'GOOGLE_CLOUD_API_KEY'):
+        os.environ.setdefault(name, 'stub')
+
+def remove_report(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+class Workload:
+    """The inputs of every measured function for one pair of synthetic PDFs"""
+
+    def __init__(self, client, paths, text_mode):
+        from app.utils.document_loader import load_document
+        from app.utils.ocr_backends import extract_text
+
+        self.client = client
+        self.paths = paths
+        self.text_mode = text_mode
+        self.pdf_bytes = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.pdf_bytes.append(f.read())
+        self.texts = []
+        for path in paths:
+            document = load_document(path)
+            try:
+                self.texts.append(str(extract_text(path, document, bypass_cache=True)))
+            finally:
+                document.close()
+        self.result = self.compare_pdfs()
+
+    def compare_pdfs(self):
+        data = {
+            'file1': (io.BytesIO(self.pdf_bytes[0]), os.path.basename(self.paths[0])),
+            'file2': (io.BytesIO(self.pdf_bytes[1]), os.path.basename(self.paths[1])),
+            'bypass_cache': 'true'
+        }
+        if self.text_mode:
+            data['text_mode'] = self.text_mode
+        response = self.client.post('/compare', data=data, content_type='multipart/form-data')
+        result = response.get_json()
+        if response.status_code != 200:
+            raise RuntimeError(f"/compare returned {response.status_code}: {result.get('error')}")
+        return result
+
+    def compute_text_similarity(self):
+        from app.similarity.text_similarity import compute_text_similarity
+        return compute_text_similarity(*self.texts)
+
+    def compute_handwriting_similarity(self):
+        from app.similarity.handwriting_similarity import compute_handwriting_similarity
+        return compute_handwriting_similarity(*self.paths, bypass_cache=True)
+
+    def generate_report(self):
+        from app.utils.report_generator import generate_report
+
+        result = self.result
+        remove_report(generate_report(
+            result['text_similarity'], result['handwriting_similarity'], result['similarity_index'],
+            self.texts[0], self.texts[1], result['feature_scores'],
+            result['anomalies']['document1'], result['anomalies']['document2'],
+            result['variations']['document1'], result['variations']['document2']
+        ))
+
+def measure(func, runs, warmup):
+    """Per-run seconds of func after warmup untimed calls"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def summarize(samples, pages):
+    total = sum(samples)
+    return {
+        'runs': len(samples),
+        'p50_seconds': float(np.percentile(samples, 50)),
+        'p95_seconds': float(np.percentile(samples, 95)),
+        'mean_seconds': total / len(samples),
+        'calls_per_second': len(samples) / total if total else None,
+        'pages_per_second': len(samples) * pages / total if total else None
+    }
+
+def regressions(results, baseline, max_regression):
+    """(function, pages, p95, baseline p95) for every p95 more than max_regression slower than the baseline"""
+    slower = []
+    for function, by_pages in results.items():
+        for pages, row in by_pages.items():
+            previous = baseline.get('results', {}).get(function, {}).get(pages)
+            if not previous or 'p95_seconds' not in row or 'p95_seconds' not in previous:
+                continue
+            if row['p95_seconds'] > previous['p95_seconds'] * (1 + max_regression):
+                slower.append((function, pages, row['p95_seconds'], previous['p95_seconds']))
+    return slower
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', default='1,4,12', help='comma-separated page counts of the synthetic PDFs')
+    parser.add_argument('--runs', type=int, default=5, help='timed runs per function and page count')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs first (model loading, connections)')
+    parser.add_argument('--functions', default=','.join(FUNCTIONS), help='comma-separated subset to measure')
+    parser.add_argument('--text-mode', choices=['semantic', 'lexical', 'hybrid'],
+                        help='text similarity mode of compare_pdfs (default TEXT_SIMILARITY_MODE)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stub adds to every API request')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic documents')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--fixtures', help='replay provider responses recorded in this file')
+    group.add_argument('--record-fixtures', help='call the real APIs and save their responses to this file')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare p95 latencies against')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed p95 slowdown against --baseline, as a fraction')
+    args = parser.parse_args()
+
+    functions = [name.strip() for name in args.functions.split(',') if name.strip()]
+    unknown = sorted(set(functions) - set(FUNCTIONS))
+    if unknown:
+        parser.error(f"unknown functions: {', '.join(unknown)}")
+    page_counts = [int(pages) for pages in args.pages.split(',')]
+
+    if args.record_fixtures:
+        # Real credentials are needed to record; they only pass through the stub
+        load_dotenv()
+    server, url = serve(latency=args.latency, fixtures=load_fixtures(args.fixtures),
+                        upstream=UPSTREAM_URLS if args.record_fixtures else None)
+    folder = tempfile.mkdtemp(prefix='pipeline_benchmark_')
+    configure(url, args.text_mode, folder)
+
+    from app import create_app
+
+    client = create_app().test_client()
+    results = {name: {} for name in functions}
+    failed = False
+    try:
+        for pages in page_counts:
+            paths = write_pdf_pair(folder, pages, args.seed)
+            try:
+                workload = Workload(client, paths, args.text_mode)
+            except Exception as e:
+                print(f"{pages} pages: setup failed: {e}")
+                failed = True
+                for name in functions:
+                    results[name][str(pages)] = {'error': str(e)}
+                continue
+            for name in functions:
+                try:
+                    samples = measure(getattr(workload, name), args.runs, args.warmup)
+                    results[name][str(pages)] = summarize(samples, pages)
+                except Exception as e:
+                    results[name][str(pages)] = {'error': str(e)}
+                    failed = True
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+        server.shutdown()
+
+    stub_stats = dict(server.state.stats)
+    if args.record_fixtures:
+        server.state.save_fixtures(args.record_fixtures)
+        print(f"Saved {stub_stats['recorded']} recorded responses to {args.record_fixtures}")
+
+    print(f"{'function':<32}{'pages':>6}{'p50 s':>10}{'p95 s':>10}{'calls/s':>10}{'pages/s':>10}")
+    for name, by_pages in results.items():
+        for pages, row in by_pages.items():
+            if 'error' in row:
+                print(f"{name:<32}{pages:>6}  error: {row['error']}")
+                continue
+            print(f"{name:<32}{pages:>6}{row['p50_seconds']:>10.3f}{row['p95_seconds']:>10.3f}"
+                  f"{row['calls_per_second']:>10.2f}{row['pages_per_second']:>10.2f}")
+    if args.fixtures:
+        print(f"Fixtures: {stub_stats['fixture_hits']} responses replayed, {stub_stats['fixture_misses']} generated")
+
+    output = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {
+            'pages': page_counts, 'runs': args.runs, 'warmup': args.warmup, 'seed': args.seed,
+            'text_mode': Config.TEXT_SIMILARITY_MODE, 'stub_latency_seconds': args.latency,
+            'fixtures': args.fixtures, 'embedding_backend': Config.EMBEDDING_BACKEND
+        },
+        'results': results,
+        'stub': stub_stats
+    }
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.max_regression)
+        output['baseline'] = {'commit': baseline.get('commit'), 'regressions': [
+            {'function': name, 'pages': pages, 'p95_seconds': p95, 'baseline_p95_seconds': previous}
+            for name, pages, p95, previous in slower
+        ]}
+        for name, pages, p95, previous in slower:
+            print(f"REGRESSION {name} ({pages} pages): p95 {p95:.3f}s vs {previous:.3f}s "
+                  f"at {baseline.get('commit') or 'baseline'}")
+        failed = failed or bool(slower)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Compare page preprocessing settings: payload size, preprocessing time and, with
+--ocr, how stable the Mathpix text and Vision handwriting features stay.
+
+    python benchmarks/preprocessing_benchmark.py scan1.pdf scan2.pdf --ocr --json results.json
+
+Every setting is measured against the unprocessed page at RENDER_DPI (the
+'baseline' row). OCR calls bypass the cache, so --ocr uses real API quota.
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+import io
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from pdf2image import convert_from_path
+from app.utils.image_preprocessing import PreprocessingSettings, preprocess_image
+from config import Config
+
+SETTINGS = {
+    'gray-png': dict(grayscale=True, binarize=False, target_dpi=0, crop_margins=False, fmt='PNG'),
+    'gray-crop-png': dict(grayscale=True, binarize=False, target_dpi=0, crop_margins=True, fmt='PNG'),
+    'gray-crop-150-png': dict(grayscale=True, binarize=False, target_dpi=150, crop_margins=True, fmt='PNG'),
+    'binary-crop-png': dict(grayscale=True, binarize=True, target_dpi=0, crop_margins=True, fmt='PNG'),
+    'gray-crop-jpeg85': dict(grayscale=True, binarize=False, target_dpi=0, crop_margins=True, fmt='JPEG', jpeg_quality=85),
+    'gray-crop-150-jpeg70': dict(grayscale=True, binarize=False, target_dpi=150, crop_margins=True, fmt='JPEG', jpeg_quality=70),
+}
+
+class EncodedPages:
+    """Minimal stand-in for RenderedDocument so the production extractors can be reused"""
+
+    def __init__(self, file_path, pages, mime_type):
+        self.file_path = file_path
+        self.pages = pages
+        self.mime_type = mime_type
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def page_bytes(self, index):
+        return self.pages[index]
+
+def encode_baseline(image):
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+def page_summary(page_features):
+    """Average Vision confidence and paragraph count for one page"""
+    if page_features is None or len(page_features) == 0:
+        return 0.0, 0
+    return float(page_features['confidence'].mean()), len(page_features)
+
+def run_ocr(document, api_key):
+    from app.utils.pdf_processor import extract_page_text
+    from app.similarity.handwriting_similarity import extract_page_features
+
+    texts = [extract_page_text(document, i, bypass_cache=True) or '' for i in range(document.page_count)]
+    features = [extract_page_features(document, i, api_key, bypass_cache=True)
+                for i in range(document.page_count)]
+    return texts, features
+
+def benchmark(pdf_paths, ocr=False):
+    api_key = os.environ.get('GOOGLE_CLOUD_API_KEY')
+    results = {name: {'bytes': 0, 'seconds': 0.0, 'pages': 0, 'text_ratio': [], 'confidence_delta': [],
+                      'paragraph_delta': []}
+               for name in ['baseline'] + list(SETTINGS)}
+
+    for pdf_path in pdf_paths:
+        images = convert_from_path(pdf_path, dpi=Config.RENDER_DPI)
+        baseline_pages = [encode_baseline(image) for image in images]
+        results['baseline']['bytes'] += sum(len(page) for page in baseline_pages)
+        results['baseline']['pages'] += len(images)
+
+        baseline_ocr = None
+        if ocr:
+            baseline_ocr = run_ocr(EncodedPages(pdf_path, baseline_pages, 'image/png'), api_key)
+
+        for name, options in SETTINGS.items():
+            settings = PreprocessingSettings(**options)
+            start = time.perf_counter()
+            pages = [preprocess_image(image, Config.RENDER_DPI, settings) for image in images]
+            results[name]['seconds'] += time.perf_counter() - start
+            results[name]['bytes'] += sum(len(page) for page in pages)
+            results[name]['pages'] += len(pages)
+
+            if ocr:
+                mime_type = 'image/jpeg' if settings.format == 'JPEG' else 'image/png'
+                texts, features = run_ocr(EncodedPages(pdf_path, pages, mime_type), api_key)
+                for page, (text, page_features) in enumerate(zip(texts, features)):
+                    base_confidence, base_paragraphs = page_summary(baseline_ocr[1][page])
+                    confidence, paragraphs = page_summary(page_features)
+                    results[name]['text_ratio'].append(
+                        difflib.SequenceMatcher(None, baseline_ocr[0][page], text).ratio())
+                    results[name]['confidence_delta'].append(abs(confidence - base_confidence))
+                    results[name]['paragraph_delta'].append(abs(paragraphs - base_paragraphs))
+
+        for image in images:
+            image.close()
+
+    return results
+
+def summarize(results):
+    baseline_bytes = results['baseline']['bytes'] / max(results['baseline']['pages'], 1)
+    summary = {}
+    for name, result in results.items():
+        pages = max(result['pages'], 1)
+        bytes_per_page = result['bytes'] / pages
+        summary[name] = {
+            'bytes_per_page': round(bytes_per_page),
+            'base64_bytes_per_page': round(bytes_per_page * 4 / 3),
+            'size_vs_baseline': round(bytes_per_page / baseline_bytes, 3) if baseline_bytes else None,
+            'ms_per_page': round(result['seconds'] / pages * 1000, 1),
+        }
+        if result['text_ratio']:
+            summary[name]['mean_text_similarity'] = round(sum(result['text_ratio']) / len(result['text_ratio']), 4)
+            summary[name]['min_text_similarity'] = round(min(result['text_ratio']), 4)
+            summary[name]['mean_confidence_delta'] = round(
+                sum(result['confidence_delta']) / len(result['confidence_delta']), 4)
+            summary[name]['mean_paragraph_delta'] = round(
+                sum(result['paragraph_delta']) / len(result['paragraph_delta']), 2)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='+', help='PDF files to rasterize')
+    parser.add_argument('--ocr', action='store_true', help='also call Mathpix and Vision and compare against the baseline')
+    parser.add_argument('--json', help='write the summary to this file')
+    args = parser.parse_args()
+
+    load_dotenv()
+    summary = summarize(benchmark(args.pdfs, ocr=args.ocr))
+
+    columns = ['bytes_per_page', 'size_vs_baseline', 'ms_per_page', 'mean_text_similarity', 'mean_confidence_delta']
+    print(f"{'setting':<24}" + ''.join(f'{column:>24}' for column in columns))
+    for name, row in summary.items():
+        print(f'{name:<24}' + ''.join(f"{str(row.get(column, '-')):>24}" for column in columns))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+if __name__ == '__main__':
+    main()
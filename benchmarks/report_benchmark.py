@@ -0,0 +1,163 @@
+"""
+Compare render time and file size of the JSON, HTML and PDF report formats.
+
+    python benchmarks/report_benchmark.py --anomalies 10,100,500 --runs 5 --json results.json
+
+Each case renders a comparison report whose documents each have N handwriting
+anomalies and N page-to-page variations, plus a batch report of N documents.
+Inputs are seeded, so runs are comparable. Exits with status 1 if any format
+fails to render or if the median JSON or HTML render time of the largest case
+exceeds --budget seconds.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.utils.report_generator import generate_report, generate_batch_report, REPORT_FORMATS
+
+ANOMALY_METRICS = ['confidence', 'symbol_density', 'line_breaks']
+
+LABELS = {
+    'confidence': 'Confidence',
+    'symbol_density': 'Symbol density',
+    'line_breaks': 'Line spacing'
+}
+
+WORDS = ['similarity', 'handwriting', 'analysis', 'document', 'paragraph', 'equation', 'page', 'score',
+         'integral', 'derivative', 'matrix', 'vector', 'theorem', 'proof', 'lemma', 'function']
+
+def _text(rng, words=400):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def _anomalies(rng, count):
+    anomalies = []
+    for i in range(count):
+        anomaly = {}
+        for metric in rng.sample(ANOMALY_METRICS, rng.randint(1, len(ANOMALY_METRICS))):
+            anomaly[metric] = {'value': rng.random(), 'mean': rng.random(), 'deviation': 2 + 3 * rng.random()}
+        anomaly['paragraph_index'] = i % 20
+        anomaly['page_number'] = i // 20 + 1
+        anomalies.append(anomaly)
+    return anomalies
+
+def _variations(rng, count):
+    variations = []
+    for i in range(count):
+        changes = []
+        for metric in rng.sample(ANOMALY_METRICS, rng.randint(1, len(ANOMALY_METRICS))):
+            difference = 0.15 + rng.random()
+            changes.append({'type': metric, 'difference': difference,
+                            'description': f"{LABELS[metric]} changed by {difference * 100:.1f}%"})
+        variations.append({'from_page': i + 1, 'to_page': i + 2, 'changes': changes})
+    return variations
+
+def comparison_fields(count, seed=0):
+    """generate_report arguments with count anomalies and variations per document"""
+    rng = random.Random(seed)
+    return {
+        'text_similarity': rng.random(),
+        'handwriting_similarity': rng.random(),
+        'similarity_index': rng.random(),
+        'text1': _text(rng),
+        'text2': _text(rng),
+        'feature_scores': {metric: rng.random() for metric in ANOMALY_METRICS},
+        'anomalies1': _anomalies(rng, count),
+        'anomalies2': _anomalies(rng, count),
+        'variations1': _variations(rng, count),
+        'variations2': _variations(rng, count)
+    }
+
+def batch_fields(count, seed=0):
+    """generate_batch_report arguments for count documents and their most similar pairs"""
+    rng = random.Random(seed)
+    names = [f'document_{i:04d}.pdf' for i in range(count)]
+    documents = [{'name': name, 'pages': rng.randint(1, 12), 'anomaly_count': rng.randint(0, 50),
+                  'variation_count': rng.randint(0, 10)} for name in names]
+    pairs = []
+    for i in range(count):
+        text, handwriting = rng.random(), rng.random()
+        pairs.append({'document1': names[i], 'document2': names[(i + 1) % count], 'text_similarity': text,
+                      'handwriting_similarity': handwriting, 'similarity_index': (text + handwriting) / 2})
+    pairs.sort(key=lambda pair: pair['similarity_index'], reverse=True)
+    return {'documents': documents, 'pairs': pairs}
+
+def measure(render, fields, fmt, runs, folder):
+    """Median/min render seconds and output bytes of one format, or the error it raised"""
+    path = os.path.join(folder, f'report.{fmt}')
+    timings = []
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            render(**fields, output_path=path, fmt=fmt)
+            timings.append(time.perf_counter() - start)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    return {
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'bytes': os.path.getsize(path)
+    }
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--anomalies', default='10,100,500',
+                        help='comma-separated anomalies and variations per document (and batch documents)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help='maximum median JSON/HTML seconds for the largest case')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    counts = sorted(int(count) for count in args.anomalies.split(','))
+    cases = []
+    with tempfile.TemporaryDirectory() as folder:
+        for count in counts:
+            for kind, render, fields in (('comparison', generate_report, comparison_fields(count)),
+                                         ('batch', generate_batch_report, batch_fields(count))):
+                case = {'kind': kind, 'count': count, 'formats': {}}
+                for fmt in REPORT_FORMATS:
+                    case['formats'][fmt] = measure(render, fields, fmt, args.runs, folder)
+                cases.append(case)
+
+    print(f"{'report':<12}{'count':>7}  {'format':<7}{'median ms':>11}{'min ms':>10}{'KiB':>10}")
+    for case in cases:
+        for fmt, result in case['formats'].items():
+            if 'error' in result:
+                print(f"{case['kind']:<12}{case['count']:>7}  {fmt:<7}  error: {result['error']}")
+                continue
+            print(f"{case['kind']:<12}{case['count']:>7}  {fmt:<7}{result['median_seconds'] * 1000:>11.1f}"
+                  f"{result['min_seconds'] * 1000:>10.1f}{result['bytes'] / 1024:>10.1f}")
+
+    errors = [(case['kind'], case['count'], fmt) for case in cases
+              for fmt, result in case['formats'].items() if 'error' in result]
+    over_budget = [(case['kind'], case['count'], fmt) for case in cases if case['count'] == counts[-1]
+                   for fmt in ('json', 'html') if case['formats'][fmt].get('median_seconds', 0) > args.budget]
+    for kind, count, fmt in over_budget:
+        print(f"{kind} report with {count} entries: {fmt} exceeds the {args.budget:.3f}s budget")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': _commit(), 'runs': args.runs, 'budget_seconds': args.budget, 'cases': cases},
+                      f, indent=2)
+
+    if errors or over_budget:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
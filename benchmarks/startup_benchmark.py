@@ -0,0 +1,95 @@
+"""
+Measure how long `create_app()` takes in a fresh interpreter, and which modules dominate.
+
+    python benchmarks/startup_benchmark.py --runs 5 --budget 2.0
+
+Each run starts a new Python process (as a gunicorn worker boot would) with
+PRELOAD_EMBEDDING_MODEL=false, so only import and app setup cost is measured.
+Exits with status 1 if the median exceeds --budget seconds or if a module that
+should load lazily (torch, transformers, onnxruntime, sklearn, nltk) is imported at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must not be imported by create_app(); they load on first use
+LAZY_MODULES = ['torch', 'transformers', 'onnxruntime', 'sklearn', 'nltk']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'modules': sorted(sys.modules)}))
+"""
+
+def run_once(importtime=False):
+    env = dict(os.environ, PRELOAD_EMBEDDING_MODEL='false')
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', PROBE]
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    # create_app() may print; the probe's JSON is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+def slowest_imports(importtime_output, top=10):
+    """Modules with the largest cumulative import time from `python -X importtime` (nested entries overlap)"""
+    entries = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue  # header line
+        entries.append((parts[2].strip(), cumulative))
+    return sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=2.0, help='maximum median create_app() seconds')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    timings = []
+    modules = []
+    for _ in range(args.runs):
+        probe, _ = run_once()
+        timings.append(probe['seconds'])
+        modules = probe['modules']
+    _, importtime_output = run_once(importtime=True)
+
+    eager = [name for name in LAZY_MODULES if name in modules]
+    results = {
+        'runs': args.runs,
+        'median_seconds': statistics.median(timings),
+        'min_seconds': min(timings),
+        'max_seconds': max(timings),
+        'budget_seconds': args.budget,
+        'eagerly_imported': eager,
+        'slowest_imports_us': slowest_imports(importtime_output)
+    }
+
+    print(f"create_app(): median {results['median_seconds']:.3f}s "
+          f"(min {results['min_seconds']:.3f}s, max {results['max_seconds']:.3f}s, budget {args.budget:.3f}s)")
+    print("Slowest imports (cumulative, including nested imports):")
+    for package, microseconds in results['slowest_imports_us']:
+        print(f"  {package:<24}{microseconds / 1000:>10.1f} ms")
+    if eager:
+        print(f"Imported at startup but should be lazy: {', '.join(eager)}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if eager or results['median_seconds'] > args.budget:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Local stand-in for the Mathpix and Google Vision endpoints the app calls.
+
+    python benchmarks/stub_server.py --port 8765 --latency 0.2
+    MATHPIX_API_URL=http://127.0.0.1:8765 VISION_API_URL=http://127.0.0.1:8765 python run.py
+
+Responses are deterministic functions of the uploaded bytes, so repeated runs
+produce the same text and handwriting features. Request counts are available at
+GET /stats and reset with POST /stats/reset.
+
+Recorded responses can be replayed instead: --fixtures FILE serves the stored
+response for every image or PDF whose SHA-256 it contains, and generates the
+rest. --record FILE --upstream forwards every request to the real APIs (the
+app's own credentials pass through) and saves their responses to FILE on exit.
+"""
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+import requests
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+UPSTREAM_URLS = {'mathpix': 'https://api.mathpix.com', 'vision': 'https://vision.googleapis.com'}
+
+# Request headers passed through to the real APIs when recording
+FORWARDED_HEADERS = ('app_id', 'app_key', 'Content-Type')
+
+# Recorded responses by kind, each keyed by the SHA-256 of the uploaded image or PDF
+FIXTURE_KINDS = ('mathpix_text', 'mathpix_pdf', 'vision')
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'sigma', 'theta', 'omega', 'lambda', 'kappa', 'zeta']
+
+def _digest(data):
+    return hashlib.sha256(data).digest()
+
+def load_fixtures(path):
+    """Recorded responses from a fixture file, or empty tables if it does not exist yet"""
+    fixtures = {kind: {} for kind in FIXTURE_KINDS}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for kind, responses in json.load(f).items():
+                fixtures.setdefault(kind, {}).update(responses)
+    return fixtures
+
+def stub_text(data, lines=8):
+    """Deterministic text for an image or PDF"""
+    digest = _digest(data)
+    return '\n'.join(
+        ' '.join(WORDS[(digest[(line * 5 + word) % len(digest)] + word) % len(WORDS)] for word in range(6))
+        for line in range(lines)
+    )
+
+def stub_annotation(data):
+    """Deterministic Vision fullTextAnnotation with a few paragraphs of words and symbols"""
+    digest = _digest(data)
+    paragraphs = []
+    for p in range(3):
+        words = []
+        for w in range(4):
+            text = WORDS[digest[p * 4 + w] % len(WORDS)]
+            symbols = [{'text': c, 'confidence': 0.8 + digest[(p + w + i) % 32] / 1280} for i, c in enumerate(text)]
+            symbols[-1]['property'] = {'detectedBreak': {'type': 'SPACE'}}
+            words.append({'symbols': symbols})
+        words[-1]['symbols'].append({'text': '.', 'confidence': 0.9})
+        paragraphs.append({'confidence': 0.75 + digest[p] / 1024, 'words': words})
+    return {
+        'fullTextAnnotation': {
+            'text': stub_text(data, 3),
+            'pages': [{'blocks': [{'paragraphs': paragraphs}]}]
+        }
+    }
+
+class StubState:
+    def __init__(self, latency=0.0, pdf_polls=2, fixtures=None, upstream=None):
+        self.latency = latency
+        self.pdf_polls = pdf_polls
+        self.fixtures = fixtures or {kind: {} for kind in FIXTURE_KINDS}
+        self.upstream = upstream
+        self.lock = threading.Lock()
+        self.pdfs = {}
+        self.ids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'vision_requests': 0, 'vision_images': 0, 'mathpix_text_requests': 0,
+                          'mathpix_pdf_submissions': 0, 'mathpix_pdf_polls': 0, 'request_bytes': 0,
+                          'fixture_hits': 0, 'fixture_misses': 0, 'recorded': 0}
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    def replay(self, kind, data, generate):
+        """The recorded response for data if there is one, else generate(data)"""
+        with self.lock:
+            response = self.fixtures[kind].get(hashlib.sha256(data).hexdigest())
+        self.count('fixture_misses' if response is None else 'fixture_hits')
+        return generate(data) if response is None else response
+
+    def record(self, kind, data, response):
+        with self.lock:
+            self.fixtures[kind][hashlib.sha256(data).hexdigest()] = response
+        self.count('recorded')
+
+    def save_fixtures(self, path):
+        with self.lock:
+            data = json.dumps(self.fixtures, indent=1, sort_keys=True)
+        with open(path, 'w') as f:
+            f.write(data)
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, text):
+        body = text.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.state.count('request_bytes', len(body))
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        return body
+
+    def _forward(self, provider, method, body=None):
+        """Send this request to the real API; returns the requests.Response"""
+        headers = {name: self.headers[name] for name in FORWARDED_HEADERS if self.headers.get(name)}
+        return requests.request(method, self.state.upstream[provider] + self.path, data=body,
+                                headers=headers, timeout=120)
+
+    def _relay(self, response):
+        body = response.content
+        self.send_response(response.status_code)
+        self.send_header('Content-Type', response.headers.get('Content-Type', 'application/json'))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/stats':
+            with self.state.lock:
+                return self._send_json(dict(self.state.stats))
+        if path.startswith('/v3/pdf/'):
+            if self.state.latency:
+                time.sleep(self.state.latency)
+            pdf_id = path[len('/v3/pdf/'):]
+            if pdf_id.endswith('.mmd'):
+                pdf = self.state.pdfs.get(pdf_id[:-len('.mmd')])
+                if pdf is None:
+                    return self._send_json({'error': 'unknown pdf_id'}, 404)
+                if self.state.upstream:
+                    response = self._forward('mathpix', 'GET')
+                    if response.ok:
+                        self.state.record('mathpix_pdf', pdf['data'], response.text)
+                    return self._relay(response)
+                return self._send_text(self.state.replay('mathpix_pdf', pdf['data'], lambda data: stub_text(data, 20)))
+            pdf = self.state.pdfs.get(pdf_id)
+            if pdf is None:
+                return self._send_json({'error': 'unknown pdf_id'}, 404)
+            self.state.count('mathpix_pdf_polls')
+            if self.state.upstream:
+                return self._relay(self._forward('mathpix', 'GET'))
+            pdf['polls'] += 1
+            done = pdf['polls'] >= self.state.pdf_polls
+            return self._send_json({
+                'status': 'completed' if done else 'split',
+                'num_pages': 1,
+                'num_pages_completed': 1 if done else 0,
+                'percent_done': 100 if done else 0
+            })
+        self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        if path == '/stats/reset':
+            self.state.reset()
+            return self._send_json({})
+
+        if path == '/v1/images:annotate':
+            requests_ = json.loads(self._read_body()).get('requests', [])
+            if len(requests_) > 16:
+                return self._send_json({'error': {'code': 400, 'message': 'At most 16 images per request'}}, 400)
+            self.state.count('vision_requests')
+            self.state.count('vision_images', len(requests_))
+            images = [base64.b64decode(request['image']['content']) for request in requests_]
+            if self.state.upstream:
+                response = self._forward('vision', 'POST', json.dumps({'requests': requests_}))
+                if response.ok:
+                    for image, annotation in zip(images, response.json().get('responses', [])):
+                        self.state.record('vision', image, annotation)
+                return self._relay(response)
+            return self._send_json({'responses': [
+                self.state.replay('vision', image, stub_annotation) for image in images
+            ]})
+
+        if path == '/v3/text':
+            body = self._read_body()
+            data = json.loads(body)
+            self.state.count('mathpix_text_requests')
+            image = base64.b64decode(data['src'].split(',', 1)[1])
+            if self.state.upstream:
+                response = self._forward('mathpix', 'POST', body)
+                if response.ok:
+                    self.state.record('mathpix_text', image, response.json())
+                return self._relay(response)
+            return self._send_json(self.state.replay(
+                'mathpix_text', image, lambda data: {'text': stub_text(data), 'confidence': 0.99}))
+
+        if path == '/v3/pdf':
+            body = self._read_body()
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            parts = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                     for part in message.iter_parts()}
+            if 'file' not in parts:
+                return self._send_json({'error': 'file is required'}, 400)
+            self.state.count('mathpix_pdf_submissions')
+            if self.state.upstream:
+                response = self._forward('mathpix', 'POST', body)
+                if response.ok and 'pdf_id' in response.json():
+                    self.state.pdfs[response.json()['pdf_id']] = {'data': parts['file'], 'polls': 0}
+                return self._relay(response)
+            pdf_id = f'stub-{next(self.state.ids)}'
+            self.state.pdfs[pdf_id] = {'data': parts['file'], 'polls': 0}
+            return self._send_json({'pdf_id': pdf_id})
+
+        self._send_json({'error': 'not found'}, 404)
+
+def serve(port=0, latency=0.0, pdf_polls=2, fixtures=None, upstream=None):
+    """
+    Start the stub in a background thread; returns (server, base_url).
+
+    fixtures are recorded responses to replay (see load_fixtures); with upstream
+    ({'mathpix': url, 'vision': url}) requests are forwarded and recorded instead.
+    The stub's StubState is server.state. Call server.shutdown() to stop it.
+    """
+    state = StubState(latency, pdf_polls, fixtures, upstream)
+    handler = type('Handler', (StubHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API request')
+    parser.add_argument('--pdf-polls', type=int, default=2, help='status polls before a PDF is reported completed')
+    parser.add_argument('--fixtures', help='replay the responses recorded in this file')
+    parser.add_argument('--record', help='save the responses served to this file on exit (with --upstream, the real ones)')
+    parser.add_argument('--upstream', action='store_true', help='forward requests to the real Mathpix and Vision APIs')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures or args.record)
+    server, url = serve(args.port, args.latency, args.pdf_polls, fixtures,
+                        UPSTREAM_URLS if args.upstream else None)
+    print(f"Stub Mathpix/Vision server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        if args.record:
+            server.state.save_fixtures(args.record)
+            print(f"Saved {server.state.stats['recorded']} recorded responses to {args.record}")
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,110 @@
 import os
 from dotenv import load_dotenv
 
-# Add debug prints
-print("Current working directory:", os.getcwd())
-print("Loading .env file...")
 load_dotenv()
-print("Environment variables after loading .env:")
-print("MATHPIX_APP_ID:", os.getenv('MATHPIX_APP_ID'))
-print("MATHPIX_APP_KEY:", os.getenv('MATHPIX_APP_KEY')[:10] + "..." if os.getenv('MATHPIX_APP_KEY') else None)
-print("GOOGLE_CLOUD_API_KEY:", os.getenv('GOOGLE_CLOUD_API_KEY')[:10] + "..." if os.getenv('GOOGLE_CLOUD_API_KEY') else None)
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
-    UPLOAD_FOLDER = 'uploads'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()  # DEBUG also logs per-page OCR requests and cache hits
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
     # API Keys
     MATHPIX_APP_ID = os.environ.get('MATHPIX_APP_ID')
     MATHPIX_APP_KEY = os.environ.get('MATHPIX_APP_KEY')
-    GOOGLE_CLOUD_API_KEY = os.environ.get('GOOGLE_CLOUD_API_KEY')
\ No newline at end of file
+    GOOGLE_CLOUD_API_KEY = os.environ.get('GOOGLE_CLOUD_API_KEY')
+
+    # Embedding model (loaded once per process by app.similarity.model_registry)
+    EMBEDDING_MODEL_NAME = os.environ.get('EMBEDDING_MODEL_NAME', 'sentence-transformers/paraphrase-MiniLM-L3-v2')
+    EMBEDDING_DEVICE = os.environ.get('EMBEDDING_DEVICE', 'auto')  # 'auto', 'cpu', 'cuda', 'cuda:1', ...
+    PRELOAD_EMBEDDING_MODEL = os.environ.get('PRELOAD_EMBEDDING_MODEL', 'true').lower() == 'true'
+    EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')  # 'torch', 'torch-int8', 'onnx' or 'onnx-int8' (see app.similarity.embedding_backends)
+    EMBEDDING_ONNX_FOLDER = os.environ.get('EMBEDDING_ONNX_FOLDER', os.path.join('models', 'onnx'))  # exported graphs, per model name
+    EMBEDDING_THREADS = int(os.environ.get('EMBEDDING_THREADS', 0))  # intra-op threads per process; 0 splits the cores between WEB_CONCURRENCY workers
+    EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 32))  # max segments per forward pass
+    EMBEDDING_TOKEN_BUDGET = int(os.environ.get('EMBEDDING_TOKEN_BUDGET', 8192))  # max padded tokens per forward pass
+    SEGMENT_MIN_TOKENS = int(os.environ.get('SEGMENT_MIN_TOKENS', 16))  # shorter consecutive OCR lines are merged into one segment
+    SEGMENT_MAX_TOKENS = int(os.environ.get('SEGMENT_MAX_TOKENS', 128))  # longer lines are split into windows; capped by the tokenizer's limit
+    SIMILARITY_BLOCK_ELEMENTS = int(os.environ.get('SIMILARITY_BLOCK_ELEMENTS', 4 * 1024 * 1024))  # max cells of the line similarity matrix held at once
+
+    # Segment embedding cache (app.similarity.embedding_cache): per-process LRU in front of a shared SQLite file
+    EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join('cache', 'embedding_cache.sqlite3'))  # also the warm-start file
+    EMBEDDING_CACHE_MEMORY_BYTES = int(os.environ.get('EMBEDDING_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))  # per process
+    EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get('EMBEDDING_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # on disk
+
+    # Text similarity (app.similarity.lexical_similarity); requests can override the mode
+    TEXT_SIMILARITY_MODE = os.environ.get('TEXT_SIMILARITY_MODE', 'semantic')  # 'semantic', 'lexical' or 'hybrid'
+    LEXICAL_PREFILTER_THRESHOLD = float(os.environ.get('LEXICAL_PREFILTER_THRESHOLD', 0.2))  # hybrid: pairs below this TF-IDF cosine skip the embedding model
+
+    # OCR result cache (app.utils.ocr_cache), keyed by page image hash + request options
+    OCR_CACHE_ENABLED = os.environ.get('OCR_CACHE_ENABLED', 'true').lower() == 'true'
+    OCR_CACHE_PATH = os.environ.get('OCR_CACHE_PATH', os.path.join('cache', 'ocr_cache.sqlite3'))
+    OCR_CACHE_MAX_BYTES = int(os.environ.get('OCR_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    OCR_CACHE_MAX_AGE = int(os.environ.get('OCR_CACHE_MAX_AGE', 30 * 24 * 3600))  # seconds
+
+    # Page rasterization shared by the Mathpix and Vision extractors
+    RENDER_DPI = int(os.environ.get('RENDER_DPI', 200))
+    RENDER_FORMAT = os.environ.get('RENDER_FORMAT', 'PNG')  # PNG or JPEG
+    RENDER_CHUNK_PAGES = int(os.environ.get('RENDER_CHUNK_PAGES', 4))  # pages rasterized per poppler call
+    RENDER_MAX_CONCURRENT = int(os.environ.get('RENDER_MAX_CONCURRENT', 2))  # page ranges rasterized at once per process
+
+    # Page preprocessing before OCR (app.utils.image_preprocessing); see benchmarks/preprocessing_benchmark.py
+    PREPROCESS_ENABLED = os.environ.get('PREPROCESS_ENABLED', 'true').lower() == 'true'
+    PREPROCESS_GRAYSCALE = os.environ.get('PREPROCESS_GRAYSCALE', 'true').lower() == 'true'
+    PREPROCESS_BINARIZE = os.environ.get('PREPROCESS_BINARIZE', 'false').lower() == 'true'  # can lower Vision confidences
+    PREPROCESS_BINARIZE_THRESHOLD = int(os.environ.get('PREPROCESS_BINARIZE_THRESHOLD', 160))
+    PREPROCESS_TARGET_DPI = int(os.environ.get('PREPROCESS_TARGET_DPI', 0))  # 0 keeps RENDER_DPI
+    PREPROCESS_CROP_MARGINS = os.environ.get('PREPROCESS_CROP_MARGINS', 'true').lower() == 'true'
+    PREPROCESS_CROP_PADDING = int(os.environ.get('PREPROCESS_CROP_PADDING', 16))  # pixels kept around the ink
+    PREPROCESS_FORMAT = os.environ.get('PREPROCESS_FORMAT', 'PNG')  # PNG or JPEG
+    PREPROCESS_JPEG_QUALITY = int(os.environ.get('PREPROCESS_JPEG_QUALITY', 85))
+
+    # OCR HTTP clients (app.utils.http_client): pooled keep-alive sessions per provider
+    MATHPIX_CONCURRENCY = int(os.environ.get('MATHPIX_CONCURRENCY', 4))  # max in-flight page requests
+    VISION_CONCURRENCY = int(os.environ.get('VISION_CONCURRENCY', 8))
+    OCR_TIMEOUT = float(os.environ.get('OCR_TIMEOUT', 60))  # seconds per request
+    OCR_MAX_RETRIES = int(os.environ.get('OCR_MAX_RETRIES', 3))  # retries on 429/5xx and connection errors
+    OCR_RETRY_BACKOFF = float(os.environ.get('OCR_RETRY_BACKOFF', 0.5))  # exponential backoff factor in seconds
+
+    # OCR provider endpoints and request modes; point the URLs at benchmarks/stub_server.py to run offline
+    MATHPIX_API_URL = os.environ.get('MATHPIX_API_URL', 'https://api.mathpix.com').rstrip('/')
+    VISION_API_URL = os.environ.get('VISION_API_URL', 'https://vision.googleapis.com').rstrip('/')
+    MATHPIX_MODE = os.environ.get('MATHPIX_MODE', 'text')  # 'text': one /v3/text call per page, 'pdf': whole PDF via /v3/pdf
+    MATHPIX_PDF_POLL_INTERVAL = float(os.environ.get('MATHPIX_PDF_POLL_INTERVAL', 1.0))  # seconds
+    MATHPIX_PDF_TIMEOUT = float(os.environ.get('MATHPIX_PDF_TIMEOUT', 300))  # seconds before falling back to per-page calls
+    VISION_BATCH_SIZE = min(int(os.environ.get('VISION_BATCH_SIZE', 16)), 16)  # pages per images:annotate call; the API allows 16
+    VISION_BATCH_MAX_BYTES = int(os.environ.get('VISION_BATCH_MAX_BYTES', 9 * 1000 * 1000))  # JSON body bytes per call (base64 images); Vision rejects requests over 10 MB
+
+    # OCR backends (app.utils.ocr_backends), tried in order until one succeeds; requests can override them
+    TEXT_OCR_BACKENDS = os.environ.get('TEXT_OCR_BACKENDS', 'mathpix,tesseract')
+    HANDWRITING_OCR_BACKENDS = os.environ.get('HANDWRITING_OCR_BACKENDS', 'vision,tesseract')
+    LOCAL_OCR_WORKERS = int(os.environ.get('LOCAL_OCR_WORKERS', os.cpu_count() or 2))  # Tesseract worker processes
+    TESSERACT_CMD = os.environ.get('TESSERACT_CMD', 'tesseract')
+    TESSERACT_LANG = os.environ.get('TESSERACT_LANG', 'eng')
+    TESSERACT_PSM = int(os.environ.get('TESSERACT_PSM', 3))  # page segmentation mode
+
+    # Worker threads running comparison stages (render, OCR, embedding, handwriting) concurrently
+    PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', 8))
+
+    # Asynchronous comparison jobs (app.jobs)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # comparisons running at once per gunicorn worker
+    JOBS_FOLDER = os.environ.get('JOBS_FOLDER', 'jobs')  # shared status/result files
+    JOB_TTL = int(os.environ.get('JOB_TTL', 24 * 3600))  # seconds before finished jobs are removed
+
+    # Reports (app.utils.report_cache): rendered on first download, keyed by a hash of the results
+    REPORT_FOLDER = os.environ.get('REPORT_FOLDER', 'reports')
+    REPORT_FORMAT = os.environ.get('REPORT_FORMAT', 'json')  # 'json', 'html' or 'pdf': report_url format of API and batch results; requests can override it
+    REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # rendered reports are evicted first
+    REPORT_CACHE_MAX_AGE = int(os.environ.get('REPORT_CACHE_MAX_AGE', 7 * 24 * 3600))  # seconds unused before a report expires
+    REPORT_HTTP_MAX_AGE = int(os.environ.get('REPORT_HTTP_MAX_AGE', 24 * 3600))  # Cache-Control max-age of downloads
+
+    # Batch comparisons (/compare/batch)
+    BATCH_MAX_DOCUMENTS = int(os.environ.get('BATCH_MAX_DOCUMENTS', 60))  # files accepted per request
+
+    # Corpus embedding index (app.similarity.embedding_index) for /search
+    EMBEDDING_INDEX_ENABLED = os.environ.get('EMBEDDING_INDEX_ENABLED', 'true').lower() == 'true'  # index every processed document
+    EMBEDDING_INDEX_FOLDER = os.environ.get('EMBEDDING_INDEX_FOLDER', 'index')
+    EMBEDDING_INDEX_RERANK_CANDIDATES = int(os.environ.get('EMBEDDING_INDEX_RERANK_CANDIDATES', 50))  # documents re-scored line by line
+    EMBEDDING_INDEX_IVF_LISTS = int(os.environ.get('EMBEDDING_INDEX_IVF_LISTS', 64))  # 0 disables approximate search
+    EMBEDDING_INDEX_IVF_PROBES = int(os.environ.get('EMBEDDING_INDEX_IVF_PROBES', 8))
+    EMBEDDING_INDEX_IVF_MIN_DOCUMENTS = int(os.environ.get('EMBEDDING_INDEX_IVF_MIN_DOCUMENTS', 2000))  # exact search below this size
@@ -1,4 +1,6 @@
 #!/bin/bash
 export FLASK_APP=run.py
 export FLASK_ENV=production
-gunicorn --bind 0.0.0.0:${PORT:-5000} --workers 4 "app:create_app()" 
\ No newline at end of file
+# Also read by the app to split CPU threads for embedding inference between workers
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+gunicorn --bind 0.0.0.0:${PORT:-5000} --workers $WEB_CONCURRENCY --preload "app:create_app()" 
\ No newline at end of file
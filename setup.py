@@ -1,65 +1,81 @@
-import nltk
-import ssl
-import os
+import argparse
+import importlib.util
+import logging
 import sys
+from app.utils.nltk_setup import NLTK_DATA_DIR, NLTK_PACKAGES, ensure_nltk_packages
 
-def download_nltk_data():
-    """Download required NLTK data"""
-    try:
-        # Create nltk_data directory in project root
-        nltk_data_dir = os.path.join(os.path.dirname(__file__), 'nltk_data')
-        os.makedirs(nltk_data_dir, exist_ok=True)
-        
-        # Clear existing paths and set new one
-        nltk.data.path = [nltk_data_dir]
+def download_nltk_data(download=True):
+    """
+    Download required NLTK data into the project's nltk_data directory.
+
+    With download=False only checks what is already there, without network access.
+    Returns the list of packages that are still missing.
+    """
+    missing = ensure_nltk_packages(download=download)
+    for package in NLTK_PACKAGES:
+        status = 'missing' if package in missing else 'ok'
+        print(f"{package}: {status}")
+    return missing
+
+def optional_packages():
+    """(module, what uses it, whether the current configuration cannot run without it) per requirements-optional.txt"""
+    from config import Config
+
+    onnx_backend = Config.EMBEDDING_BACKEND.startswith('onnx')
+    return [
+        # Backends in the fallback order are skipped when their package is missing
+        ('pytesseract', 'tesseract OCR backend', False),
+        # Exporting is only required when the graph has not been exported yet
+        ('onnx', 'exporting the embedding model for the onnx backends', False),
+        ('onnxruntime', 'EMBEDDING_BACKEND=onnx and onnx-int8', onnx_backend)
+    ]
 
-        # Disable SSL verification if needed
-        try:
-            _create_unverified_https_context = ssl._create_unverified_context
-        except AttributeError:
-            pass
-        else:
-            ssl._create_default_https_context = _create_unverified_https_context
+def check_optional_packages():
+    """
+    Report which optional packages are installed, without importing them.
 
-        required_packages = [
-            'punkt',
-            'stopwords',
-            'wordnet',
-            'averaged_perceptron_tagger'
-        ]
-        
-        for package in required_packages:
-            try:
-                nltk.data.find(f'tokenizers/{package}')
-                print(f"Package {package} is already downloaded")
-            except LookupError:
-                print(f"Downloading {package}...")
-                nltk.download(package, download_dir=nltk_data_dir, quiet=True)
-                print(f"Successfully downloaded {package}")
+    Returns the missing ones the current configuration requires.
+    """
+    required_missing = []
+    for module, purpose, required in optional_packages():
+        installed = importlib.util.find_spec(module) is not None
+        status = 'ok' if installed else 'missing, required by the current configuration' if required else 'missing'
+        print(f"{module}: {status} ({purpose})")
+        if required and not installed:
+            required_missing.append(module)
+    return required_missing
 
-        # Verify downloads
-        for package in required_packages:
-            try:
-                if package == 'punkt':
-                    sent_tokenize("This is a test sentence.")
-                elif package == 'stopwords':
-                    stopwords.words('english')
-                elif package == 'wordnet':
-                    from nltk.corpus import wordnet
-                    wordnet.synsets('test')
-            except Exception as e:
-                print(f"Error verifying {package}: {str(e)}")
-                raise
+def export_embedding_model(backend):
+    """
+    Export the configured embedding model for an ONNX backend ('onnx' or 'onnx-int8').
 
+    Run once per deployment so workers never pay for the export on first load.
+    Returns True on success.
+    """
+    from app.similarity.embedding_backends import export_onnx
+    from config import Config
+
+    try:
+        path = export_onnx(Config.EMBEDDING_MODEL_NAME, quantized=backend == 'onnx-int8', force=True)
     except Exception as e:
-        print(f"Error during NLTK data download: {str(e)}")
-        print("\nTrying alternative download method...")
-        try:
-            for package in required_packages:
-                nltk.download(package)
-        except Exception as e2:
-            print(f"Alternative download failed: {str(e2)}")
-            sys.exit(1)
+        print(f"Error exporting {Config.EMBEDDING_MODEL_NAME}: {str(e)}")
+        return False
+    print(f"{backend}: {path}")
+    return True
 
 if __name__ == "__main__":
-    download_nltk_data() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=f"Prepare NLTK data in {NLTK_DATA_DIR}")
+    parser.add_argument('--check', action='store_true',
+                        help='only verify the data and optional packages are present (offline); '
+                             'exit with status 1 if something required is missing')
+    parser.add_argument('--export-onnx', nargs='?', const='onnx', choices=['onnx', 'onnx-int8'],
+                        help='also export the embedding model for EMBEDDING_BACKEND=onnx (default) or onnx-int8')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    failed = bool(download_nltk_data(download=not args.check))
+    failed = bool(check_optional_packages()) or failed
+    if args.export_onnx and not args.check:
+        failed = not export_embedding_model(args.export_onnx) or failed
+    if failed:
+        sys.exit(1)
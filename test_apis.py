@@ -1,8 +1,7 @@
 import os
+import sys
 from dotenv import load_dotenv
 import requests
-from google.cloud import vision
-from google.api_core import client_options
 import base64
 import io
 from PIL import Image, ImageDraw
@@ -140,7 +139,74 @@ def test_vision_api_key():
         print(f"❌ Error testing API key: {str(e)}")
         return False
 
+class _StubDocument:
+    """In-memory pages standing in for a RenderedDocument"""
+
+    def __init__(self, pages):
+        self.file_path = 'stub.pdf'
+        self.mime_type = 'image/png'
+        self.pages = pages
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def page_bytes(self, index):
+        return self.pages[index]
+
+def test_stub_providers(monkeypatch, tmp_path):
+    """Exercise Vision batching and Mathpix PDF mode against benchmarks/stub_server.py"""
+    from benchmarks.stub_server import serve
+    from config import Config
+    from app.similarity.handwriting_similarity import extract_handwriting_features
+    from app.utils.pdf_processor import extract_text_with_pdf_api
+
+    server, url = serve()
+    monkeypatch.setattr(Config, 'MATHPIX_API_URL', url)
+    monkeypatch.setattr(Config, 'VISION_API_URL', url)
+    monkeypatch.setattr(Config, 'MATHPIX_PDF_POLL_INTERVAL', 0.01)
+
+    images = []
+    for page in range(20):
+        img = Image.new('RGB', (200, 60), color='white')
+        ImageDraw.Draw(img).text((10, 20), f"Page {page}", fill='black')
+        images.append(img)
+    pages = []
+    for img in images:
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format='PNG')
+        pages.append(img_byte_arr.getvalue())
+    document = _StubDocument(pages)
+
+    try:
+        results = {}
+        requests_per_batch_size = {}
+        for batch_size in (1, 16):
+            monkeypatch.setattr(Config, 'VISION_BATCH_SIZE', batch_size)
+            requests.post(f'{url}/stats/reset')
+            results[batch_size] = extract_handwriting_features(document, 'stub-key', bypass_cache=True)
+            stats = requests.get(f'{url}/stats').json()
+            assert stats['vision_images'] == len(pages)
+            requests_per_batch_size[batch_size] = stats['vision_requests']
+        assert requests_per_batch_size == {1: 20, 16: 2}
+        assert results[16].page_count == len(pages)
+        assert results[1].rows.tolist() == results[16].rows.tolist()
+
+        pdf_path = str(tmp_path / 'stub_test.pdf')
+        images[0].save(pdf_path, save_all=True, append_images=images[1:])
+        requests.post(f'{url}/stats/reset')
+        text = extract_text_with_pdf_api(pdf_path, bypass_cache=True)
+        stats = requests.get(f'{url}/stats').json()
+        assert text
+        assert stats['mathpix_pdf_submissions'] == 1
+        assert stats['mathpix_pdf_polls'] >= 1
+    finally:
+        server.shutdown()
+
 if __name__ == "__main__":
+    if '--stub' in sys.argv:
+        import pytest
+        sys.exit(pytest.main(['-q', f'{os.path.abspath(__file__)}::test_stub_providers']))
     print("Testing API Keys...")
     if test_vision_api_key():
         print("✅ Google Cloud Vision API key is valid!")
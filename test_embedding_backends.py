@@ -0,0 +1,65 @@
+"""
+Parity of the torch-int8 and ONNX embedding backends with float32 PyTorch.
+
+Runs offline on a small randomly initialized BERT saved to a temporary folder;
+benchmarks/embedding_parity.py does the same check on the real model. Skipped
+without torch/transformers, and the ONNX backends without onnx/onnxruntime.
+
+Run with: python -m pytest test_embedding_backends.py
+"""
+import numpy as np
+import pytest
+from config import Config
+from app.similarity.text_similarity import SemanticAnalyzer, normalize_embeddings
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+WORDS = ['light', 'energy', 'plants', 'leaves', 'carbon', 'sugar', 'oxygen', 'cells', 'green', 'water',
+         'the', 'a', 'of', 'into', 'is', 'and', 'make', 'use', 'from', 'air']
+
+# Lowest per-segment cosine to the float32 embeddings; int8 weights cost some precision
+MIN_COSINE = {'torch-int8': 0.98, 'onnx': 0.9999, 'onnx-int8': 0.98}
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    """A seeded two-layer BERT and its tokenizer, saved like a downloaded model"""
+    path = tmp_path_factory.mktemp('tiny-bert')
+    vocab = path / 'vocab.txt'
+    vocab.write_text('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + WORDS) + '\n')
+    transformers.BertTokenizerFast(str(vocab)).save_pretrained(str(path))
+
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=len(WORDS) + 5, hidden_size=64, num_hidden_layers=2,
+                                     num_attention_heads=4, intermediate_size=128, max_position_embeddings=64)
+    transformers.BertModel(config).eval().save_pretrained(str(path))
+    return str(path)
+
+@pytest.fixture
+def segments():
+    rng = np.random.default_rng(0)
+    return [' '.join(rng.choice(WORDS, size=rng.integers(2, 20))) for _ in range(24)]
+
+@pytest.mark.parametrize('backend', ['torch-int8', 'onnx', 'onnx-int8'])
+def test_backend_matches_float32_torch(backend, model_path, segments, tmp_path, monkeypatch):
+    if backend.startswith('onnx'):
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+    monkeypatch.setattr(Config, 'EMBEDDING_ONNX_FOLDER', str(tmp_path))
+
+    reference = SemanticAnalyzer(model_name=model_path, device='cpu', backend='torch')
+    analyzer = SemanticAnalyzer(model_name=model_path, device='cpu', backend=backend)
+    expected = reference.encode(segments)
+    embeddings = analyzer.encode(segments)
+
+    assert embeddings.shape == expected.shape
+    cosines = np.einsum('ij,ij->i', normalize_embeddings(embeddings), normalize_embeddings(expected))
+    assert cosines.min() >= MIN_COSINE[backend]
+
+    # Each embedding turned by at most theta moves every cosine, and so the document score
+    # /compare reports, by at most 2 * theta
+    split = len(segments) // 2
+    expected_score = reference.compute_semantic_similarity(expected[:split], expected[split:])
+    score = analyzer.compute_semantic_similarity(embeddings[:split], embeddings[split:])
+    theta = np.arccos(np.clip(cosines.min(), -1, 1))
+    assert abs(score - expected_score) <= 2 * theta + 1e-5
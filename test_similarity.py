@@ -0,0 +1,201 @@
+"""
+Equivalence checks of the vectorized similarity code against straightforward reference loops.
+
+Run with: python -m pytest test_similarity.py
+"""
+import random
+import numpy as np
+import pytest
+from app.similarity.text_similarity import SemanticAnalyzer, max_cosine_similarity, pairwise_text_similarity
+from app.similarity.handwriting_similarity import (HandwritingFeatures, page_features_from_response,
+                                                   compare_handwriting_features, pairwise_handwriting_similarity,
+                                                   detect_internal_anomalies)
+
+def _cosine(a, b):
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+def _reference_semantic_similarity(embeddings1, embeddings2):
+    """The per-line loop compute_semantic_similarity replaced"""
+    return np.mean([max(_cosine(emb1, emb2) for emb2 in embeddings2) for emb1 in embeddings1])
+
+def _reference_inconsistencies(embeddings, threshold=0.05):
+    similarities = [_cosine(embeddings[i], embeddings[i + 1]) for i in range(len(embeddings) - 1)]
+    return [(i, similarity) for i, similarity in enumerate(similarities) if similarity < threshold]
+
+def _analyzer():
+    # The similarity methods don't use the model; skip loading it
+    return object.__new__(SemanticAnalyzer)
+
+def _embeddings(rng, rows, dimension=32):
+    return rng.standard_normal((rows, dimension)).astype(np.float32)
+
+@pytest.mark.parametrize('seed', range(5))
+def test_semantic_similarity_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    embeddings1 = _embeddings(rng, rng.integers(1, 40))
+    embeddings2 = _embeddings(rng, rng.integers(1, 40))
+    expected = _reference_semantic_similarity(embeddings1, embeddings2)
+    assert _analyzer().compute_semantic_similarity(embeddings1, embeddings2) == pytest.approx(expected, abs=1e-5)
+
+@pytest.mark.parametrize('max_block_elements', [1, 7, 64, 10 ** 6])
+def test_max_cosine_similarity_is_independent_of_block_size(max_block_elements):
+    rng = np.random.default_rng(0)
+    embeddings1 = _embeddings(rng, 23)
+    embeddings2 = _embeddings(rng, 11)
+    expected = [max(_cosine(emb1, emb2) for emb2 in embeddings2) for emb1 in embeddings1]
+    np.testing.assert_allclose(max_cosine_similarity(embeddings1, embeddings2, max_block_elements), expected,
+                               atol=1e-5)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_pairwise_text_similarity_matches_pairs(seed):
+    rng = np.random.default_rng(seed)
+    documents = [_embeddings(rng, rows) for rows in rng.integers(1, 20, size=5)]
+    matrix = pairwise_text_similarity(documents, max_block_elements=50)
+    for i, embeddings1 in enumerate(documents):
+        for j, embeddings2 in enumerate(documents):
+            assert matrix[i, j] == pytest.approx(_reference_semantic_similarity(embeddings1, embeddings2), abs=1e-5)
+
+def test_internal_consistency_matches_loop():
+    rng = np.random.default_rng(0)
+    # Few dimensions, so some adjacent lines fall below the threshold
+    embeddings = _embeddings(rng, 60, dimension=3)
+    segments = [f'line {i}' for i in range(len(embeddings))]
+    expected = _reference_inconsistencies(embeddings)
+    assert expected
+
+    found = _analyzer().analyze_internal_consistency(segments, embeddings)
+    assert [entry['segment_index'] for entry in found] == [i for i, _ in expected]
+    np.testing.assert_allclose([entry['similarity_score'] for entry in found],
+                               [similarity for _, similarity in expected], atol=1e-5)
+
+def _vision_response(rng, paragraphs):
+    """A fullTextAnnotation with random paragraphs, words and symbols"""
+    blocks = []
+    for _ in range(paragraphs):
+        words = []
+        for _ in range(rng.randint(1, 6)):
+            symbols = []
+            for _ in range(rng.randint(1, 5)):
+                symbol = {'text': rng.choice('abcxyz019.,;=+'), 'confidence': rng.random()}
+                if rng.random() < 0.3:
+                    symbol['property'] = {'detectedBreak': {'type': 'LINE_BREAK'}}
+                symbols.append(symbol)
+            words.append({'symbols': symbols})
+        blocks.append({'paragraphs': [{'confidence': rng.random(), 'words': words}]})
+    return {'fullTextAnnotation': {'pages': [{'blocks': blocks}]}}
+
+def _random_document(rng):
+    """Vision responses of a document whose pages may have no paragraphs (the first one included)"""
+    return [_vision_response(rng, rng.choice([0, 1, 2, 4, 8, 12])) for _ in range(rng.randint(1, 6))]
+
+def _reference_page_features(response):
+    """Paragraph feature dicts, as the list-of-dicts implementation built them"""
+    features = []
+    for page in response['fullTextAnnotation']['pages']:
+        for block in page['blocks']:
+            for paragraph in block['paragraphs']:
+                words = paragraph['words']
+                symbols = [symbol for word in words for symbol in word['symbols']]
+                features.append({
+                    'confidence': paragraph['confidence'],
+                    'word_count': len(words),
+                    'symbol_density': sum(1 for symbol in symbols if not symbol['text'].isalnum()) / len(words),
+                    'line_breaks': sum(1 for symbol in symbols
+                                       if symbol.get('property', {}).get('detectedBreak', {}).get('type')),
+                    'average_symbol_confidence': sum(symbol['confidence'] for symbol in symbols) / len(symbols)
+                })
+    return features
+
+def _reference_compare(features1, features2):
+    if not features1 or not features2 or not features1[0] or not features2[0]:
+        return 0.0, {}
+    flat1 = [f for page in features1 for f in page]
+    flat2 = [f for page in features2 for f in page]
+    similarities = [1 - abs(np.mean([f[metric] for f in flat1]) - np.mean([f[metric] for f in flat2]))
+                    for metric in ('confidence', 'symbol_density', 'line_breaks', 'average_symbol_confidence')]
+    feature_scores = dict(zip(['confidence_similarity', 'symbol_density_similarity', 'line_break_similarity',
+                               'average_confidence_similarity'],
+                              [float(np.clip(similarity, 0, 1)) for similarity in similarities]))
+    return float(np.clip(np.dot([0.3, 0.3, 0.2, 0.2], similarities), 0, 1)), feature_scores
+
+def _reference_anomalies(features):
+    metrics = ('confidence', 'symbol_density', 'line_breaks')
+    labels = {'confidence': 'Confidence', 'symbol_density': 'Symbol density', 'line_breaks': 'Line spacing'}
+    anomalies = []
+    pages = []
+    for page_num, page_features in enumerate(features):
+        if not page_features:
+            continue
+        stats = {metric: (np.mean([f[metric] for f in page_features]), np.std([f[metric] for f in page_features]))
+                 for metric in metrics}
+        pages.append({'page_number': page_num + 1, **{metric: stats[metric][0] for metric in metrics}})
+        for i, feature in enumerate(page_features):
+            anomaly = {}
+            for metric in metrics:
+                mean, std = stats[metric]
+                if abs(feature[metric] - mean) > 2.0 * std:
+                    anomaly[metric] = {'value': feature[metric], 'mean': mean,
+                                       'deviation': abs(feature[metric] - mean) / std}
+            if anomaly:
+                anomaly['paragraph_index'] = i
+                anomaly['page_number'] = page_num + 1
+                anomalies.append(anomaly)
+
+    variations = []
+    for previous, current in zip(pages, pages[1:]):
+        changes = []
+        for metric in metrics:
+            change = abs(current[metric] - previous[metric])
+            if change > 0.15:
+                changes.append({'type': metric, 'difference': change,
+                                'description': f"{labels[metric]} changed by {(change * 100):.1f}%"})
+        if changes:
+            variations.append({'from_page': previous['page_number'], 'to_page': current['page_number'],
+                               'changes': changes})
+    return anomalies, variations if len(pages) > 1 else []
+
+def _features(document):
+    """(columnar HandwritingFeatures, reference per-page dict lists) of one document's responses"""
+    return (HandwritingFeatures.from_pages([page_features_from_response(response) for response in document]),
+            [_reference_page_features(response) for response in document])
+
+def _assert_close(actual, expected):
+    """Nested dicts, lists and tuples equal, with float tolerance"""
+    if isinstance(expected, dict):
+        assert set(actual) == set(expected)
+        for key in expected:
+            if key == 'description':
+                # Summation order can flip the rounding of the printed percentage; 'difference' is checked instead
+                assert actual[key].split(' changed by')[0] == expected[key].split(' changed by')[0]
+                continue
+            _assert_close(actual[key], expected[key])
+    elif isinstance(expected, (list, tuple)):
+        assert len(actual) == len(expected)
+        for actual_item, expected_item in zip(actual, expected):
+            _assert_close(actual_item, expected_item)
+    elif isinstance(expected, str):
+        assert actual == expected
+    else:
+        assert actual == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+@pytest.mark.parametrize('seed', range(20))
+def test_handwriting_statistics_match_per_row_code(seed):
+    rng = random.Random(seed)
+    columnar1, reference1 = _features(_random_document(rng))
+    columnar2, reference2 = _features(_random_document(rng))
+
+    for columnar, reference in ((columnar1, reference1), (columnar2, reference2)):
+        assert columnar.page_sizes().tolist() == [len(page) for page in reference]
+        for metric in ('confidence', 'word_count', 'symbol_density', 'line_breaks', 'average_symbol_confidence'):
+            assert columnar.rows[metric].tolist() == pytest.approx([f[metric] for page in reference for f in page])
+        _assert_close(detect_internal_anomalies(columnar), _reference_anomalies(reference))
+
+    _assert_close(compare_handwriting_features(columnar1, columnar2), _reference_compare(reference1, reference2))
+
+def test_pairwise_handwriting_similarity_matches_pairs():
+    rng = random.Random(0)
+    documents = [_features(_random_document(rng)) for _ in range(8)]
+    matrix = pairwise_handwriting_similarity([columnar for columnar, _ in documents])
+    for i, (_, reference1) in enumerate(documents):
+        for j, (_, reference2) in enumerate(documents):
+            assert matrix[i, j] == pytest.approx(_reference_compare(reference1, reference2)[0], abs=1e-12)